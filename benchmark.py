@@ -0,0 +1,277 @@
+import argparse, contextlib, io, json, os, platform, random, shutil, subprocess, sys, tempfile, time, tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+
+# Benchmarks of the app's hot paths on a generated data tree, results are printed as JSON.
+#   python benchmark.py --accounts 10000 --transactions 1000000 --output results.json
+# Run it on two revisions with the same arguments and compare the JSON files.
+
+repository_folder = Path(__file__).resolve().parent
+
+argument_parser = argparse.ArgumentParser(description="Basic Savings App benchmarks")
+argument_parser.add_argument("--accounts", type=int, default=10_000, help="Accounts in the generated data tree (default 10000).")
+argument_parser.add_argument("--transactions", type=int, default=1_000_000, help="Transactions in the generated data tree (default 1000000).")
+argument_parser.add_argument("--operations", type=int, default=10_000, help="Operations timed by each benchmark (default 10000).")
+argument_parser.add_argument("--seed", type=int, default=2025, help="Seed of the data generator and the operations (default 2025).")
+argument_parser.add_argument("--backend", default="json", help="Storage backend to benchmark, json or sqlite (default json).")
+argument_parser.add_argument("--output", metavar="FILE", help="Write the JSON results into FILE instead of stdout.")
+argument_parser.add_argument("--keep", action="store_true", help="Keep the generated data tree instead of deleting it.")
+argument_parser.add_argument("--no-tracemalloc", action="store_true", help="Don't trace peak memory, tracing makes every benchmark slower.")
+
+class SyntheticLedger():
+
+    # Names are built from these, so every generated tree with the same seed is the same
+    first_names: list[str] = ["Ada", "Ben", "Chai", "Dao", "Emi", "Fon", "Gus", "Hana", "Ivan", "June", "Kit", "Lek"]
+    last_names: list[str] = ["Savings", "Travel", "Rent", "Food", "Fun", "Bills", "Emergency", "House"]
+
+    # Accounts written together, small enough for their journals to stay open
+    block_size: int = 32
+
+    # History starts on 2025-01-01 and covers one year
+    start_timestamp: float = 1735689600.0
+    history_seconds: float = 365 * 24 * 60 * 60
+
+    # Initialise a generator of accounts and transactions.
+    def __init__(self, accounts: int, transactions: int, seed: int) -> None:
+        self.accounts: int = accounts
+        self.transactions: int = transactions
+        self.random: random.Random = random.Random(seed)
+
+    def account_name(self, number: int) -> str:
+        return f"{self.first_names[number % len(self.first_names)]} {self.last_names[number // len(self.first_names) % len(self.last_names)]} {number}"
+
+    # Transaction the write path understands, without going through Account
+    def transaction(self, account, transaction_type, amount: int, transferer, receiver, timestamp: float, transfer_id: str | None = None) -> SimpleNamespace:
+        return SimpleNamespace(id=f"{self.random.getrandbits(32):08x}", timestamp=timestamp, account=account,
+                               transaction_type=transaction_type, amount=amount, transferer=transferer,
+                               receiver=receiver, transfer_id=transfer_id, new_balance=account.balance, category=None,
+                               posted=timestamp, description=None)
+
+    # Write the accounts and their history into the data folder, returns the amount of records written
+    def generate(self) -> int:
+        from modules.account import Account
+        from modules.data_handler import DataHandler
+        from modules.transaction_types import TransactionTypes
+
+        DataHandler.begin_deferred()
+        registry, records = {}, 0
+        for block_start in range(0, self.accounts, self.block_size):
+            block = []
+            for number in range(block_start + 1, min(block_start + self.block_size, self.accounts) + 1):
+                account = Account.from_profile(DataHandler.create_account(f"account{number}", self.account_name(number), 0))
+                registry[account.id] = {"name": account.name, "profile_path": str(account.profile_path)}
+                block.append(account)
+
+            # The block gets its share of the transactions, spread over the year
+            count = self.transactions * len(block) // self.accounts
+            step = self.history_seconds / max(count, 1)
+            timestamp = self.start_timestamp
+            written = 0
+            while written < count:
+                timestamp += step
+                account = self.random.choice(block)
+                amount = self.random.randint(100, 50_000)
+                kind = self.random.random()
+                if kind < 0.25 and len(block) > 1 and account.balance >= amount and written + 2 <= count:
+                    target = self.random.choice([other for other in block if other is not account])
+                    transfer_id = f"{self.random.getrandbits(32):08x}"
+                    account.balance -= amount
+                    target.balance += amount
+                    DataHandler.write_transfer([
+                        self.transaction(account, TransactionTypes.TRANSFER, amount, account, target, timestamp, transfer_id),
+                        self.transaction(target, TransactionTypes.RECEIVE, amount, account, target, timestamp, transfer_id)
+                    ])
+                    written += 2
+                elif kind < 0.55 and account.balance >= amount:
+                    account.balance -= amount
+                    DataHandler.write_transaction(account, self.transaction(account, TransactionTypes.WITHDRAW, amount, account, account, timestamp))
+                    written += 1
+                else:
+                    account.balance += amount
+                    DataHandler.write_transaction(account, self.transaction(account, TransactionTypes.DEPOSIT, amount, account, account, timestamp))
+                    written += 1
+
+            for account in block:
+                DataHandler.update_account_profile(account)
+            DataHandler.flush()
+            records += written
+
+        DataHandler.update_accounts_list({"accounts": registry, "account_id_counter": self.accounts + 1})
+        DataHandler.end_deferred()
+        return records
+
+class Benchmark():
+
+    # Initialise the benchmarks, traced ones also record the peak of memory allocated by Python.
+    def __init__(self, operations: int, seed: int, trace_memory: bool = True) -> None:
+        self.operations: int = operations
+        self.random: random.Random = random.Random(seed)
+        self.trace_memory: bool = trace_memory
+        self.results: list[dict] = []
+
+    # Bytes this process handed to write() so far, only Linux keeps count
+    @staticmethod
+    def bytes_written() -> int | None:
+        try:
+            with open("/proc/self/io", "r") as file:
+                for line in file:
+                    if line.startswith("wchar:"):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        return None
+
+    # Time a function doing the given amount of operations, persisting whatever it changed is part of it
+    def measure(self, name: str, operations: int, function) -> dict:
+        from modules.account import Account
+        from modules.data_handler import DataHandler
+
+        print(f"Running {name} ({operations} operation(s))...", file=sys.stderr)
+        if self.trace_memory:
+            tracemalloc.start()
+        written = self.bytes_written()
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            function()
+            Account.flush_profiles()
+            DataHandler.flush()
+        elapsed = time.perf_counter() - started
+        after = self.bytes_written()
+        peak = None
+        if self.trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        result = {
+            "name": name,
+            "operations": operations,
+            "seconds": round(elapsed, 6),
+            "operations_per_second": round(operations / elapsed, 1) if elapsed > 0 else None,
+            "bytes_written": after - written if written is not None and after is not None else None,
+            "peak_memory_bytes": peak
+        }
+        self.results.append(result)
+        return result
+
+    # Run every benchmark on the data tree in the current folder
+    def run(self) -> list[dict]:
+        from modules.money import Money
+        from modules.account import Account
+        from modules.parser import Parser
+        from modules.executor import Executor
+        from modules.session import Session
+
+        operations = self.operations
+        self.measure("Account.load_accounts", 1, Account.load_accounts)
+        accounts = list(Account.accounts)
+
+        names = [self.random.choice(accounts).name for _ in range(operations)]
+        lookups = [name if index % 3 else name.upper() for index, name in enumerate(names)]
+        def find_accounts() -> None:
+            for name in lookups:
+                Account.find_account(name, True)
+        self.measure("Account.find_account", operations, find_accounts)
+
+        def create_accounts() -> None:
+            for number in range(operations):
+                Account.create_account(f"Benchmark {number}", 1_000)
+        self.measure("Account.create_account", operations, create_accounts)
+
+        picks = [(self.random.choice(accounts), self.random.choice(accounts), self.random.randint(1, 5_000)) for _ in range(operations)]
+        def deposit() -> None:
+            for account, _, amount in picks:
+                account.deposit(amount, True)
+        self.measure("Account.deposit", operations, deposit)
+
+        def withdraw() -> None:
+            for account, _, amount in picks:
+                account.withdraw(amount, True)
+        self.measure("Account.withdraw", operations, withdraw)
+
+        def transfer() -> None:
+            for account, target, amount in picks:
+                if account is not target:
+                    account.transfer(target, amount)
+        self.measure("Account.transfer", operations, transfer)
+
+        # A mix of the commands typed the most
+        commands = []
+        for account, target, amount in picks:
+            amount = Money.format(amount)
+            commands.extend([f"acc login {account.id}", f"t + {amount}", f"t - {amount}", f"t > {target.id} {amount}", "acc b"])
+        parser = Parser(session=Session())
+        def parse() -> None:
+            for command in commands:
+                parser.parse(command)
+        self.measure("Parser.parse", len(commands), parse)
+
+        listings = max(1, operations // 1_000)
+        def list_accounts() -> None:
+            for _ in range(listings):
+                Executor.execute_account_list()
+        self.measure("Executor.execute_account_list", listings, list_accounts)
+        return self.results
+
+# Git revision of this tree, so results of different revisions can be told apart
+def revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=repository_folder,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main() -> None:
+    arguments = argument_parser.parse_args()
+    output_path = Path(arguments.output).resolve() if arguments.output else None
+
+    # Everything happens in a fresh folder, the app keeps its data relative to the working directory
+    working_folder = os.getcwd()
+    folder = Path(tempfile.mkdtemp(prefix="savings-benchmark-"))
+    os.chdir(folder)
+    try:
+        from modules.account import Account
+        from modules.config import Config
+        from modules.data_handler import DataHandler
+        Config.set("storage_backend", arguments.backend)
+        DataHandler.initialise(folder / "data")
+
+        print(f"Generating {arguments.accounts} account(s) and {arguments.transactions} transaction(s) in {folder}...", file=sys.stderr)
+        written = Benchmark.bytes_written()
+        started = time.perf_counter()
+        records = SyntheticLedger(arguments.accounts, arguments.transactions, arguments.seed).generate()
+        generated = {
+            "accounts": arguments.accounts,
+            "transactions": records,
+            "seconds": round(time.perf_counter() - started, 6),
+            "bytes_written": Benchmark.bytes_written() - written if written is not None else None
+        }
+
+        results = {
+            "revision": revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "backend": arguments.backend,
+            "seed": arguments.seed,
+            "tracemalloc": not arguments.no_tracemalloc,
+            "generate": generated,
+            "benchmarks": Benchmark(arguments.operations, arguments.seed, not arguments.no_tracemalloc).run()
+        }
+        # Nothing may be left for the exit handlers to write once the folder is gone
+        Account.flush_profiles()
+        Account.checkpoint()
+        DataHandler.backend().close()
+    finally:
+        os.chdir(working_folder)
+        if arguments.keep:
+            print(f"Kept the data tree in {folder}.", file=sys.stderr)
+        else:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    text = json.dumps(results, indent=4)
+    if output_path:
+        output_path.write_text(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
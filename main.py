@@ -1,21 +1,113 @@
+import argparse, sys
 from modules.account import Account
 from modules.parser import Parser
+from modules.executor import Executor
+from modules.session import Session
+from modules.data_handler import DataHandler
+from modules.batch_runner import BatchRunner
+from modules.standing_orders import StandingOrders
+from modules.server import CommandServer
 from modules.ascii_decorator import AsciiDecorator as Text
 
-loaded_accounts = Account.load_accounts()
+argument_parser = argparse.ArgumentParser(description="Basic Savings App")
+argument_parser.add_argument("--data-root", metavar="FOLDER", help="Keep the data in FOLDER instead of the data_root setting (default ./data).")
+argument_parser.add_argument("-c", "--command", metavar="COMMAND", action="append", help="Run COMMAND (repeat for more, in order) and exit, only the accounts it uses are read.")
+argument_parser.add_argument("--batch", metavar="FILE", help="Run commands from FILE ('-' for stdin) and persist once at the end or at 'commit' lines.")
+argument_parser.add_argument("--serve", metavar="ADDRESS", nargs="?", const=f"{CommandServer.default_host}:{CommandServer.default_port}", help="Serve commands to many clients over HOST:PORT or unix:PATH (default 127.0.0.1:8765).")
+argument_parser.add_argument("--migrate-journal", action="store_true", help="Move one-file-per-transaction logs into the append-only journal and exit.")
+argument_parser.add_argument("--migrate-storage", metavar="BACKEND", help="Copy every account and transaction into another storage backend (json or sqlite) and exit.")
+argument_parser.add_argument("--export", metavar="ARGS", nargs=argparse.REMAINDER, help="Export accounts and history ('t export' arguments, e.g. '--export - --format csv') and exit.")
+argument_parser.add_argument("--audit", action="store_true", help="Recompute every balance from its transaction history, save a discrepancy report and exit.")
 
-print(f"{Text.BG_GREEN}{Text.WHITE}Welcome to Basic Savings App Version {Parser.program_version}.{Text.RESET}\nType help for list of commands.")
+# Audit workers import this file again, so the app only runs when started directly
+def main() -> None:
+    program_arguments = argument_parser.parse_args()
+    DataHandler.initialise(program_arguments.data_root)
 
-if len(Account.accounts) == 0:
-    print(f"{Text.YELLOW}Warning: There's no account in system.{Text.RESET}\nPlease create one using 'acc new [name] [<balance>]'")
-elif len(Account.accounts) >= 1:
-    Account.current_account = Account.accounts[0]
-    print(f"Loaded {len(Account.accounts)} account(s).")
-    print(f"Current Account: {Account.current_account.name}")
+    # Storage migration
+    if program_arguments.migrate_storage:
+        accounts, transactions = DataHandler.migrate_storage(program_arguments.migrate_storage)
+        print(f"{Text.GREEN}Copied {accounts} account(s) and {transactions} transaction(s) into the {program_arguments.migrate_storage} backend.{Text.RESET}")
+        print(f"Set \"storage_backend\": \"{program_arguments.migrate_storage}\" in config.json to use it.")
+        sys.exit(0)
 
-while True:
-    user_command = input(">_ ")
-    success, log = Parser.parse(user_command)
-    print(log)
-    if success and log.startswith("Stopping"):
-        break
+    loaded_accounts = Account.load_accounts()
+
+    # Export, the summary goes to stderr so stdout can feed a pipe
+    if program_arguments.export is not None:
+        success, log = Executor.execute_transaction_export(program_arguments.export)
+        print(log, file=sys.stderr)
+        sys.exit(0 if success else 1)
+
+    # Ledger audit
+    if program_arguments.audit:
+        success, log = Executor.execute_report_audit()
+        print(log)
+        sys.exit(0 if success else 1)
+
+    # Journal migration
+    if program_arguments.migrate_journal:
+        try:
+            migrated = DataHandler.migrate_transactions(Account.accounts)
+        except ValueError as error:
+            print(f"{Text.YELLOW}{error}{Text.RESET}")
+            sys.exit(1)
+        print(f"{Text.GREEN}Migrated {migrated} transaction file(s) into the journal.{Text.RESET}")
+        sys.exit(0)
+
+    # Standing orders that came due while the app wasn't running, the summary stays off stdout
+    ran = StandingOrders.describe(StandingOrders.run_due())
+    if ran:
+        print(ran, file=sys.stderr)
+
+    # One-shot commands, every log is printed and the writes are persisted once at the end
+    if program_arguments.command:
+        if len(Account.accounts) >= 1:
+            Session.current().current_account = Account.accounts[0]
+        parser, failed = Parser(), False
+        DataHandler.begin_deferred()
+        try:
+            for user_command in program_arguments.command:
+                success, log = parser.parse(user_command)
+                print(log)
+                failed = failed or not success
+        finally:
+            Account.flush_profiles()
+            DataHandler.end_deferred()
+        sys.exit(1 if failed else 0)
+
+    # Batch mode
+    if program_arguments.batch:
+        if len(Account.accounts) >= 1:
+            Session.current().current_account = Account.accounts[0]
+        success, log = BatchRunner.from_path(program_arguments.batch).run()
+        print(log)
+        sys.exit(0 if success else 1)
+
+    # Server mode
+    if program_arguments.serve:
+        CommandServer.from_address(program_arguments.serve).run()
+        sys.exit(0)
+
+    print(f"{Text.BG_GREEN}{Text.WHITE}Welcome to Basic Savings App Version {Parser.program_version}.{Text.RESET}\nType help for list of commands.")
+
+    if len(Account.accounts) == 0:
+        print(f"{Text.YELLOW}Warning: There's no account in system.{Text.RESET}\nPlease create one using 'acc new [name] [<balance>]'")
+    elif len(Account.accounts) >= 1:
+        Session.current().current_account = Account.accounts[0]
+        print(f"Loaded {len(Account.accounts)} account(s).")
+        print(f"Current Account: {Session.current().current_account.name}")
+
+    parser = Parser()
+    while True:
+        user_command = input(">_ ")
+        ran = StandingOrders.describe(StandingOrders.tick())
+        if ran:
+            print(ran)
+        success, log = parser.parse(user_command)
+        print(log)
+        if success and log.startswith("Stopping"):
+            break
+
+if __name__ == "__main__":
+    main()
@@ -1,158 +1,492 @@
+import atexit, contextvars, re, threading, time
+from contextlib import ExitStack
 from pathlib import Path    
 from typing import Optional
 
+from modules.money import Money
+from modules.report import Report
+from modules.budgets import Budgets
 from modules.transaction import Transaction
 from modules.data_handler import DataHandler
+from modules.instrumentation import Instrumentation
 from modules.transaction_types import TransactionTypes
 from modules.ascii_decorator import AsciiDecorator as Text
 
 class Account():
 
-    # Path Variables
-    _data_folder_path: Path = DataHandler.ensure_data_folder()
-    _accounts_file_path: Path = DataHandler.ensure_accounts_list()
-
     # Account Variables
     accounts : list[Account] = []
-    current_account: Account | None = None
-    _accounts_path : dict = {}
+    _registry_lock: threading.RLock = threading.RLock()
     _account_id_counter : int = 1
+    # Ids are looked up before names, so no name may look like one
+    _id_pattern: re.Pattern = re.compile(r"account\d+")
+
+    # Lookup Indexes
+    case_insensitive_names: bool = False
+    _accounts_by_id: dict[str, Account] = {}
+    _accounts_by_name: dict[str, Account] = {}
+    _accounts_by_folded_name: dict[str, Account] = {}
+
+    # Write-behind Variables (profiles are written in bursts instead of on every change)
+    flush_after_changes: int = 100
+    flush_interval_seconds: float = 5.0
+    _dirty_accounts: dict[str, Account] = {}
+    _pending_changes: int = 0
+    _last_flush: float = time.monotonic()
+    _flush_lock: threading.Lock = threading.Lock()
+    # Writes what is left once its time comes, even when no further change comes to trigger it
+    _flush_timer: threading.Timer | None = None
 
-    # Initialise an account.
-    def __init__(self, id : str, name: str, balance: float, folder_path: Path, profile_path: Path, transactions_folder_path: Path) -> None:
+    # Checkpoint Variables (every balance is saved together so startup only replays recent history)
+    checkpoint_after_changes: int = 1000
+    checkpoint_interval_seconds: float = 60.0
+    _changes_since_checkpoint: int = 0
+    _last_checkpoint: float = time.monotonic()
+    # Checkpoint found by load_accounts, accounts loaded without their balance replay from it
+    _loaded_checkpoint: dict | None = None
+
+    # Initialise an account, a balance of None is read from storage the first time it is used.
+    def __init__(self, id : str, name: str, balance: int | None, folder_path: Path, profile_path: Path, transactions_folder_path: Path) -> None:
         
         # Assign values
         self.id: str = id
         self.name: str = name
-        self.balance: float = balance
+        # Balance in cents
+        self._balance: int | None = balance
         self.folder_path: Path = folder_path
         self.profile_path: Path = profile_path
         self.transactions_folder_path: Path = transactions_folder_path
 
-        # Increase the counter
-        Account._account_id_counter += 1
+        # Serialises balance changes of this account between sessions
+        self.lock: threading.RLock = threading.RLock()
+
+    @classmethod # Alternative Constructor
+    def create_account(cls, name: Optional[str], balance: int = 0) -> Account:
+        with cls._registry_lock:
+            # Assign account profile
+            id: str = f"account{Account._account_id_counter}"
+            name = name or f"Account {Account._account_id_counter}"
+
+            # Names must stay unique, otherwise one account would shadow the other
+            if cls.name_taken(name):
+                raise ValueError(f"Account name {name} is already taken.")
+
+            # Create the account folder and profile through the storage backend
+            account = cls.from_profile(DataHandler.create_account(id, name, 0))
+
+            # Increase the counter
+            Account._account_id_counter += 1
 
-        # Append account to the accounts list
-        Account.accounts.append(self)
-        Account._accounts_path[self.id] = str(self.profile_path)
+            # Append account to the accounts list
+            cls._register(account)
 
-        # Update the accounts.json
-        accounts_json_data = {
-            "accounts": {k: str(v) for k, v in Account._accounts_path.items()},
-            "account_id_counter": Account._account_id_counter
-        }
-        DataHandler.update_accounts_list(accounts_json_data)
+            # Add it to the accounts list
+            DataHandler.add_to_accounts_list(account.id, {"name": account.name, "profile_path": str(account.profile_path)},
+                                             cls._account_id_counter)
+
+        # The opening balance is a deposit, so the history alone adds up to the balance
+        if balance and balance > 0:
+            account.deposit(balance, True)
+        return account
 
     @classmethod # Alternative Constructor
-    def create_account(cls, name: Optional[str], balance: float = 0) -> Account:
-        
-        # Assign account profile
-        id: str = f"account{Account._account_id_counter}"
-        name = name or f"Account {Account._account_id_counter}"
-        balance = balance or 0
+    def from_profile(cls, profile: dict) -> Account:
+        return cls(
+            profile["id"],
+            profile["name"],
+            Money.read(profile, "balance") if profile.get("balance_cents", 0) is not None else None,
+            profile["folder_path"],
+            profile["profile_path"],
+            profile["transactions_folder_path"]
+        )
 
-        # Create an account folder
-        folder_path = DataHandler.create_account_folder(id)
-        
-        # Create a transactions folder
-        transactions_folder_path = DataHandler.create_transactions_folder(folder_path)
-        
-        # Create a profile.json file
-        profile_path = DataHandler.create_account_profile(folder_path, id, name, balance, folder_path, transactions_folder_path)
+    # Balance Hydration
+
+    @property
+    def balance(self) -> int:
+        if self._balance is None:
+            self.hydrate()
+        return self._balance
+
+    @balance.setter
+    def balance(self, balance: int) -> None:
+        self._balance = balance
+
+    # Whether the balance has been read yet
+    @property
+    def hydrated(self) -> bool:
+        return self._balance is not None
+
+    # Read the balance from the stored profile and the history after the loaded checkpoint
+    def hydrate(self) -> None:
+        with self.lock:
+            if self._balance is not None:
+                return
+            balance = Money.read(DataHandler.read_account_profile(self), "balance")
+            balance = Account.replayed_balance(self, balance, Account._loaded_checkpoint)
+            self._balance = balance
 
-        return cls(id, name, balance, folder_path, profile_path, transactions_folder_path)
+    # Add an account to the in-memory registry
+    @classmethod
+    def _register(cls, account: Account) -> None:
+        cls.accounts.append(account)
+        cls._accounts_by_id[account.id] = account
+        cls._index_name(account)
+
+    # Remove an account from the in-memory registry
+    @classmethod
+    def _unregister(cls, account: Account) -> None:
+        cls.accounts.remove(account)
+        cls._accounts_by_id.pop(account.id, None)
+        cls._unindex_name(account)
+
+    # Name Indexes (older data may hold duplicated names, the first one loaded wins)
+
+    @classmethod
+    def _index_name(cls, account: Account) -> None:
+        cls._accounts_by_name.setdefault(account.name, account)
+        cls._accounts_by_folded_name.setdefault(account.name.casefold(), account)
+
+    @classmethod
+    def _unindex_name(cls, account: Account) -> None:
+        if cls._accounts_by_name.get(account.name) is account:
+            del cls._accounts_by_name[account.name]
+        if cls._accounts_by_folded_name.get(account.name.casefold()) is account:
+            del cls._accounts_by_folded_name[account.name.casefold()]
+
+    # Check if a name is already used by another account (or looks like its id)
+    @classmethod
+    def name_taken(cls, name: str) -> bool:
+        return name.casefold() in cls._accounts_by_folded_name or cls._id_pattern.fullmatch(name) is not None
+
+    # Change the account name and keep the name indexes up to date
+    def rename(self, name: str) -> None:
+        with Account._registry_lock:
+            # Checked under the lock, so two renames (or a rename and a create) can't both claim a name
+            if Account.name_taken(name) and Account._accounts_by_folded_name.get(name.casefold()) is not self:
+                raise ValueError(f"Account name {name} is already taken.")
+            Account._unindex_name(self)
+            self.name = name
+            Account._index_name(self)
+            # The accounts list holds names too, so accounts can be found without reading their profile
+            Account.save_accounts_list()
+        self.mark_dirty()
+
+    # Write the registry (names and profile paths) into accounts.json
+    @classmethod
+    def save_accounts_list(cls) -> None:
+        DataHandler.update_accounts_list({
+            "accounts": {account.id: {"name": account.name, "profile_path": str(account.profile_path)} for account in cls.accounts},
+            "account_id_counter": cls._account_id_counter
+        })
     
+    # Build the registry from disk. Accounts come from the accounts list alone, their profile is read
+    # the first time their balance is used, so a one-shot command only reads the accounts it touches.
     @classmethod
     def load_accounts(cls) -> Account | None:
         cls.accounts.clear()
+        cls._accounts_by_id.clear()
+        cls._accounts_by_name.clear()
+        cls._accounts_by_folded_name.clear()
+        cls._account_id_counter = 1
         accounts: dict = DataHandler.get_accounts_list()
 
+        # Finish transfers a crash left halfway before reading balances, then the columnar rows it lost
+        DataHandler.recover()
+        DataHandler.reconcile_columnar_store()
+
         if not accounts.get("accounts"): 
             return None
 
-        for _, profile_path in accounts["accounts"].items():
-            account_data = DataHandler.read_json(profile_path)
-            cls(
-                account_data["id"],
-                account_data["name"],
-                account_data["balance"],
-                account_data["folder_path"],
-                account_data["profile_path"],
-                account_data["transactions_folder_path"]
-            )
+        checkpoint = cls._loaded_checkpoint = DataHandler.latest_checkpoint()
+        highest_id = 0
+        for profile in DataHandler.read_account_index():
+            account = cls.from_profile(profile)
+            if account.hydrated:
+                account.balance = cls.replayed_balance(account, account.balance, checkpoint)
+            cls._register(account)
+            number = account.id.removeprefix("account")
+            if number.isdigit():
+                highest_id = max(highest_id, int(number))
+
+        # Never hand out an id that is already taken
+        cls._account_id_counter = max(accounts.get("account_id_counter", 1), highest_id + 1)
+
+        # Lists written before names were kept in them are upgraded once, so the next start reads no profile
+        if any(not isinstance(entry, dict) for entry in accounts["accounts"].values()):
+            cls.save_accounts_list()
+
+    # Balance of an account from the checkpoint and the transactions made after it. Profiles are written
+    # behind, so without a checkpoint (or outside of it) the stored balance is never trusted over the journal.
+    @staticmethod
+    def replayed_balance(account: Account, balance: int, checkpoint: dict | None) -> int:
+        checkpointed = checkpoint["balances"].get(account.id) if checkpoint is not None else None
+        if checkpointed is None:
+            # No checkpoint, or not in it (created after it, or never loaded while it was written), its last transaction knows the balance
+            record = DataHandler.last_transaction(account)
+            return Money.read(record, "new_balance") if record is not None else balance
+        balance, _, _ = DataHandler.replay_balance(account, checkpointed, checkpoint["timestamp"])
+        return balance
+
     @classmethod
-    def find_account(cls, account_name_or_id: str) -> Account | None:
-        for account in Account.accounts:
-            if account_name_or_id == account.name or account_name_or_id == account.id:
-                return account
-        return None
+    def find_account(cls, account_name_or_id: str, case_insensitive: bool | None = None) -> Account | None:
+        if case_insensitive is None:
+            case_insensitive = cls.case_insensitive_names
+        account = cls._accounts_by_id.get(account_name_or_id) or cls._accounts_by_name.get(account_name_or_id)
+        if account is None and case_insensitive:
+            account = cls._accounts_by_folded_name.get(account_name_or_id.casefold())
+        return account
 
     # Transaction Handling
-    def deposit(self, amount: float, loggable: bool) ->  tuple:
-        
-        # Condition Checking
-        if amount <= 0:
-            return False, f"{Text.YELLOW}Cannot deposit amount below or equal 0.{Text.RESET}"
+    def deposit(self, amount: int, loggable: bool, category: str | None = None,
+                posted: float | None = None, description: str | None = None) ->  tuple:
+        with self.lock:
+            # Condition Checking
+            if amount <= 0:
+                return False, f"{Text.YELLOW}Cannot deposit amount below or equal 0.{Text.RESET}"
+            try:
+                category = Budgets.category_for(TransactionTypes.DEPOSIT, category)
+            except ValueError as e:
+                return False, f"{Text.YELLOW}{e}{Text.RESET}"
 
-        self.balance += amount
+            self.balance += amount
 
-        # Create Transaction log
-        if loggable:
-            log = Transaction(self, TransactionTypes.DEPOSIT, amount, self, self)
-        else:
-            log = f"Deposited {amount} to {self}, now {self.balance}."
+            # Create Transaction log, budgets count it as it happens
+            warning = None
+            if loggable:
+                log = Transaction(self, TransactionTypes.DEPOSIT, amount, self, self, category=category,
+                                  posted=posted, description=description)
+                warning = Budgets.record(self, log)
+            else:
+                log = f"Deposited {Money.format(amount)} to {self}, now {Money.format(self.balance)}."
 
-        # Update Profile Json file
-        DataHandler.update_account_profile(self)
+            # Schedule Profile Json file update
+            self.mark_dirty()
         
-        return True, str(log)
+            return True, Account.with_warning(str(log), warning)
 
-    def withdraw(self, amount: float, loggable: bool) -> tuple:
-       
-        # Condition Checking
-        if amount <= 0:
-            return False, f"{Text.YELLOW}Cannot withdraw amount below or equal 0.{Text.RESET}"
-        if self.balance < amount:
-            return False, f"{Text.YELLOW}Insufficient fund in your account (Only: {self.balance}){Text.RESET}"
+    def withdraw(self, amount: int, loggable: bool, category: str | None = None,
+                 posted: float | None = None, description: str | None = None) -> tuple:
+        with self.lock:
+            # Condition Checking
+            if amount <= 0:
+                return False, f"{Text.YELLOW}Cannot withdraw amount below or equal 0.{Text.RESET}"
+            if self.balance < amount:
+                return False, f"{Text.YELLOW}Insufficient fund in your account (Only: {Money.format(self.balance)}){Text.RESET}"
+            try:
+                category = Budgets.category_for(TransactionTypes.WITHDRAW, category)
+            except ValueError as e:
+                return False, f"{Text.YELLOW}{e}{Text.RESET}"
         
-        self.balance -= amount
+            self.balance -= amount
 
-        # Create Transaction log
-        if loggable:
-            log = Transaction(self, TransactionTypes.WITHDRAW, amount, self, self)
-        else:
-            log = f"Withdrew {amount} to {self}, now {self.balance}."
+            # Create Transaction log, budgets count it as it happens
+            warning = None
+            if loggable:
+                log = Transaction(self, TransactionTypes.WITHDRAW, amount, self, self, category=category,
+                                  posted=posted, description=description)
+                warning = Budgets.record(self, log)
+            else:
+                log = f"Withdrew {Money.format(amount)} to {self}, now {Money.format(self.balance)}."
 
-        # Update Profile Json file
-        DataHandler.update_account_profile(self)
+            # Schedule Profile Json file update
+            self.mark_dirty()
     
-        return True, str(log)
+            return True, Account.with_warning(str(log), warning)
 
-    def transfer(self, target_account: Account, amount: float) -> tuple:
+    # Add a budget warning under the log of a transaction
+    @staticmethod
+    def with_warning(log: str, warning: str | None) -> str:
+        if warning is None:
+            return log
+        return f"{log}\n{Text.YELLOW}{warning}{Text.RESET}"
+
+    def transfer(self, target_account: Account, amount: int) -> tuple:
         # Condition Checking
         if not target_account:
             return False, f"{Text.YELLOW}Target account not found in the system.{Text.RESET}"
-        if amount <= 0:
-            return False, f"{Text.YELLOW}Cannot transfer amount below or equal 0.{Text.RESET}"
-        if self.balance < amount:
-            return False, f"{Text.YELLOW}Insufficient fund in your account (Only: {self.balance}){Text.RESET}"
+        if target_account is self:
+            return False, f"{Text.YELLOW}Cannot transfer between {self} and itself.{Text.RESET}"
+
+        # Lock both accounts, always in the same order so two opposite transfers can't deadlock
+        first, second = sorted((self, target_account), key=lambda account: account.id)
+        with first.lock, second.lock:
+            if amount <= 0:
+                return False, f"{Text.YELLOW}Cannot transfer amount below or equal 0.{Text.RESET}"
+            if self.balance < amount:
+                return False, f"{Text.YELLOW}Insufficient fund in your account (Only: {Money.format(self.balance)}){Text.RESET}"
         
-        self.withdraw(amount, False)
-        target_account.deposit(amount, False)
+            self.balance -= amount
+            target_account.balance += amount
 
-        # Create Transaction log
-        log_transfer = Transaction(self, TransactionTypes.TRANSFER, amount, self, target_account)
-        log_receive = Transaction(target_account, TransactionTypes.RECEIVE, amount, self, target_account)
+            # One record covers both legs, they are stored together or not at all
+            log_transfer, _ = Transaction.transfer(self, target_account, amount)
 
-        # Update Profile Json file
-        DataHandler.update_account_profile(self)
-        DataHandler.update_account_profile(target_account)
+            # Schedule Profile Json file update
+            self.mark_dirty()
+            target_account.mark_dirty()
         
-        return True, str(log_transfer)
-    
+            return True, str(log_transfer)
+
+    # Move money between this account and many others in one batch, legs are (account, amount) pairs.
+    # The money goes to each of them, or comes from each of them when collecting. Nothing moves unless
+    # every leg can, and every leg is stored with a single commit.
+    def bulk_transfer(self, legs: list[tuple[Account, int]], collect: bool = False) -> tuple:
+        # Condition Checking
+        if not legs:
+            return False, f"{Text.YELLOW}There's nothing to transfer.{Text.RESET}"
+        totals: dict[str, int] = {}
+        for account, amount in legs:
+            if account is self:
+                return False, f"{Text.YELLOW}Cannot transfer between {self} and itself.{Text.RESET}"
+            if amount <= 0:
+                return False, f"{Text.YELLOW}Cannot transfer amount below or equal 0 (to {account}).{Text.RESET}"
+            totals[account.id] = totals.get(account.id, 0) + amount
+        total = sum(totals.values())
+
+        # Lock every account once, in the same order as single transfers so they can't deadlock with the batch
+        accounts = sorted({self, *(account for account, _ in legs)}, key=lambda account: account.id)
+        with ExitStack() as locks:
+            for account in accounts:
+                locks.enter_context(account.lock)
+            if collect:
+                for account in accounts:
+                    if account is not self and account.balance < totals[account.id]:
+                        return False, f"{Text.YELLOW}Insufficient fund in {account} (Only: {Money.format(account.balance)}, needs {Money.format(totals[account.id])}){Text.RESET}"
+            elif self.balance < total:
+                return False, f"{Text.YELLOW}Insufficient fund in your account (Only: {Money.format(self.balance)}, needs {Money.format(total)}){Text.RESET}"
+
+            # Each leg is made right after its balances move, so the records keep the running balances
+            transfer_id, timestamp = Transaction.new_transfer()
+            transactions = []
+            for account, amount in legs:
+                transferer, receiver = (account, self) if collect else (self, account)
+                transferer.balance -= amount
+                receiver.balance += amount
+                transactions.extend(Transaction.legs(transferer, receiver, amount, transfer_id, timestamp))
+            Transaction.store_transfer(transactions)
+
+            # Schedule Profile Json file update
+            Account.mark_many_dirty(accounts)
+
+            direction = "from" if collect else "to"
+            return True, f"Transaction: BULK TRANSFER {Money.format(total)} {direction} {len(totals)} account(s) in {len(legs)} leg(s), now {Money.format(self.balance)}."
+
+    # Profile Persistence
+
+    # Mark the profile as changed, it will be written on the next flush
+    def mark_dirty(self) -> None:
+        Account.mark_many_dirty([self])
+
+    # Mark several profiles as changed together, a batch triggers one flush at most
+    @classmethod
+    def mark_many_dirty(cls, accounts: list[Account]) -> None:
+        with cls._registry_lock:
+            for account in accounts:
+                cls._dirty_accounts[account.id] = account
+            cls._pending_changes += len(accounts)
+            cls._changes_since_checkpoint += len(accounts)
+            flush_due = cls._pending_changes >= cls.flush_after_changes or \
+                time.monotonic() - cls._last_flush >= cls.flush_interval_seconds
+        if flush_due:
+            cls.flush_profiles(wait=False)
+        cls._schedule_flush()
+
+    # Arm the flush timer for the next time-based flush or checkpoint, unless it is armed already
+    @classmethod
+    def _schedule_flush(cls) -> None:
+        with cls._registry_lock:
+            if cls._flush_timer is not None:
+                return
+            now = time.monotonic()
+            delays = []
+            if cls._dirty_accounts:
+                delays.append(cls._last_flush + cls.flush_interval_seconds - now)
+            if cls._changes_since_checkpoint:
+                delays.append(cls._last_checkpoint + cls.checkpoint_interval_seconds - now)
+            if not delays:
+                return
+            # Something due but not written (busy or deferred) is tried again after a flush interval
+            delay = min(delays)
+            if delay <= 0:
+                delay = cls.flush_interval_seconds
+            # The timer runs in the context that armed it, so writes a batch defers stay deferred
+            cls._flush_timer = threading.Timer(delay, contextvars.copy_context().run, (cls._flush_when_idle,))
+            cls._flush_timer.daemon = True
+            cls._flush_timer.start()
+
+    @classmethod
+    def _flush_when_idle(cls) -> None:
+        with cls._registry_lock:
+            cls._flush_timer = None
+        cls.flush_profiles(wait=False)
+        cls._schedule_flush()
+
+    # Write every changed profile once, returns the amount of profiles written
+    @classmethod
+    @Instrumentation.persisting
+    def flush_profiles(cls, wait: bool = True) -> int:
+        # One flush at a time, automatic flushes are skipped while another one is running
+        if not cls._flush_lock.acquire(blocking=wait):
+            return 0
+        try:
+            with cls._registry_lock:
+                dirty_accounts = list(cls._dirty_accounts.values())
+                cls._dirty_accounts.clear()
+                cls._pending_changes = 0
+                cls._last_flush = time.monotonic()
+            for account in dirty_accounts:
+                DataHandler.update_account_profile(account)
+            Report.flush()
+            Budgets.flush()
+            if cls.checkpoint_due(wait):
+                cls.checkpoint(wait)
+            return len(dirty_accounts)
+        finally:
+            cls._flush_lock.release()
+
+    # Checkpoints are written after enough changes or time, batch mode waits for its own commits
+    @classmethod
+    def checkpoint_due(cls, wait: bool) -> bool:
+        if cls._changes_since_checkpoint == 0 or (DataHandler.deferred() and not wait):
+            return False
+        return cls._changes_since_checkpoint >= cls.checkpoint_after_changes or \
+            time.monotonic() - cls._last_checkpoint >= cls.checkpoint_interval_seconds
+
+    # Save every balance at one moment, returns the checkpoint (None when skipped or nothing changed)
+    @classmethod
+    def checkpoint(cls, wait: bool = True, force: bool = False) -> dict | None:
+        if cls._changes_since_checkpoint == 0 and not force:
+            return None
+        # Accounts never loaded haven't changed, their stored history still gives their balance
+        with cls._registry_lock:
+            accounts = sorted((account for account in cls.accounts if account.hydrated), key=lambda account: account.id)
+            changes = cls._changes_since_checkpoint
+
+        # Hold every account lock (in id order, like transfers) so no balance changes meanwhile.
+        # Without waiting, give up when another thread is busy with one of them.
+        held: list[Account] = []
+        try:
+            for account in accounts:
+                if not account.lock.acquire(blocking=wait):
+                    return None
+                held.append(account)
+            checkpoint = DataHandler.write_checkpoint(Transaction.next_timestamp(), {account.id: account.balance for account in accounts})
+        finally:
+            for account in reversed(held):
+                account.lock.release()
+
+        with cls._registry_lock:
+            cls._changes_since_checkpoint = max(cls._changes_since_checkpoint - changes, 0)
+            cls._last_checkpoint = time.monotonic()
+        return checkpoint
+
     def __str__(self) -> str:
         return f"{self.name}"
     
     def __repr__(self) -> str:
-        return f"{self.name} ({self.id})\nBALANCE: {self.balance}.\nFolder: {self.folder_path}\nProfile JSON file: {self.profile_path}\nTransaction folder: {self.transactions_folder_path}"
-    
\ No newline at end of file
+        return f"{self.name} ({self.id})\nBALANCE: {Money.format(self.balance)}.\nFolder: {self.folder_path}\nProfile JSON file: {self.profile_path}\nTransaction folder: {self.transactions_folder_path}"
+
+# Make sure changed profiles reach the disk when the program exits, then checkpoint them
+atexit.register(Account.checkpoint)
+atexit.register(Account.flush_profiles)
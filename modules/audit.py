@@ -0,0 +1,146 @@
+import multiprocessing, os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+
+from modules.money import Money
+from modules.data_handler import DataHandler
+from modules.transaction_types import TransactionTypes
+
+class LedgerAudit():
+
+    # Accounts handed to a worker at once, and the least accounts worth starting a process pool for
+    max_accounts_per_task: int = 256
+    min_accounts_for_pool: int = 64
+
+    # Initialise an audit of accounts, using every core unless told otherwise.
+    def __init__(self, accounts: list, workers: int | None = None) -> None:
+        self.accounts: list = accounts
+        self.workers: int = workers or os.cpu_count() or 1
+        self.results: list[dict] = []
+        self.unmatched_transfers: dict[tuple, int] = {}
+        self.discrepancies: list[str] = []
+
+    # Worker
+
+    # Recompute the balances of some accounts from their history, runs inside a worker process.
+    # Returns one result per account and the transfer legs left without their other leg.
+    @staticmethod
+    def audit_accounts(backend_name: str, data_folder_path: str, accounts: list[dict]) -> tuple[list[dict], dict[tuple, int]]:
+        from modules.storage_backend import StorageBackend
+        DataHandler.initialise(data_folder_path)
+        backend = StorageBackend.from_name(backend_name)
+
+        results, legs = [], {}
+        for account in accounts:
+            opening, balance, transactions, chain_breaks = None, 0, 0, 0
+            for record in backend.read_transactions(SimpleNamespace(**account)):
+                transaction_type = TransactionTypes.from_record(record["type"])
+                amount = Money.read(record, "amount")
+                new_balance = Money.read(record, "new_balance")
+                change = transaction_type.signed(amount)
+
+                # Whatever the account held before its first transaction wasn't recorded
+                if opening is None:
+                    opening = new_balance - change
+                    balance = opening
+                balance += change
+                if balance != new_balance:
+                    chain_breaks += 1
+                transactions += 1
+
+                # TRANSFER counts +1 and RECEIVE -1 on the same key, matched pairs cancel out
+                if transaction_type in (TransactionTypes.TRANSFER, TransactionTypes.RECEIVE):
+                    key = LedgerAudit.transfer_key(record, amount)
+                    legs[key] = legs.get(key, 0) + (1 if transaction_type == TransactionTypes.TRANSFER else -1)
+                    if legs[key] == 0:
+                        del legs[key]
+
+            results.append({
+                "id": account["id"],
+                "opening_balance": opening or 0,
+                "balance": balance,
+                "transactions": transactions,
+                "chain_breaks": chain_breaks
+            })
+        backend.close()
+        return results, legs
+
+    # Key both legs of a transfer share, older legs without a transfer id are matched by who, whom and how much
+    @staticmethod
+    def transfer_key(record: dict, amount: int) -> tuple:
+        if "transfer_id" in record:
+            return ("id", record["transfer_id"])
+        return (record.get("transferer_id", record["transferer"]), record.get("receiver_id", record["receiver"]), amount)
+
+    # Running
+
+    # Split the accounts into tasks, a few per worker so busy workers can be caught up by idle ones
+    def tasks(self) -> list[list[dict]]:
+        size = max(1, min(self.max_accounts_per_task, len(self.accounts) // (self.workers * 4)))
+        accounts = [{
+            "id": account.id,
+            "name": account.name,
+            "folder_path": str(account.folder_path),
+            "profile_path": str(account.profile_path),
+            "transactions_folder_path": str(account.transactions_folder_path)
+        } for account in self.accounts]
+        return [accounts[index:index + size] for index in range(0, len(accounts), size)]
+
+    # Audit every account, returns True when nothing is wrong
+    def run(self) -> bool:
+        # Workers read from disk, so everything pending has to be written first
+        from modules.account import Account
+        Account.flush_profiles()
+        DataHandler.flush()
+
+        backend_name, data_folder_path = DataHandler.backend().name, str(DataHandler.data_folder_path)
+        tasks = self.tasks()
+        if self.workers > 1 and len(self.accounts) >= self.min_accounts_for_pool:
+            # Workers start clean instead of forking a process that may hold locks in other threads
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(method)) as pool:
+                outcomes = list(pool.map(self.audit_accounts, [backend_name] * len(tasks), [data_folder_path] * len(tasks), tasks))
+        else:
+            outcomes = [self.audit_accounts(backend_name, data_folder_path, task) for task in tasks]
+
+        for results, legs in outcomes:
+            self.results.extend(results)
+            for key, count in legs.items():
+                self.unmatched_transfers[key] = self.unmatched_transfers.get(key, 0) + count
+        self.unmatched_transfers = {key: count for key, count in self.unmatched_transfers.items() if count != 0}
+        self.find_discrepancies()
+        return len(self.discrepancies) == 0
+
+    # Compare the recomputed balances with the accounts and list everything that doesn't add up
+    def find_discrepancies(self) -> None:
+        accounts = {account.id: account for account in self.accounts}
+        for result in self.results:
+            account = accounts[result["id"]]
+            if result["opening_balance"] != 0:
+                self.discrepancies.append(f"{account.name} ({account.id}): {Money.format(result['opening_balance'])} opening balance isn't in its history.")
+            if result["balance"] != account.balance:
+                self.discrepancies.append(f"{account.name} ({account.id}): balance is {Money.format(account.balance)} but history adds up to {Money.format(result['balance'])}.")
+            if result["chain_breaks"]:
+                self.discrepancies.append(f"{account.name} ({account.id}): {result['chain_breaks']} transaction(s) don't follow the balance before them.")
+        for key, count in self.unmatched_transfers.items():
+            leg = "TRANSFER without a RECEIVE" if count > 0 else "RECEIVE without a TRANSFER"
+            name = f"transfer {key[1]}" if key[0] == "id" else f"transfer of {Money.format(key[2])} from {key[0]} to {key[1]}"
+            self.discrepancies.append(f"{name}: {abs(count)} {leg}.")
+
+    # Report
+
+    # Write the audit result into the reports folder
+    def save(self) -> Path:
+        transactions = sum(result["transactions"] for result in self.results)
+        lines = [
+            "Basic Savings App - Ledger Audit",
+            f"Generated at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+            f"Audited {len(self.results)} account(s) and {transactions} transaction(s) with {self.workers} worker(s).",
+            "=" * 60
+        ]
+        lines.extend(self.discrepancies or ["No discrepancy found."])
+        path = DataHandler.create_reports_folder() / f"audit-{datetime.now().strftime('%Y%m%d-%H%M%S')}.txt"
+        DataHandler.write_text(path, "\n".join(lines) + "\n")
+        return path
@@ -0,0 +1,77 @@
+import sys, time
+from typing import TextIO
+
+from modules.parser import Parser
+from modules.account import Account
+from modules.data_handler import DataHandler
+from modules.ascii_decorator import AsciiDecorator as Text
+
+class BatchRunner():
+
+    # Lines that flush pending writes instead of being parsed
+    commit_aliases = ["COMMIT", "SAVE"]
+
+    # Lines starting with this are ignored
+    comment_prefix = "#"
+
+    def __init__(self, source: TextIO, source_name: str = "<stdin>", parser: Parser | None = None) -> None:
+        self.source: TextIO = source
+        self.source_name: str = source_name
+        self.parser: Parser = parser or Parser()
+        self.commands: int = 0
+        self.commits: int = 0
+        self.files_written: int = 0
+        self.failures: list[tuple[int, str, str]] = []
+
+    @classmethod # Alternative Constructor
+    def from_path(cls, path: str) -> BatchRunner:
+        if path == "-":
+            return cls(sys.stdin)
+        return cls(open(path, "r"), path)
+
+    # Flush every pending write to disk
+    def commit(self) -> None:
+        Account.flush_profiles()
+        self.files_written += DataHandler.flush()
+        self.commits += 1
+
+    # Run every line of the source, persisting only at commit points and at the end.
+    def run(self) -> tuple:
+        DataHandler.begin_deferred()
+        started = time.perf_counter()
+        try:
+            for line_number, line in enumerate(self.source, start=1):
+                line = line.strip()
+                if line == "" or line.startswith(self.comment_prefix):
+                    continue
+                if line.upper() in self.commit_aliases:
+                    self.commit()
+                    continue
+
+                self.commands += 1
+                success, log = self.parser.parse(line)
+                if not success:
+                    self.failures.append((line_number, line, log))
+                elif log.startswith("Stopping"):
+                    break
+        finally:
+            Account.flush_profiles()
+            self.files_written += DataHandler.end_deferred()
+            self.commits += 1
+            if self.source is not sys.stdin:
+                self.source.close()
+        elapsed = time.perf_counter() - started
+
+        return len(self.failures) == 0, self.summary(elapsed)
+
+    # Build the run report
+    def summary(self, elapsed: float) -> str:
+        rate = self.commands / elapsed if elapsed > 0 else 0
+        lines = [f"{Text.RED}Line {line_number}: {line}{Text.RESET} -> {log}" for line_number, line, log in self.failures]
+        colour = Text.GREEN if len(self.failures) == 0 else Text.YELLOW
+        lines.append(
+            f"{colour}Ran {self.commands} command(s) from {self.source_name} in {elapsed:.3f}s "
+            f"({rate:.0f} commands/sec), {len(self.failures)} failed, "
+            f"{self.files_written} file(s) written over {self.commits} commit(s).{Text.RESET}"
+        )
+        return "\n".join(lines)
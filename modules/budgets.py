@@ -0,0 +1,204 @@
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from modules.money import Money
+from modules.report import Report
+from modules.data_handler import DataHandler
+from modules.transaction_types import TransactionTypes
+
+class Budgets():
+
+    # Default categories, deposits and withdrawals made without one fall into income and expense
+    income_categories: tuple[str, ...] = ("income", "salary", "interest", "gift")
+    expense_categories: tuple[str, ...] = ("expense", "food", "transport", "housing", "bills", "shopping", "health", "fun")
+    default_categories: dict[TransactionTypes, str] = {TransactionTypes.DEPOSIT: "income", TransactionTypes.WITHDRAW: "expense"}
+
+    # Spending above this share of a budget is warned about
+    warn_share: float = 0.8
+
+    # Budgets are kept in each account folder as category: {period: {limit, period key, spent in that period}}.
+    # Only budgeted categories keep a counter, so recording a transaction is a couple of lookups.
+    budgets_file_name: str = "budgets.json"
+    _budgets: dict[str, dict] = {}
+    _dirty_budgets: dict[str, Path] = {}
+    _lock: threading.RLock = threading.RLock()
+
+    # Categories
+
+    @classmethod
+    def categories(cls) -> tuple[str, ...]:
+        return cls.income_categories + cls.expense_categories
+
+    # Category a transaction is filed under, raises ValueError for unknown ones
+    @classmethod
+    def category_for(cls, transaction_type: TransactionTypes, category: str | None) -> str | None:
+        if category is None:
+            return cls.default_categories.get(transaction_type)
+        category = category.lower()
+        if category not in cls.categories():
+            raise ValueError(f"Unknown category {category}, use {', '.join(cls.categories())}.")
+        return category
+
+    # Money spent in a category by a transaction: withdrawals add to it and deposits (refunds) take from it
+    @staticmethod
+    def spending(transaction_type: TransactionTypes, amount: int) -> int:
+        return -transaction_type.signed(amount)
+
+    # First moment of the period a moment belongs to
+    @staticmethod
+    def period_start(period: str, moment: datetime) -> datetime:
+        moment = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+        match (period):
+            case "daily":
+                return moment
+            case "weekly":
+                return moment - timedelta(days=moment.weekday())
+            case "monthly":
+                return moment.replace(day=1)
+        raise ValueError(f"Unknown budget period {period}.")
+
+    # Budget Handling
+
+    @classmethod
+    def budgets_path(cls, account) -> Path:
+        return Path(account.folder_path) / cls.budgets_file_name
+
+    # Get the budgets of an account, reading them from disk once
+    @classmethod
+    def load(cls, account) -> dict:
+        with cls._lock:
+            budgets = cls._budgets.get(account.id)
+            if budgets is None:
+                try:
+                    budgets = DataHandler.read_json(cls.budgets_path(account))
+                except FileNotFoundError:
+                    budgets = {}
+                cls._budgets[account.id] = budgets
+            return budgets
+
+    # Set the budget of a category in a period, the counter starts from the history of the current period
+    @classmethod
+    def set_budget(cls, account, category: str, limit: int, period: str = "monthly") -> dict:
+        category = category.lower()
+        if category not in cls.expense_categories:
+            raise ValueError(f"Budgets are for expenses, use {', '.join(cls.expense_categories)}.")
+        if period not in Report.periods:
+            raise ValueError(f"Unknown budget period {period}, use {', '.join(Report.periods)}.")
+        if limit <= 0:
+            raise ValueError("A budget must be above 0.")
+        # The history is read from disk, so everything pending is written first
+        DataHandler.flush()
+        with cls._lock:
+            budget = {"limit_cents": limit, "period": None, "spent_cents": 0}
+            cls.load(account).setdefault(category, {})[period] = budget
+            cls.rebuild_budget(account, category, period, budget)
+            cls._dirty_budgets[account.id] = cls.budgets_path(account)
+            cls.flush()
+            return budget
+
+    # Remove the budget of a category (every period by default), returns False when there was none
+    @classmethod
+    def remove_budget(cls, account, category: str, period: str | None = None) -> bool:
+        category = category.lower()
+        with cls._lock:
+            budgets = cls.load(account)
+            periods = budgets.get(category)
+            if not periods or (period is not None and period not in periods):
+                return False
+            if period is None:
+                del budgets[category]
+            else:
+                del periods[period]
+                if not periods:
+                    del budgets[category]
+            cls._dirty_budgets[account.id] = cls.budgets_path(account)
+            cls.flush()
+            return True
+
+    # Counters
+
+    # Count a transaction against the budgets of its category, returns a warning when one is (nearly) spent.
+    # A transaction of a later period than a counter rolls the counter over, one of an earlier period is left out.
+    @classmethod
+    def record(cls, account, transaction) -> str | None:
+        with cls._lock:
+            periods = cls.load(account).get(transaction.category)
+            if not periods:
+                return None
+            moment = datetime.fromtimestamp(transaction.posted)
+            spending = cls.spending(transaction.transaction_type, transaction.amount)
+            warnings = []
+            for period, budget in periods.items():
+                key = Report.period_key(period, moment)
+                if budget["period"] is None or key > budget["period"]:
+                    budget["period"], budget["spent_cents"] = key, 0
+                elif key < budget["period"]:
+                    continue
+                budget["spent_cents"] += spending
+                if spending > 0 and budget["spent_cents"] >= budget["limit_cents"] * cls.warn_share:
+                    warnings.append(cls.describe(transaction.category, period, budget))
+            cls._dirty_budgets[account.id] = cls.budgets_path(account)
+            return "\n".join(warnings) if warnings else None
+
+    # Spent so far in the current period, a counter of an earlier period means nothing was spent yet
+    @staticmethod
+    def spent(budget: dict, period: str, now: datetime | None = None) -> int:
+        key = Report.period_key(period, now or datetime.now())
+        return budget["spent_cents"] if budget["period"] == key else 0
+
+    # Every budget of an account with what is spent of it now, as (category, period, limit, spent)
+    @classmethod
+    def status(cls, account) -> list[tuple[str, str, int, int]]:
+        with cls._lock:
+            now = datetime.now()
+            return [(category, period, budget["limit_cents"], cls.spent(budget, period, now))
+                    for category, periods in sorted(cls.load(account).items())
+                    for period, budget in periods.items()]
+
+    @classmethod
+    def describe(cls, category: str, period: str, budget: dict) -> str:
+        spent, limit = budget["spent_cents"], budget["limit_cents"]
+        if spent > limit:
+            return f"Over the {period} {category} budget by {Money.format(spent - limit)} ({Money.format(spent)} of {Money.format(limit)})."
+        return f"Spent {Money.format(spent)} of the {period} {category} budget ({spent * 100 // limit}%), {Money.format(limit - spent)} left."
+
+    # Rebuilding
+
+    # Recount one budget from the history of the current period
+    @classmethod
+    def rebuild_budget(cls, account, category: str, period: str, budget: dict) -> int:
+        now = datetime.now()
+        budget["period"], budget["spent_cents"] = Report.period_key(period, now), 0
+        replayed = 0
+        for record in DataHandler.query_transactions(account, cls.period_start(period, now).timestamp(), category=category):
+            budget["spent_cents"] += cls.spending(TransactionTypes.from_record(record["type"]), Money.read(record, "amount"))
+            replayed += 1
+        return replayed
+
+    # Recount every budget of the given accounts from their history, returns the amount of transactions counted
+    @classmethod
+    def rebuild(cls, accounts: list) -> int:
+        replayed = 0
+        DataHandler.flush()
+        with cls._lock:
+            for account in accounts:
+                budgets = cls.load(account)
+                if not budgets:
+                    continue
+                for category, periods in budgets.items():
+                    for period, budget in periods.items():
+                        replayed += cls.rebuild_budget(account, category, period, budget)
+                cls._dirty_budgets[account.id] = cls.budgets_path(account)
+            cls.flush()
+        return replayed
+
+    # Write every changed budgets file, returns the amount of files written
+    @classmethod
+    def flush(cls) -> int:
+        with cls._lock:
+            dirty_budgets = cls._dirty_budgets
+            cls._dirty_budgets = {}
+            for account_id, path in dirty_budgets.items():
+                DataHandler.write_json(path, cls._budgets[account_id])
+            return len(dirty_budgets)
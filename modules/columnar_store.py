@@ -0,0 +1,361 @@
+import json, mmap, os, threading
+from array import array
+from bisect import bisect_left, bisect_right
+from pathlib import Path
+from typing import Iterator
+
+from modules.instrumentation import Instrumentation
+from modules.transaction_types import TransactionTypes
+
+class ColumnarStore():
+
+    # Fixed-width columns, one file each (name: array typecode)
+    columns: dict[str, str] = {
+        "timestamp": "d",
+        "account": "I",
+        "type": "B",
+        "amount": "q",
+        "counterparty": "I"
+    }
+    flush_after_rows: int = 1024
+
+    # Store Variables (the folder follows the data root, see DataHandler.initialise)
+    folder_path: Path = Path("data") / "columnar"
+    _account_ids: list[str] | None = None
+    _account_indexes: dict[str, int] = {}
+    _new_accounts: bool = False
+    _buffer: dict[str, array] = {name: array(typecode) for name, typecode in columns.items()}
+    _lock: threading.RLock = threading.RLock()
+
+    # Rows on disk once the columns have been cut to the same length (None until then). While rows wait
+    # in the buffer, pending.json holds that count and the first waiting timestamp, so after a crash the
+    # lost rows can be written again from the journals (see DataHandler.reconcile_columnar_store).
+    _stored_rows: int | None = None
+    _pending_marked: bool = False
+    pending_file_name: str = "pending.json"
+
+    # Rows are kept in timestamp order, so scans bisect to the rows of a time range. Threads writing at the
+    # same moment can still land slightly out of order, never by more than this.
+    order_slack_seconds: float = 1.0
+    # Stores written before rows were kept in order are sorted once, the first time they are scanned
+    _order_checked: bool = False
+
+    # Account Index Handling
+
+    @classmethod
+    def _accounts_path(cls) -> Path:
+        return cls.folder_path / "accounts.json"
+
+    @classmethod
+    def _load_accounts(cls) -> None:
+        if cls._account_ids is not None:
+            return
+        try:
+            with open(cls._accounts_path(), "r") as file:
+                cls._account_ids = json.load(file)
+        except FileNotFoundError:
+            cls._account_ids = []
+        cls._account_indexes = {account_id: index for index, account_id in enumerate(cls._account_ids)}
+
+    # Get the small integer an account id is stored as
+    @classmethod
+    def account_index(cls, account_id: str) -> int:
+        cls._load_accounts()
+        index = cls._account_indexes.get(account_id)
+        if index is None:
+            index = len(cls._account_ids)
+            cls._account_ids.append(account_id)
+            cls._account_indexes[account_id] = index
+            cls._new_accounts = True
+        return index
+
+    # Repairing
+
+    @classmethod
+    def _pending_path(cls) -> Path:
+        return cls.folder_path / cls.pending_file_name
+
+    # Cut every column file to the rows all of them hold, a crash while flushing can leave some longer
+    # than others and rows appended after an uneven tail would never line up again. Returns the rows kept.
+    @classmethod
+    def repair(cls, rows: int | None = None) -> int:
+        with cls._lock:
+            if cls._stored_rows is not None and rows is None:
+                return cls._stored_rows
+            sizes = {}
+            for name, typecode in cls.columns.items():
+                path = cls.folder_path / f"{name}.col"
+                sizes[name] = path.stat().st_size if path.exists() else 0
+            complete = min(size // array(typecode).itemsize for size, typecode in zip(sizes.values(), cls.columns.values()))
+            rows = complete if rows is None else min(rows, complete)
+            for name, typecode in cls.columns.items():
+                length = rows * array(typecode).itemsize
+                if sizes[name] != length:
+                    os.truncate(cls.folder_path / f"{name}.col", length)
+            cls._stored_rows = rows
+            return rows
+
+    # Rows on disk and first timestamp of the rows a run left in its buffer, None when it flushed them all
+    @classmethod
+    def pending(cls) -> dict | None:
+        try:
+            with open(cls._pending_path(), "r") as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    # Write again the rows a crash lost: the columns go back to the rows they held when those were buffered,
+    # then every record since then is added unless the columns already hold it. The rows from there on are
+    # written again together, so they stay in timestamp order. Returns the rows written.
+    @classmethod
+    def restore(cls, rows: int, since: float, records: Iterator[tuple]) -> int:
+        with cls._lock:
+            for column in cls._buffer.values():
+                del column[:]
+            cls.repair(rows)
+            handles, views = cls._open_columns()
+            try:
+                cls._load_accounts()
+                kept = set()
+                timestamps = views["timestamp"]
+                first = bisect_left(timestamps, since - cls.order_slack_seconds)
+                for row in range(first, len(timestamps)):
+                    if timestamps[row] >= since:
+                        kept.add((timestamps[row], cls._account_ids[views["account"][row]], views["type"][row], views["amount"][row]))
+                    for name in cls.columns:
+                        cls._buffer[name].append(views[name][row])
+            finally:
+                cls._close_columns(handles, views)
+            cls.repair(first)
+
+            restored = 0
+            for account_id, transaction_type, amount, timestamp, counterparty_id in records:
+                if (timestamp, account_id, transaction_type.value, amount) in kept:
+                    continue
+                cls._buffer_row(account_id, transaction_type, amount, timestamp, counterparty_id)
+                restored += 1
+            cls._pending_marked = True
+            cls.flush()
+            return restored
+
+    # Note where a crash would have to restore from, before the first row waiting for a flush is
+    # written anywhere (DataHandler calls it ahead of the journal write)
+    @classmethod
+    def mark_pending(cls, timestamp: float) -> None:
+        with cls._lock:
+            if cls._pending_marked:
+                return
+            rows = cls.repair()
+            cls.folder_path.mkdir(parents=True, exist_ok=True)
+            with open(cls._pending_path(), "w") as file:
+                json.dump({"rows": rows, "timestamp": timestamp}, file)
+            cls._pending_marked = True
+
+    # Writing
+
+    # Add one transaction row, rows are written to disk in blocks
+    @classmethod
+    def append(cls, account_id: str, transaction_type: TransactionTypes, amount: int,
+               timestamp: float, counterparty_id: str) -> None:
+        with cls._lock:
+            cls.mark_pending(timestamp)
+            cls._buffer_row(account_id, transaction_type, amount, timestamp, counterparty_id)
+            if len(cls._buffer["timestamp"]) >= cls.flush_after_rows:
+                cls.flush()
+
+    @classmethod
+    def _buffer_row(cls, account_id: str, transaction_type: TransactionTypes, amount: int,
+                    timestamp: float, counterparty_id: str) -> None:
+        cls._buffer["timestamp"].append(timestamp)
+        cls._buffer["account"].append(cls.account_index(account_id))
+        cls._buffer["type"].append(transaction_type.value)
+        cls._buffer["amount"].append(amount)
+        cls._buffer["counterparty"].append(cls.account_index(counterparty_id))
+
+    # Write every row again from history, in timestamp order whatever order they come in. Returns the rows written.
+    @classmethod
+    def rebuild(cls, rows: Iterator[tuple]) -> int:
+        with cls._lock:
+            cls.clear()
+            for account_id, transaction_type, amount, timestamp, counterparty_id in rows:
+                cls._buffer_row(account_id, transaction_type, amount, timestamp, counterparty_id)
+            return cls.flush()
+
+    # Put the buffered rows in timestamp order, they are usually in order already
+    @classmethod
+    def _sort_buffer(cls) -> None:
+        timestamps = cls._buffer["timestamp"]
+        if all(timestamps[row] <= timestamps[row + 1] for row in range(len(timestamps) - 1)):
+            return
+        order = sorted(range(len(timestamps)), key=timestamps.__getitem__)
+        for name, typecode in cls.columns.items():
+            column = cls._buffer[name]
+            cls._buffer[name] = array(typecode, [column[row] for row in order])
+
+    # Write buffered rows at the end of every column file
+    @classmethod
+    @Instrumentation.persisting
+    def flush(cls) -> int:
+        with cls._lock:
+            rows = len(cls._buffer["timestamp"])
+            if rows == 0 and not cls._new_accounts and not cls._pending_marked:
+                return 0
+            cls.folder_path.mkdir(parents=True, exist_ok=True)
+            if cls._new_accounts:
+                with open(cls._accounts_path(), "w") as file:
+                    json.dump(cls._account_ids, file)
+                cls._new_accounts = False
+            if Instrumentation.enabled():
+                Instrumentation.count("files_opened", len(cls._buffer))
+                Instrumentation.count("bytes_written", sum(len(column) * column.itemsize for column in cls._buffer.values()))
+            if rows:
+                stored = cls.repair()
+                cls._sort_buffer()
+                for name, column in cls._buffer.items():
+                    with open(cls.folder_path / f"{name}.col", "ab") as file:
+                        column.tofile(file)
+                    del column[:]
+                cls._stored_rows = stored + rows
+            if cls._pending_marked:
+                cls._pending_path().unlink(missing_ok=True)
+                cls._pending_marked = False
+            return rows
+
+    # Keep the columns in another folder, rows buffered for the old one are written there first
+    @classmethod
+    def use_folder(cls, folder_path: Path) -> None:
+        with cls._lock:
+            cls.flush()
+            cls.folder_path = Path(folder_path)
+            cls._account_ids = None
+            cls._account_indexes = {}
+            cls._stored_rows = None
+            cls._pending_marked = False
+            cls._order_checked = False
+
+    # Remove every column so it can be written again from history
+    @classmethod
+    def clear(cls) -> None:
+        for name in cls.columns:
+            (cls.folder_path / f"{name}.col").unlink(missing_ok=True)
+            del cls._buffer[name][:]
+        cls._accounts_path().unlink(missing_ok=True)
+        cls._pending_path().unlink(missing_ok=True)
+        cls._pending_marked = False
+        cls._account_ids = None
+        cls._account_indexes = {}
+        cls._new_accounts = False
+        cls._stored_rows = None
+        cls._order_checked = True
+
+    # Scanning
+
+    # Map every column file and hand out typed views over them without copying
+    @classmethod
+    def _open_columns(cls, check_order: bool = True) -> tuple[list, dict[str, memoryview]]:
+        if check_order:
+            cls._ensure_order()
+        cls.flush()
+        cls.repair()
+        handles, views = [], {}
+        for name, typecode in cls.columns.items():
+            path = cls.folder_path / f"{name}.col"
+            if not path.exists() or path.stat().st_size == 0:
+                views[name] = memoryview(array(typecode))
+                continue
+            file = open(path, "rb")
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            handles.extend((mapped, file))
+            usable = len(mapped) - len(mapped) % array(typecode).itemsize
+            views[name] = memoryview(mapped)[:usable].cast(typecode)
+        # A crash while writing can leave columns of different length, only use complete rows
+        rows = min(len(view) for view in views.values())
+        return handles, {name: view[:rows] for name, view in views.items()}
+
+    @staticmethod
+    def _close_columns(handles: list, views: dict[str, memoryview]) -> None:
+        for view in views.values():
+            view.release()
+        for handle in handles:
+            handle.close()
+
+    # Check once that the rows are in timestamp order (within the slack), a store written before they were
+    # kept in order is sorted by writing every row again
+    @classmethod
+    def _ensure_order(cls) -> None:
+        with cls._lock:
+            if cls._order_checked:
+                return
+            handles, views = cls._open_columns(check_order=False)
+            try:
+                latest, ordered = float("-inf"), True
+                for timestamp in views["timestamp"]:
+                    if timestamp < latest - cls.order_slack_seconds:
+                        ordered = False
+                        break
+                    latest = max(latest, timestamp)
+                if not ordered:
+                    for name in cls.columns:
+                        cls._buffer[name].extend(views[name])
+            finally:
+                cls._close_columns(handles, views)
+            if not ordered:
+                cls.repair(0)
+                cls.flush()
+            cls._order_checked = True
+
+    # Go through the rows between two timestamps, only the ones near the range are looked at
+    @classmethod
+    def _rows(cls, views: dict[str, memoryview], start: float | None, end: float | None) -> Iterator[int]:
+        timestamps = views["timestamp"]
+        # Rows are out of order by the slack at most, so no row of the range lies outside these bounds
+        first = 0 if start is None else bisect_left(timestamps, start - cls.order_slack_seconds)
+        last = len(timestamps) if end is None else bisect_right(timestamps, end + cls.order_slack_seconds)
+        for row in range(first, last):
+            if start is not None and timestamps[row] < start:
+                continue
+            if end is not None and timestamps[row] > end:
+                continue
+            yield row
+
+    # Total amount (in cents) of each transaction type, for one account or every account
+    @classmethod
+    def sum_by_type(cls, account_id: str | None = None, start: float | None = None,
+                    end: float | None = None) -> dict[str, int]:
+        handles, views = cls._open_columns()
+        try:
+            account = None
+            if account_id is not None:
+                cls._load_accounts()
+                account = cls._account_indexes.get(account_id, -1)
+            totals: dict[int, int] = {}
+            types, amounts, accounts = views["type"], views["amount"], views["account"]
+            for row in cls._rows(views, start, end):
+                if account is not None and accounts[row] != account:
+                    continue
+                totals[types[row]] = totals.get(types[row], 0) + amounts[row]
+        finally:
+            cls._close_columns(handles, views)
+        return {TransactionTypes(value).name: total for value, total in totals.items()}
+
+    # Net change (in cents) of every account, or total of one transaction type per account
+    @classmethod
+    def sum_by_account(cls, transaction_type: TransactionTypes | None = None, start: float | None = None,
+                       end: float | None = None) -> dict[str, int]:
+        handles, views = cls._open_columns()
+        try:
+            signs = {member.value: member.signed(1) for member in TransactionTypes}
+            totals: dict[int, int] = {}
+            types, amounts, accounts = views["type"], views["amount"], views["account"]
+            for row in cls._rows(views, start, end):
+                if transaction_type is None:
+                    change = signs[types[row]] * amounts[row]
+                elif types[row] == transaction_type.value:
+                    change = amounts[row]
+                else:
+                    continue
+                totals[accounts[row]] = totals.get(accounts[row], 0) + change
+        finally:
+            cls._close_columns(handles, views)
+        cls._load_accounts()
+        return {cls._account_ids[index]: total for index, total in totals.items()}
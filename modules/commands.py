@@ -8,9 +8,12 @@ class Commands(Enum):
     CLEAR = auto()
     VERSION = auto()
     EXIT = auto()
+    FLUSH = auto()
+    VERIFY = auto()
 
     ACCOUNT = auto()
     TRANSACTION = auto()
+    REPORT = auto()
 
     # Accounts Sub command
     ACC_LIST = auto()
@@ -24,5 +27,21 @@ class Commands(Enum):
     T_DEPOSIT = auto()
     T_WITHDRAW = auto()
     T_TRANSFER = auto()
+    T_BULK = auto()
+    T_HISTORY = auto()
+    T_IMPORT = auto()
+    T_EXPORT = auto()
+    T_SCHEDULE = auto()
+    T_ORDERS = auto()
+    T_UNSCHEDULE = auto()
+    T_BUDGET = auto()
+
+    # Report Sub command
+    REPORT_DAILY = auto()
+    REPORT_WEEKLY = auto()
+    REPORT_MONTHLY = auto()
+    REPORT_REBUILD = auto()
+    REPORT_TOTALS = auto()
+    REPORT_AUDIT = auto()
 
     SOB = auto()
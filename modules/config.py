@@ -0,0 +1,38 @@
+import json, os
+from pathlib import Path
+from typing import Any
+
+class Config():
+
+    # Config Variables
+    config_file_path: Path = Path("config.json")
+    environment_prefix: str = "SAVINGS_"
+    defaults: dict[str, Any] = {
+        "storage_backend": "json",
+        "data_root": "data"
+    }
+    _values: dict[str, Any] | None = None
+
+    # Read config.json once, missing file means every default is used
+    @classmethod
+    def load(cls) -> dict[str, Any]:
+        if cls._values is None:
+            try:
+                with open(cls.config_file_path, "r") as file:
+                    cls._values = json.load(file)
+            except FileNotFoundError:
+                cls._values = {}
+        return cls._values
+
+    # Get a setting, environment variables (e.g. SAVINGS_STORAGE_BACKEND) win over config.json
+    @classmethod
+    def get(cls, key: str) -> Any:
+        environment_value = os.environ.get(f"{cls.environment_prefix}{key.upper()}")
+        if environment_value is not None:
+            return environment_value
+        return cls.load().get(key, cls.defaults.get(key))
+
+    # Change a setting for the running program only
+    @classmethod
+    def set(cls, key: str, value: Any) -> None:
+        cls.load()[key] = value
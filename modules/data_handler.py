@@ -1,9 +1,33 @@
+from contextvars import ContextVar
 from pathlib import Path
-import json
+from typing import Iterator
+import atexit, json, os, threading, time
+
+from modules.money import Money
+from modules.config import Config
+from modules.journal import Journal
+from modules.instrumentation import Instrumentation
+from modules.columnar_store import ColumnarStore
 
 class DataHandler:
+
+    # Data root, set by initialise (nothing on disk is touched until the first write needs it)
     data_folder_path: Path = Path("data")
-    accounts_json_file: Path = data_folder_path / "accounts.json"
+    _initialised: bool = False
+
+    # Storage backend picked from config ("storage_backend": "json" or "sqlite")
+    _backend: StorageBackend | None = None
+
+    # Balance checkpoints (only the newest few are kept)
+    checkpoint_prefix: str = "checkpoint-"
+    keep_checkpoints: int = 3
+
+    # Deferred persistence (batch mode keeps writes in memory until flush). Each context defers its own
+    # writes, so an import on one server connection neither changes how the other sessions write nor
+    # gets written out by their flushes. Every deferring context's pending writes are also listed.
+    _deferred: ContextVar[dict[Path, dict|list] | None] = ContextVar("deferred", default=None)
+    _pending_writes: list[dict[Path, dict|list]] = []
+    _pending_lock: threading.Lock = threading.Lock()
     
     # Helper function to check index exist in list
     @staticmethod
@@ -11,102 +35,439 @@ class DataHandler:
         return index < len(target_list)
 
     # Helper function for writing JSON file
+    @classmethod
+    @Instrumentation.persisting
+    def write_json(cls, path: Path, data: dict|list) -> None:
+        path = Path(path)
+        with cls._pending_lock:
+            deferred = cls._current_pending()
+            # This write is newer than any other session still holds back for the same file
+            for pending in cls._pending_writes:
+                if pending is not deferred:
+                    pending.pop(path, None)
+            if deferred is not None:
+                # Later writes to the same file replace the pending one
+                deferred[path] = data
+                return
+        cls._replace_json(path, data)
+
+    # Write into a temporary file and swap it in, so a crash never leaves a half written file
     @staticmethod
-    def write_json(path: Path, data: dict|list) -> None:
-        with open(path, "w") as file:
-            json.dump(data, file, indent=4)
+    def _replace_json(path: Path, data: dict|list, sync: bool = False) -> None:
+        temporary_path = Path(f"{path}.tmp")
+        started = time.perf_counter()
+        text = json.dumps(data, indent=4)
+        if Instrumentation.enabled():
+            Instrumentation.count_json("encode", started)
+            Instrumentation.count("files_opened")
+            Instrumentation.count("bytes_written", len(text))
+        with open(temporary_path, "w") as file:
+            file.write(text)
+            if sync:
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(temporary_path, path)
 
     # Helper function for reading JSON file
-    @staticmethod
-    def read_json(path):
+    @classmethod
+    def read_json(cls, path):
+        with cls._pending_lock:
+            for pending in cls._pending_writes:
+                if Path(path) in pending:
+                    return pending[Path(path)]
         with open(path, "r") as file:
-            data = json.load(file)
-            return data
+            text = file.read()
+        started = time.perf_counter()
+        data = json.loads(text)
+        if Instrumentation.enabled():
+            Instrumentation.count_json("decode", started)
+            Instrumentation.count("files_opened")
+            Instrumentation.count("bytes_read", len(text))
+        return data
+
+    # Check if writes of the current context are kept in memory
+    @classmethod
+    def deferred(cls) -> bool:
+        with cls._pending_lock:
+            return cls._current_pending() is not None
+
+    # Pending writes of the current context, None when it doesn't defer. A context copied from a deferring
+    # one (e.g. by a timer) stops deferring once the batch that started it has ended.
+    @classmethod
+    def _current_pending(cls) -> dict[Path, dict|list] | None:
+        deferred = cls._deferred.get()
+        if deferred is not None and not any(pending is deferred for pending in cls._pending_writes):
+            return None
+        return deferred
+
+    # Start keeping writes in memory instead of writing them right away
+    @classmethod
+    def begin_deferred(cls) -> None:
+        pending = {}
+        with cls._pending_lock:
+            cls._pending_writes.append(pending)
+        cls._deferred.set(pending)
+
+    # Write every file the current context holds back to disk, returns the amount of files written
+    @classmethod
+    @Instrumentation.persisting
+    def flush(cls) -> int:
+        with cls._pending_lock:
+            deferred = cls._current_pending()
+        return cls._write_pending([deferred] if deferred is not None else [])
+
+    # Write the files every context holds back, when the program exits
+    @classmethod
+    def flush_all(cls) -> int:
+        with cls._pending_lock:
+            deferred = list(cls._pending_writes)
+        return cls._write_pending(deferred)
+
+    @classmethod
+    def _write_pending(cls, deferred: list[dict[Path, dict|list]]) -> int:
+        with cls._pending_lock:
+            writes = [write for pending in deferred for write in pending.items()]
+            for pending in deferred:
+                pending.clear()
+        for path, data in writes:
+            cls._replace_json(path, data)
+        if cls._backend is not None:
+            cls._backend.flush()
+        ColumnarStore.flush()
+        return len(writes)
+
+    # Flush pending writes and go back to writing right away
+    @classmethod
+    def end_deferred(cls) -> int:
+        written = cls.flush()
+        deferred = cls._deferred.get()
+        with cls._pending_lock:
+            cls._pending_writes = [pending for pending in cls._pending_writes if pending is not deferred]
+        cls._deferred.set(None)
+        return written
+
+    # Pick the data root: the given folder, else config ("data_root" or SAVINGS_DATA_ROOT), else "data".
+    # Only paths are set, folders are created by the first write into them.
+    @classmethod
+    def initialise(cls, data_root: str | Path | None = None) -> Path:
+        root = Path(data_root if data_root is not None else Config.get("data_root")).expanduser()
+        if root != cls.data_folder_path:
+            if cls._backend is not None:
+                cls._backend.close()
+                cls._backend = None
+            ColumnarStore.use_folder(root / "columnar")
+        cls.data_folder_path = root
+        cls._initialised = True
+        return root
 
     # Create Data Folder
     @classmethod
     def ensure_data_folder(cls) -> Path:
-        cls.data_folder_path.mkdir(exist_ok=True)
+        if not cls._initialised:
+            cls.initialise()
+        cls.data_folder_path.mkdir(parents=True, exist_ok=True)
         return cls.data_folder_path
 
-    # Create Accounts list file
+    # Storage Backend
+
     @classmethod
-    def ensure_accounts_list(cls) -> Path:
-        if not cls.accounts_json_file.exists():
-            cls.write_json(cls.accounts_json_file, {
-                "accounts": {},
-                "account_id_counter": 1
-            })
-        return cls.accounts_json_file
+    def backend(cls) -> StorageBackend:
+        if cls._backend is None:
+            from modules.storage_backend import StorageBackend
+            if not cls._initialised:
+                cls.initialise()
+            cls._backend = StorageBackend.from_name(Config.get("storage_backend"))
+        return cls._backend
 
-    # Update Accounts list file
+    # Switch to another backend, flushing the current one first
     @classmethod
+    def use_backend(cls, backend: StorageBackend) -> None:
+        if cls._backend is not None:
+            cls._backend.close()
+        cls._backend = backend
+
+    # Group several writes so they are applied all together or not at all
+    @classmethod
+    def atomic(cls):
+        return cls.backend().atomic()
+
+    # Update Accounts list
+    @classmethod
+    @Instrumentation.persisting
     def update_accounts_list(cls, data: dict) -> None:
-        path: Path = cls.accounts_json_file
-        cls.write_json(path, data)
+        cls.backend().update_accounts_list(data)
 
-    # Get Accounts list from file
+    # Add one new account to the accounts list without writing the others again
     @classmethod
-    def get_accounts_list(cls):
-        path: Path = cls.accounts_json_file
-        data = cls.read_json(path)
-        return data
+    @Instrumentation.persisting
+    def add_to_accounts_list(cls, account_id: str, entry: dict, account_id_counter: int) -> None:
+        cls.backend().add_to_accounts_list(account_id, entry, account_id_counter)
 
-    # Create an account folder
+    # Get Accounts list
     @classmethod
-    def create_account_folder(cls, account_id: str) -> Path:
-        folder = cls.data_folder_path / account_id
-        folder.mkdir(exist_ok=True)
-        return folder
+    def get_accounts_list(cls) -> dict:
+        return cls.backend().get_accounts_list()
 
-    # Create an account profile JSON file
-    @classmethod
-    def create_account_profile(cls, account_folder: Path, account_id: str, 
-                               name: str, balance: float, folder_path: Path,
-                               transaction_folder_path: Path) -> Path:
-        path = account_folder / "profile.json"
-        cls.write_json(path, {
-            "id": account_id, 
-            "name": name, 
-            "balance": balance,
-            "folder_path": str(folder_path),
-            "profile_path": str(path),
-            "transactions_folder_path": str(transaction_folder_path)
-            })
-        return path
-
-    # Update an account profile JSON file
+    # Helper function for writing text file
     @staticmethod
-    def update_account_profile(account) -> None:
-        path = account.profile_path
-        DataHandler.write_json(path, {
-            "id": account.id,
-            "name": account.name,
-            "balance": account.balance,
-            "folder_path": str(account.folder_path),
-            "profile_path": str(account.profile_path),
-            "transactions_folder_path": str(account.transactions_folder_path)
-        })
-
-    # Create a transaction folder inside an account folder
-    @staticmethod
-    def create_transactions_folder(account_folder: Path) -> Path:
-        folder = account_folder / "transactions"
-        folder.mkdir(exist_ok=True)
+    @Instrumentation.persisting
+    def write_text(path: Path, text: str) -> None:
+        if Instrumentation.enabled():
+            Instrumentation.count("files_opened")
+            Instrumentation.count("bytes_written", len(text))
+        with open(path, "w") as file:
+            file.write(text)
+
+    # Create a reports folder inside the data folder
+    @classmethod
+    def create_reports_folder(cls) -> Path:
+        folder = cls.data_folder_path / "reports"
+        folder.mkdir(parents=True, exist_ok=True)
         return folder
 
-    # Write transaction log into the transaction folder inside the account folder.
+    # Create the storage of a new account, returns its profile
+    @classmethod
+    @Instrumentation.persisting
+    def create_account(cls, account_id: str, name: str, balance: int) -> dict:
+        return cls.backend().create_account(account_id, name, balance)
+
+    # Stream the profile of every account
+    @classmethod
+    def read_account_profiles(cls) -> Iterator[dict]:
+        return cls.backend().read_account_profiles()
+
+    # Stream what the registry needs of every account, balances may be left out (None) to be read on first use
+    @classmethod
+    def read_account_index(cls) -> Iterator[dict]:
+        return cls.backend().read_account_index()
+
+    # Read the stored profile of one account
+    @classmethod
+    def read_account_profile(cls, account) -> dict:
+        return cls.backend().read_account_profile(account)
+
+    # Update an account profile
+    @classmethod
+    @Instrumentation.persisting
+    def update_account_profile(cls, account) -> None:
+        cls.backend().update_account_profile(account)
+
+    # Build the stored form of a transaction
     @staticmethod
-    def write_transaction(account, transaction) -> None:
-        path = Path(account.transactions_folder_path) / f"{transaction.id}.json"
-        data = {
+    def transaction_record(account, transaction) -> dict:
+        record = {
             "id": transaction.id,
+            "timestamp": transaction.timestamp,
             "account": account.name,
             "account_id": account.id,
             "type": str(transaction.transaction_type),
-            "amount": transaction.amount,
-            "new_balance": account.balance,
+            "amount_cents": transaction.amount,
+            "new_balance_cents": transaction.new_balance,
             "transferer": transaction.transferer.name,
-            "receiver": transaction.receiver.name
+            "transferer_id": transaction.transferer.id,
+            "receiver": transaction.receiver.name,
+            "receiver_id": transaction.receiver.id
+        }
+        if transaction.transfer_id is not None:
+            record["transfer_id"] = transaction.transfer_id
+        if transaction.category is not None:
+            record["category"] = transaction.category
+        if transaction.posted != transaction.timestamp:
+            record["posted"] = transaction.posted
+        if transaction.description:
+            record["description"] = transaction.description
+        return record
+
+    # When the money of a record moved, records are kept in the order they were written (timestamp)
+    # but an imported one can have been posted long before
+    @staticmethod
+    def posted(record: dict) -> float:
+        return record.get("posted", record.get("timestamp", 0))
+
+    # Store a transaction log of an account.
+    @classmethod
+    @Instrumentation.persisting
+    def write_transaction(cls, account, transaction) -> None:
+        ColumnarStore.mark_pending(transaction.timestamp)
+        cls.backend().write_transaction(account, cls.transaction_record(account, transaction))
+        cls._append_columnar(account, transaction)
+
+    # Store every leg of a transfer as one unit, so a crash can't keep only one of them
+    @classmethod
+    @Instrumentation.persisting
+    def write_transfer(cls, transactions: list) -> None:
+        legs = [(transaction.account, cls.transaction_record(transaction.account, transaction)) for transaction in transactions]
+        transfer = {
+            "id": transactions[0].transfer_id,
+            "timestamp": transactions[0].timestamp,
+            "legs": [record for _, record in legs]
         }
-        DataHandler.write_json(path, data)
+        ColumnarStore.mark_pending(transfer["timestamp"])
+        cls.backend().write_transfer(transfer, legs)
+        for transaction in transactions:
+            cls._append_columnar(transaction.account, transaction)
+
+    # Keep the columnar copy used by fast scans
+    @staticmethod
+    def _append_columnar(account, transaction) -> None:
+        counterparty = transaction.receiver if transaction.transferer is account else transaction.transferer
+        ColumnarStore.append(account.id, transaction.transaction_type, transaction.amount, transaction.timestamp, counterparty.id)
+
+    # Finish writes a crash interrupted, returns the amount of records written again
+    @classmethod
+    def recover(cls) -> int:
+        return cls.backend().recover()
+
+    # Stream the transaction logs of an account in the order they were written
+    @classmethod
+    def read_transactions(cls, account) -> Iterator[dict]:
+        return cls.backend().read_transactions(account)
+
+    # Get the newest transaction log of an account, None when it has none
+    @classmethod
+    def last_transaction(cls, account) -> dict | None:
+        return cls.backend().last_transaction(account)
+
+    # Stream the transaction logs of an account between two timestamps that match every given filter
+    @classmethod
+    def query_transactions(cls, account, start: float | None = None, end: float | None = None,
+                           types: set[str] | None = None, min_amount: int | None = None,
+                           max_amount: int | None = None, counterparty=None, category: str | None = None) -> Iterator[dict]:
+        # Dates are filtered by when the money moved, that is never after the record was written,
+        # so everything written since the start is read and the end is checked record by record
+        for record in cls.backend().query_transactions(account, start, None):
+            posted = cls.posted(record)
+            if (start is not None and posted < start) or (end is not None and posted > end):
+                continue
+            if types and record["type"] not in types:
+                continue
+            if min_amount is not None and Money.read(record, "amount") < min_amount:
+                continue
+            if max_amount is not None and Money.read(record, "amount") > max_amount:
+                continue
+            if counterparty is not None and counterparty.id not in (record.get("transferer_id"), record.get("receiver_id")) \
+                    and counterparty.name not in (record["transferer"], record["receiver"]):
+                continue
+            if category is not None and record.get("category") != category:
+                continue
+            yield record
+
+    # Checkpoints
+
+    @classmethod
+    def checkpoints_folder(cls) -> Path:
+        folder = cls.data_folder_path / "checkpoints"
+        folder.mkdir(parents=True, exist_ok=True)
+        return folder
+
+    # Every checkpoint file, oldest first (looking doesn't create the folder)
+    @classmethod
+    def checkpoints(cls) -> list[Path]:
+        return sorted((cls.data_folder_path / "checkpoints").glob(f"{cls.checkpoint_prefix}*.json"))
+
+    # Get the newest readable checkpoint, None when there isn't one yet
+    @classmethod
+    def latest_checkpoint(cls) -> dict | None:
+        for path in reversed(cls.checkpoints()):
+            try:
+                return cls.read_json(path)
+            except (json.JSONDecodeError, OSError):
+                continue
+        return None
+
+    # Save the balance (in cents) of every account as of a timestamp, returns the checkpoint
+    @classmethod
+    @Instrumentation.persisting
+    def write_checkpoint(cls, timestamp: float, balances: dict[str, int]) -> dict:
+        checkpoints = cls.checkpoints()
+        latest = cls.latest_checkpoint()
+        checkpoint = {
+            "sequence": (latest["sequence"] if latest else 0) + 1,
+            "timestamp": timestamp,
+            "balances": balances
+        }
+        path = cls.checkpoints_folder() / f"{cls.checkpoint_prefix}{checkpoint['sequence']:06d}.json"
+        # Journals and pending files first, a checkpoint never gets ahead of the history it covers
+        cls.flush()
+        cls._replace_json(path, checkpoint, sync=True)
+        for old_path in checkpoints[:max(len(checkpoints) + 1 - cls.keep_checkpoints, 0)]:
+            old_path.unlink(missing_ok=True)
+        return checkpoint
+
+    # Apply the transactions an account made after a checkpoint to its checkpointed balance.
+    # Returns the replayed balance, the balance the last replayed record stored and the amount replayed.
+    @classmethod
+    def replay_balance(cls, account, balance: int, since: float | None) -> tuple[int, int | None, int]:
+        from modules.transaction_types import TransactionTypes
+        recorded, replayed = None, 0
+        for record in cls.backend().query_transactions(account, since, None):
+            if since is not None and record.get("timestamp", 0) <= since:
+                continue
+            balance += TransactionTypes.from_record(record["type"]).signed(Money.read(record, "amount"))
+            recorded = Money.read(record, "new_balance")
+            replayed += 1
+        return balance, recorded, replayed
+
+    # Write the columnar store again from every account journal
+    @classmethod
+    def rebuild_columnar_store(cls, accounts: list) -> int:
+        from modules.transaction_types import TransactionTypes
+        cls.flush()
+        ids_by_name = {account.name: account.id for account in accounts}
+
+        def rows() -> Iterator[tuple]:
+            for account in accounts:
+                for record in cls.read_transactions(account):
+                    transferer_id = record.get("transferer_id", ids_by_name.get(record["transferer"], account.id))
+                    receiver_id = record.get("receiver_id", ids_by_name.get(record["receiver"], account.id))
+                    counterparty_id = receiver_id if transferer_id == account.id else transferer_id
+                    yield (account.id, TransactionTypes.from_record(record["type"]), Money.read(record, "amount"),
+                           record.get("timestamp", 0), counterparty_id)
+        return ColumnarStore.rebuild(rows())
+
+    # Write again the columnar rows a crash left in memory, from the journals of every account.
+    # Only runs when the last run didn't flush its rows, otherwise it's a single file lookup.
+    @classmethod
+    def reconcile_columnar_store(cls) -> int:
+        pending = ColumnarStore.pending()
+        if pending is None:
+            return 0
+        since = pending["timestamp"] - ColumnarStore.order_slack_seconds
+        return ColumnarStore.restore(pending["rows"], since, cls._columnar_rows_since(since))
+
+    # Columnar rows (account id, type, amount, timestamp, counterparty id) of every record from a timestamp on
+    @classmethod
+    def _columnar_rows_since(cls, since: float) -> Iterator[tuple]:
+        from types import SimpleNamespace
+        from modules.transaction_types import TransactionTypes
+        for profile in cls.read_account_index():
+            account = SimpleNamespace(**profile)
+            for record in cls.backend().query_transactions(account, since, None):
+                transferer_id = record.get("transferer_id", account.id)
+                receiver_id = record.get("receiver_id", account.id)
+                counterparty_id = receiver_id if transferer_id == account.id else transferer_id
+                yield (account.id, TransactionTypes.from_record(record["type"]), Money.read(record, "amount"),
+                       record.get("timestamp", 0), counterparty_id)
+
+    # Copy every account and transaction from the configured backend into another one
+    @classmethod
+    def migrate_storage(cls, target_name: str) -> tuple[int, int]:
+        from modules.storage_backend import StorageBackend
+        cls.flush()
+        target = StorageBackend.from_name(target_name)
+        if target.name == cls.backend().name:
+            raise ValueError(f"Data is already stored with the {target.name} backend.")
+        migrated = StorageBackend.migrate(cls.backend(), target)
+        target.close()
+        return migrated
+
+    # Move old one-file-per-transaction logs of every account into their journal
+    @classmethod
+    def migrate_transactions(cls, accounts: list) -> int:
+        migrated = 0
+        for account in accounts:
+            migrated += Journal.migrate_transactions_folder(account.transactions_folder_path)
+        return migrated
+
+# Make sure pending writes reach the disk when the program exits
+atexit.register(DataHandler.flush_all)
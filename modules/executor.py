@@ -1,26 +1,135 @@
+import csv, heapq, io, json
+from collections import deque
+from datetime import datetime, timedelta
+
+from modules.money import Money
 from modules.account import Account
+from modules.report import Report
+from modules.session import Session
 from modules.data_handler import DataHandler
+from modules.columnar_store import ColumnarStore
+from modules.transaction_types import TransactionTypes
 from modules.ascii_decorator import AsciiDecorator as Text
 
 class Executor():
 
+    # Account listing: rows per page and the keys it sorts by (ids by their number, so account10 comes after account9)
+    account_page_size: int = 50
+    account_sort_keys: dict = {
+        "balance": lambda account: account.balance,
+        "name": lambda account: account.name.casefold(),
+        "id": lambda account: (len(account.id), account.id)
+    }
+    account_list_formats: tuple[str, ...] = ("table", "json", "csv")
+
+    # Helper function to split '--option value' pairs from positional arguments. Flags never take a value,
+    # and when the known options are given any other option, or one of them without its value, raises ValueError.
+    @staticmethod
+    def parse_options(arguments: list[str], flags: tuple[str, ...] = (),
+                      known: tuple[str, ...] | None = None) -> tuple[list[str], dict[str, str]]:
+        positional: list[str] = []
+        options: dict[str, str] = {}
+        index = 0
+        while index < len(arguments):
+            argument = arguments[index]
+            if argument.startswith("--") and len(argument) > 2:
+                key = argument[2:].lower()
+                if known is not None and key not in known and key not in flags:
+                    raise ValueError(f"Unknown option {argument}, use {', '.join('--' + option for option in known + flags)}.")
+                # Options without a value are flags
+                if key not in flags and index + 1 < len(arguments) and not arguments[index + 1].startswith("--"):
+                    options[key] = arguments[index + 1]
+                    index += 1
+                elif known is not None and key not in flags:
+                    raise ValueError(f"Option {argument} needs a value.")
+                else:
+                    options[key] = "true"
+            else:
+                positional.append(argument)
+            index += 1
+        return positional, options
+
+    # Helper function to turn a date (or date and time) into a timestamp, end of day for dates used as upper bound
+    @staticmethod
+    def parse_timestamp(value: str, end_of_day: bool = False) -> float:
+        moment = datetime.fromisoformat(value)
+        if end_of_day and len(value) <= 10:
+            moment += timedelta(days=1, microseconds=-1)
+        return moment.timestamp()
+
     # Account
 
     @staticmethod
-    def execute_account_list() -> tuple:
-        if len(Account.accounts) == 0:
+    def execute_account_list(arguments=[]) -> tuple:
+        try:
+            _, options = Executor.parse_options(arguments, ("desc",), ("page", "limit", "top", "bottom", "sort", "format"))
+        except ValueError as e:
+            return False, f"{Text.YELLOW}{e}{Text.RESET}"
+        try:
+            page = int(options.get("page", 1))
+            limit = int(options.get("limit", Executor.account_page_size))
+            top = int(options["top"]) if "top" in options else None
+            bottom = int(options["bottom"]) if "bottom" in options else None
+        except ValueError:
+            return False, f"{Text.YELLOW}Page, limit, top and bottom are whole numbers.{Text.RESET}"
+        if min(page, limit, top or 1, bottom or 1) < 1:
+            return False, f"{Text.YELLOW}Page, limit, top and bottom start at 1.{Text.RESET}"
+        sort = options.get("sort", "balance" if top or bottom else "").lower()
+        if sort and sort not in Executor.account_sort_keys:
+            return False, f"{Text.YELLOW}Unknown sort {sort}, use {', '.join(Executor.account_sort_keys)}.{Text.RESET}"
+        output_format = options.get("format", "table").lower()
+        if output_format not in Executor.account_list_formats:
+            return False, f"{Text.YELLOW}Unknown format {output_format}, use {', '.join(Executor.account_list_formats)}.{Text.RESET}"
+
+        accounts = Account.accounts
+        total = len(accounts)
+        if total == 0 and output_format == "table":
             return True, f"{Text.YELLOW}There's no account in the system.{Text.RESET}"
+
+        # Top and bottom k (and sorted pages) come from a heap of k items instead of sorting everything,
+        # unsorted pages are a slice of the registry, so only the accounts shown have their balance read
+        pages = max(-(-total // limit), 1)
+        if top is not None or bottom is not None:
+            select = heapq.nlargest if top is not None else heapq.nsmallest
+            rows = select(top or bottom, accounts, key=Executor.account_sort_keys[sort])
+            title = f"{'Top' if top is not None else 'Bottom'} {len(rows)} account(s) by {sort}."
         else:
-            print(f"{Text.CYAN}All account in the system.{Text.RESET}")
-            print(f"{Text.CYAN}{'-'*50}{Text.RESET}")
-            print(f"{Text.CYAN}{'Account Name':<25} {'Account Id':<15} {'Balance':<10} {Text.RESET}")
-            for account in Account.accounts:
-                if account == Account.current_account:
-                    # Current Account
-                    print(f"{Text.BLACK}{Text.BG_WHITE}{account.name:<25} {account.id:<15} {float(account.balance):<10.2f}{Text.RESET}")
-                else:
-                    print(f"{account.name:<25} {account.id:<15} {float(account.balance):<10.2f}")
-            return True, f"{Text.GREEN}Now using: {Account.current_account}{Text.RESET}"
+            start = (page - 1) * limit
+            if sort:
+                select = heapq.nlargest if "desc" in options else heapq.nsmallest
+                rows = select(start + limit, accounts, key=Executor.account_sort_keys[sort])[start:]
+            elif "desc" in options:
+                rows = accounts[max(total - start - limit, 0):max(total - start, 0)][::-1]
+            else:
+                rows = accounts[start:start + limit]
+            title = f"Accounts {start + 1}-{start + len(rows)} of {total} (page {page} of {pages})." if rows else \
+                f"There's no account on page {page} of {pages}."
+
+        # Machine-readable output is the whole log, without any colour
+        if output_format == "json":
+            return True, json.dumps([{"id": account.id, "name": account.name, "balance_cents": account.balance} for account in rows])
+        if output_format == "csv":
+            output = io.StringIO()
+            writer = csv.writer(output, lineterminator="\n")
+            writer.writerow(["id", "name", "balance"])
+            writer.writerows([account.id, account.name, Money.format(account.balance)] for account in rows)
+            return True, output.getvalue().rstrip("\n")
+
+        # The table is written at once
+        current_account = Session.current().current_account
+        lines = [
+            f"{Text.CYAN}{title}{Text.RESET}",
+            f"{Text.CYAN}{'-'*50}{Text.RESET}",
+            f"{Text.CYAN}{'Account Name':<25} {'Account Id':<15} {'Balance':<10} {Text.RESET}"
+        ]
+        for account in rows:
+            if account is current_account:
+                # Current Account
+                lines.append(f"{Text.BLACK}{Text.BG_WHITE}{account.name:<25} {account.id:<15} {Money.format(account.balance):<10}{Text.RESET}")
+            else:
+                lines.append(f"{account.name:<25} {account.id:<15} {Money.format(account.balance):<10}")
+        print("\n".join(lines))
+        return True, f"{Text.GREEN}Now using: {current_account}{Text.RESET}"
 
     @staticmethod
     def execute_account_login(arguments=[]) -> tuple:
@@ -31,16 +140,16 @@ class Executor():
             return False, f"{Text.YELLOW}Required an account name or account id to login.{Text.RESET}"
         if arguments[0].strip() == "":
             return False, f"{Text.YELLOW}Missing an argument for the account name or id.{Text.RESET}"
-        if Account.current_account:
+        if Session.current().current_account:
             # Already logged into request account.
-            if arguments[0] == Account.current_account.name or arguments[0] == Account.current_account.id:
+            if arguments[0] == Session.current().current_account.name or arguments[0] == Session.current().current_account.id:
                 return True, f"{Text.GREEN}You're already using this account.{Text.RESET}"
         # Find account
         account = Account.find_account(arguments[0])
         # Change current account
         if account:
-            Account.current_account = account
-            return True, f"{Text.GREEN}Successfully logged into {Account.current_account}{Text.RESET}"
+            Session.current().current_account = account
+            return True, f"{Text.GREEN}Successfully logged into {Session.current().current_account}{Text.RESET}"
         return False, f"{Text.YELLOW}There's no account named or using id {arguments[0]}.{Text.RESET}"
     
     @staticmethod
@@ -50,26 +159,27 @@ class Executor():
             return False, f"{Text.YELLOW}Required at least an argument to use this command.{Text.RESET}"
         if arguments[0].strip() == "":
             return False, f"{Text.YELLOW}Missing an argument for the account name.{Text.RESET}"
+        if Account.name_taken(arguments[0]):
+            return False, f"{Text.YELLOW}There's already an account named {arguments[0]}, or the name looks like an account id.{Text.RESET}"
         # Create account
-        account = Account.create_account(arguments[0])
         try:
-            if DataHandler.exists_in_list(arguments, 1):
-                account.balance = float(arguments[1])
-        except:
-            account.balance = 0
-        Account.current_account = account
-        return True, f"{Text.GREEN}Successfully created and logged into account named {account.name} with the balance of {account.balance:.2f}.{Text.RESET}"
+            balance = Money.parse(arguments[1]) if DataHandler.exists_in_list(arguments, 1) else 0
+        except ValueError:
+            balance = 0
+        account = Account.create_account(arguments[0], balance)
+        Session.current().current_account = account
+        return True, f"{Text.GREEN}Successfully created and logged into account named {account.name} with the balance of {Money.format(account.balance)}.{Text.RESET}"
     
     @staticmethod
     def execute_account_balance() -> tuple:
-        if Account.current_account == None:
+        if Session.current().current_account == None:
             return False, "You're not using any account."
-        return True, f"{Text.GREEN}{Account.current_account.name} has the balance of {Account.current_account.balance:.2f}{Text.RESET}"
+        return True, f"{Text.GREEN}{Session.current().current_account.name} has the balance of {Money.format(Session.current().current_account.balance)}{Text.RESET}"
     
     @staticmethod
     def execute_account_modify(arguments=[]) -> tuple:
         # Check arguments
-        if Account.current_account == None:
+        if Session.current().current_account == None:
             return False, f"{Text.YELLOW}You're not using any account.{Text.RESET}"
         if len(arguments) < 2:
             return False, f"{Text.YELLOW}Required attribute and value arguments to use this command.{Text.RESET}"
@@ -83,7 +193,7 @@ class Executor():
     @staticmethod
     def execute_account_delete(arguments=[]) -> tuple:
         # Check arguments
-        if Account.current_account == None:
+        if Session.current().current_account == None:
             return False, f"{Text.YELLOW}You're not using any account.{Text.RESET}"
         if len(arguments) < 1:
             return False, f"{Text.YELLOW}Required an account argument to use this command.{Text.RESET}"
@@ -97,49 +207,53 @@ class Executor():
 
     @staticmethod
     def execute_transaction_deposit(arguments=[]) -> tuple:
-        if Account.current_account == None:
+        if Session.current().current_account == None:
             return False, f"{Text.YELLOW}You're not using any account.{Text.RESET}"
         # Check arguments
         if len(arguments) < 1:
             return False, f"{Text.YELLOW}Required at least an argument to use this command.{Text.RESET}"
         if arguments[0].strip() == "":
             return False, f"{Text.YELLOW}Missing an argument for the amount.{Text.RESET}"
-        # Deposit
+        # Deposit, filed under a category given after the amount or with --category
+        positional, options = Executor.parse_options(arguments)
+        category = options.get("category", positional[1] if len(positional) >= 2 else None)
         try:
-            amount = float(arguments[0])
-            _, log = Account.current_account.deposit(amount, True)
-            return True, log
+            amount = Money.parse(positional[0])
+            success, log = Session.current().current_account.deposit(amount, True, category)
+            return success, log
         except Exception as e:
             from modules.parser import Parser
-            if Parser.debug_mode:
+            if Parser.current_debug_mode():
                 return False, Parser.traceback_exception(e)
                 
         return False, f"{Text.YELLOW}Something went wrong, please try again later.{Text.RESET}"
     
     @staticmethod
     def execute_transaction_withdraw(arguments=[]) -> tuple:
-        if Account.current_account == None:
+        if Session.current().current_account == None:
             return False, f"{Text.YELLOW}You're not using any account.{Text.RESET}"
         # Check arguments
         if len(arguments) < 1:
             return False, f"{Text.YELLOW}Required at least an argument to use this command.{Text.RESET}"
         if arguments[0].strip() == "":
             return False, f"{Text.YELLOW}Missing an argument for the amount.{Text.RESET}"
-        # Withdraw
+        # Withdraw, filed under a category given after the amount or with --category
+        positional, options = Executor.parse_options(arguments)
+        category = options.get("category", positional[1] if len(positional) >= 2 else None)
         try:
-            amount = float(arguments[0])
-            _, log = Account.current_account.withdraw(amount, True)
-            return True, log
+            amount = Money.parse(positional[0])
+            success, log = Session.current().current_account.withdraw(amount, True, category)
+            return success, log
         except Exception as e:
             from modules.parser import Parser
-            if Parser.debug_mode:
+            if Parser.current_debug_mode():
                 return False, Parser.traceback_exception(e)
                 
         return False, f"{Text.YELLOW}Something went wrong, please try again later.{Text.RESET}"
     
     @staticmethod
     def execute_transaction_transfer(arguments=[]) -> tuple:
-        if Account.current_account == None:
+        if Session.current().current_account == None:
             return False, f"{Text.YELLOW}You're not using any account.{Text.RESET}"
         # Check arguments
         if len(arguments) < 2:
@@ -152,18 +266,468 @@ class Executor():
         try:
             target_account = Account.find_account(arguments[0])
             if target_account:
-                amount = float(arguments[1])
-                _, log = Account.current_account.transfer(target_account, amount)
-                return True, log
+                amount = Money.parse(arguments[1])
+                success, log = Session.current().current_account.transfer(target_account, amount)
+                return success, log
             else:
                 return False, f"{Text.YELLOW}Targeted account to transfer can't be found.{Text.RESET}"
         except Exception as e:
             from modules.parser import Parser
-            if Parser.debug_mode:
+            if Parser.current_debug_mode():
                 return False, Parser.traceback_exception(e)
                 
         return False, f"{Text.YELLOW}Something went wrong, please try again later.{Text.RESET}"
-    
+
+    # Helper function to read (account, amount) pairs given as 'Account:Amount', 'Account Amount' or a
+    # CSV file of account,amount rows. Returns the pairs as written, a header row is skipped.
+    @staticmethod
+    def read_bulk_pairs(positional: list[str], file_path: str | None) -> list[tuple[str, str]]:
+        pairs: list[tuple[str, str]] = []
+        index = 0
+        while index < len(positional):
+            if ":" in positional[index]:
+                name, _, amount = positional[index].rpartition(":")
+                pairs.append((name, amount))
+                index += 1
+            elif index + 1 < len(positional):
+                pairs.append((positional[index], positional[index + 1]))
+                index += 2
+            else:
+                raise ValueError(f"Account {positional[index]} has no amount.")
+
+        if file_path is not None:
+            with open(file_path, "r", newline="") as file:
+                for line_number, row in enumerate(csv.reader(file), 1):
+                    if not row or not row[0].strip() or row[0].lstrip().startswith("#"):
+                        continue
+                    if len(row) < 2:
+                        raise ValueError(f"Line {line_number} of {file_path} isn't an account,amount row.")
+                    if line_number == 1 and row[1].strip().lower() in ("amount", "amount_cents"):
+                        continue
+                    pairs.append((row[0].strip(), row[1].strip()))
+        return pairs
+
+    @staticmethod
+    def execute_transaction_bulk(arguments=[]) -> tuple:
+        account = Session.current().current_account
+        if account == None:
+            return False, f"{Text.YELLOW}You're not using any account.{Text.RESET}"
+        try:
+            positional, options = Executor.parse_options(arguments, ("collect",), ("file",))
+            pairs = Executor.read_bulk_pairs(positional, options.get("file"))
+        except FileNotFoundError:
+            return False, f"{Text.YELLOW}There's no file at {options['file']}.{Text.RESET}"
+        except ValueError as e:
+            return False, f"{Text.YELLOW}{e}{Text.RESET}"
+        if not pairs:
+            return False, f"{Text.YELLOW}Required target accounts and amounts, inline or with --file, to use this command.{Text.RESET}"
+
+        # Every target is resolved before anything moves, so one unknown name rejects the whole batch
+        legs, unknown, invalid = [], [], []
+        for name, amount in pairs:
+            target = Account.find_account(name)
+            if target is None:
+                unknown.append(name)
+                continue
+            try:
+                legs.append((target, Money.parse(amount)))
+            except ValueError:
+                invalid.append(f"{name} {amount}")
+        if unknown:
+            shown = ", ".join(unknown[:5]) + (f" and {len(unknown) - 5} more" if len(unknown) > 5 else "")
+            return False, f"{Text.YELLOW}Nothing was transferred, there's no account named or using id {shown}.{Text.RESET}"
+        if invalid:
+            return False, f"{Text.YELLOW}Nothing was transferred, {invalid[0]} isn't a valid amount.{Text.RESET}"
+
+        return account.bulk_transfer(legs, "collect" in options)
+
+    @staticmethod
+    def execute_transaction_history(arguments=[]) -> tuple:
+        if Session.current().current_account == None:
+            return False, f"{Text.YELLOW}You're not using any account.{Text.RESET}"
+        _, options = Executor.parse_options(arguments)
+
+        # Build filters
+        try:
+            start = Executor.parse_timestamp(options["from"]) if "from" in options else None
+            end = Executor.parse_timestamp(options["to"], True) if "to" in options else None
+            if "days" in options:
+                start = (datetime.now() - timedelta(days=float(options["days"]))).timestamp()
+            min_amount = Money.parse(options["min"]) if "min" in options else None
+            max_amount = Money.parse(options["max"]) if "max" in options else None
+            limit = int(options.get("limit", 20))
+        except ValueError:
+            return False, f"{Text.YELLOW}Invalid filter value. Dates use YYYY-MM-DD, amounts and limit are numbers.{Text.RESET}"
+        if limit < 1:
+            return False, f"{Text.YELLOW}The limit starts at 1.{Text.RESET}"
+
+        types = None
+        if "type" in options:
+            try:
+                types = {str(TransactionTypes[name.strip().upper()]) for name in options["type"].split(",")}
+            except KeyError:
+                return False, f"{Text.YELLOW}Unknown transaction type in {options['type']}. Use {', '.join(t.name.lower() for t in TransactionTypes)}.{Text.RESET}"
+
+        counterparty = None
+        if "with" in options:
+            counterparty = Account.find_account(options["with"])
+            if counterparty is None:
+                return False, f"{Text.YELLOW}There's no account named or using id {options['with']}.{Text.RESET}"
+
+        # Keep only the newest matching records
+        records = deque(DataHandler.query_transactions(Session.current().current_account, start, end, types,
+                                                       min_amount, max_amount, counterparty, options.get("category")), maxlen=limit)
+        if len(records) == 0:
+            return True, f"{Text.YELLOW}No transaction matches the given filters.{Text.RESET}"
+
+        print(f"{Text.CYAN}Transactions of {Session.current().current_account}.{Text.RESET}")
+        print(f"{Text.CYAN}{'-'*111}{Text.RESET}")
+        print(f"{Text.CYAN}{'Date':<20} {'Id':<26} {'Type':<10} {'Amount':<12} {'Balance':<12} {'From':<14} {'To':<14}{Text.RESET}")
+        for record in records:
+            date = datetime.fromtimestamp(DataHandler.posted(record)).strftime("%Y-%m-%d %H:%M:%S")
+            transaction_type = record["type"].removeprefix("TransactionTypes.")
+            print(f"{date:<20} {record['id']:<26} {transaction_type:<10} {Money.format(Money.read(record, 'amount')):<12} {Money.format(Money.read(record, 'new_balance')):<12} {record['transferer']:<14} {record['receiver']:<14}")
+        return True, f"{Text.GREEN}Showing the last {len(records)} matching transaction(s).{Text.RESET}"
+
+    @staticmethod
+    def execute_transaction_import(arguments=[]) -> tuple:
+        from modules.statement_import import StatementImporter
+        positional, options = Executor.parse_options(arguments)
+        if len(positional) < 1 or positional[0].strip() == "":
+            return False, f"{Text.YELLOW}Missing an argument for the statement file.{Text.RESET}"
+
+        account = Session.current().current_account
+        if "account" in options:
+            account = Account.find_account(options["account"])
+            if account is None:
+                return False, f"{Text.YELLOW}There's no account named or using id {options['account']}.{Text.RESET}"
+        if account == None:
+            return False, f"{Text.YELLOW}You're not using any account.{Text.RESET}"
+
+        try:
+            batch_size = int(options["batch-size"]) if "batch-size" in options else None
+        except ValueError:
+            return False, f"{Text.YELLOW}The batch size must be a number.{Text.RESET}"
+        columns = {field: options[field] for field in StatementImporter.column_candidates if field in options}
+        delimiter = options.get("delimiter", ",")
+        delimiter = "\t" if delimiter.lower() in ("tab", "\\t") else delimiter
+        importer = StatementImporter(account, positional[0], options.get("format"), columns,
+                                     options.get("date-format", "%Y-%m-%d"), delimiter, batch_size)
+        try:
+            return importer.run()
+        except FileNotFoundError:
+            return False, f"{Text.YELLOW}There's no statement file at {positional[0]}.{Text.RESET}"
+        except ValueError as e:
+            return False, f"{Text.YELLOW}{e}{Text.RESET}"
+
+    @staticmethod
+    def execute_transaction_export(arguments=[]) -> tuple:
+        from modules.ledger_export import LedgerExporter
+        positional, options = Executor.parse_options(arguments)
+        output_path = positional[0] if len(positional) >= 1 and positional[0].strip() != "" else "-"
+
+        accounts = Account.accounts
+        if "account" in options:
+            accounts = []
+            for name in options["account"].split(","):
+                account = Account.find_account(name.strip())
+                if account is None:
+                    return False, f"{Text.YELLOW}There's no account named or using id {name.strip()}.{Text.RESET}"
+                accounts.append(account)
+        try:
+            start = Executor.parse_timestamp(options["from"]) if "from" in options else None
+            end = Executor.parse_timestamp(options["to"], True) if "to" in options else None
+            workers = int(options["workers"]) if "workers" in options else None
+        except ValueError:
+            return False, f"{Text.YELLOW}Invalid option value. Dates use YYYY-MM-DD and workers is a number.{Text.RESET}"
+
+        try:
+            exporter = LedgerExporter(list(accounts), output_path, options.get("format"), start, end, workers)
+            return exporter.run()
+        except ValueError as e:
+            return False, f"{Text.YELLOW}{e}{Text.RESET}"
+        except OSError as e:
+            return False, f"{Text.YELLOW}Cannot write the export to {output_path} ({e.strerror}).{Text.RESET}"
+
+    # Standing Orders
+
+    @staticmethod
+    def execute_transaction_schedule(arguments=[]) -> tuple:
+        from modules.standing_orders import StandingOrders
+        account = Session.current().current_account
+        if account == None:
+            return False, f"{Text.YELLOW}You're not using any account.{Text.RESET}"
+        positional, options = Executor.parse_options(arguments)
+        kinds = {"+": "deposit", "-": "withdraw", ">": "transfer"}
+        kind = kinds.get(positional[0], positional[0].lower()) if positional else ""
+        if kind not in StandingOrders.kinds:
+            return False, f"{Text.YELLOW}Start with the order to make: deposit (+), withdraw (-) or transfer (>).{Text.RESET}"
+        if "every" not in options:
+            return False, f"{Text.YELLOW}Missing --every once/daily/weekly/monthly or a cron expression.{Text.RESET}"
+
+        target = None
+        if kind == "transfer":
+            if len(positional) < 3:
+                return False, f"{Text.YELLOW}Required target account and amount arguments to use this command.{Text.RESET}"
+            target = Account.find_account(positional[1])
+            if target is None:
+                return False, f"{Text.YELLOW}Targeted account to transfer can't be found.{Text.RESET}"
+        elif len(positional) < 2:
+            return False, f"{Text.YELLOW}Missing an argument for the amount.{Text.RESET}"
+
+        try:
+            amount = Money.parse(positional[-1])
+            start = Executor.parse_timestamp(options["start"]) if "start" in options else None
+            times = int(options["times"]) if "times" in options else None
+            order = StandingOrders.schedule(account, kind, amount, options["every"], start, target, times, options.get("category"))
+        except ValueError as e:
+            return False, f"{Text.YELLOW}{e}{Text.RESET}"
+        due = datetime.fromtimestamp(order["next_due"]).strftime("%Y-%m-%d %H:%M")
+        return True, f"{Text.GREEN}Scheduled order {order['id']}: {kind} {Money.format(amount)} {order['every']}, first run on {due}.{Text.RESET}"
+
+    @staticmethod
+    def execute_transaction_orders(arguments=[]) -> tuple:
+        from modules.standing_orders import StandingOrders
+        # Run whatever is due right away
+        if len(arguments) >= 1 and arguments[0].lower() == "run":
+            counts = StandingOrders.run_due()
+            return True, f"{Text.GREEN}{StandingOrders.describe(counts) or 'No standing order is due.'}{Text.RESET}"
+
+        account = Session.current().current_account
+        if account == None:
+            return False, f"{Text.YELLOW}You're not using any account.{Text.RESET}"
+        orders = sorted(StandingOrders.orders(account).values(), key=lambda order: order["next_due"])
+        if not orders:
+            return True, f"{Text.YELLOW}{account} has no standing order.{Text.RESET}"
+
+        lines = [
+            f"{Text.CYAN}Standing orders of {account}.{Text.RESET}",
+            f"{Text.CYAN}{'-'*111}{Text.RESET}",
+            f"{Text.CYAN}{'Id':<26} {'Order':<10} {'Amount':<12} {'To':<14} {'Every':<16} {'Next Run':<17} {'Runs':<6} {'Failed':<6}{Text.RESET}"
+        ]
+        for order in orders:
+            target = Account.find_account(order["target_id"]) if order["target_id"] else None
+            due = "disabled" if order.get("disabled") else datetime.fromtimestamp(order["next_due"]).strftime("%Y-%m-%d %H:%M")
+            lines.append(f"{order['id']:<26} {order['kind']:<10} {Money.format(order['amount_cents']):<12} {str(target or '-'):<14} "
+                         f"{order['every']:<16} {due:<17} {order['runs']:<6} {order['failures']:<6}")
+        print("\n".join(lines))
+        return True, f"{Text.GREEN}{account} has {len(orders)} standing order(s).{Text.RESET}"
+
+    @staticmethod
+    def execute_transaction_unschedule(arguments=[]) -> tuple:
+        from modules.standing_orders import StandingOrders
+        account = Session.current().current_account
+        if account == None:
+            return False, f"{Text.YELLOW}You're not using any account.{Text.RESET}"
+        if len(arguments) < 1 or arguments[0].strip() == "":
+            return False, f"{Text.YELLOW}Missing an argument for the order id.{Text.RESET}"
+        if not StandingOrders.cancel(account, arguments[0].upper()):
+            return False, f"{Text.YELLOW}{account} has no standing order {arguments[0]}.{Text.RESET}"
+        return True, f"{Text.GREEN}Cancelled standing order {arguments[0].upper()}.{Text.RESET}"
+
+    @staticmethod
+    def execute_transaction_budget(arguments=[]) -> tuple:
+        from modules.budgets import Budgets
+        account = Session.current().current_account
+        if account == None:
+            return False, f"{Text.YELLOW}You're not using any account.{Text.RESET}"
+        positional, options = Executor.parse_options(arguments)
+        period = options.get("period", "monthly" if len(positional) >= 2 and positional[1].lower() != "off" else None)
+
+        # Set or remove the budget of a category
+        if len(positional) >= 2:
+            if positional[1].lower() == "off":
+                name = f"{period.lower()} {positional[0].lower()}" if period else positional[0].lower()
+                if not Budgets.remove_budget(account, positional[0], period.lower() if period else None):
+                    return False, f"{Text.YELLOW}{account} has no {name} budget.{Text.RESET}"
+                return True, f"{Text.GREEN}Removed the {name} budget of {account}.{Text.RESET}"
+            try:
+                budget = Budgets.set_budget(account, positional[0], Money.parse(positional[1]), period.lower())
+            except ValueError as e:
+                return False, f"{Text.YELLOW}{e}{Text.RESET}"
+            return True, f"{Text.GREEN}{Budgets.describe(positional[0].lower(), period.lower(), budget)}{Text.RESET}"
+        if len(positional) == 1:
+            return False, f"{Text.YELLOW}Missing an argument for the amount (or off).{Text.RESET}"
+
+        # Show every budget with what is spent of it in the current period
+        budgets = Budgets.status(account)
+        lines = [
+            f"{Text.CYAN}Budgets of {account}.{Text.RESET}",
+            f"{Text.CYAN}{'-'*70}{Text.RESET}",
+            f"{Text.CYAN}{'Category':<12} {'Period':<10} {'Budget':<12} {'Spent':<12} {'Left':<12} {'Used':<6}{Text.RESET}"
+        ]
+        for category, budget_period, limit, spent in budgets:
+            colour = Text.RED if spent > limit else Text.YELLOW if spent >= limit * Budgets.warn_share else ""
+            lines.append(f"{colour}{category:<12} {budget_period:<10} {Money.format(limit):<12} {Money.format(spent):<12} "
+                         f"{Money.format(max(limit - spent, 0)):<12} {f'{spent * 100 // limit}%':<6}{Text.RESET}")
+        lines.append(f"{Text.CYAN}Income: {', '.join(Budgets.income_categories)}. Expense: {', '.join(Budgets.expense_categories)}.{Text.RESET}")
+        print("\n".join(lines))
+        return True, f"{Text.GREEN}{account} has {len(budgets)} budget(s).{Text.RESET}"
+
+    # Report
+
+    @staticmethod
+    def execute_report(period: str, arguments=[]) -> tuple:
+        if len(Account.accounts) == 0:
+            return False, f"{Text.YELLOW}There's no account in the system.{Text.RESET}"
+        key = arguments[0].strip() if len(arguments) >= 1 and arguments[0].strip() != "" else None
+        path = Report.generate(Account.accounts, period, key)
+        return True, f"{Text.GREEN}Saved {period} savings report to {path}.{Text.RESET}"
+
+    @staticmethod
+    def execute_report_daily(arguments=[]) -> tuple:
+        return Executor.execute_report("daily", arguments)
+
+    @staticmethod
+    def execute_report_weekly(arguments=[]) -> tuple:
+        return Executor.execute_report("weekly", arguments)
+
+    @staticmethod
+    def execute_report_monthly(arguments=[]) -> tuple:
+        return Executor.execute_report("monthly", arguments)
+
+    @staticmethod
+    def execute_report_rebuild() -> tuple:
+        DataHandler.flush()
+        from modules.budgets import Budgets
+        replayed = Report.rebuild(Account.accounts)
+        DataHandler.rebuild_columnar_store(Account.accounts)
+        counted = Budgets.rebuild(Account.accounts)
+        return True, f"{Text.GREEN}Rebuilt report rollups and columnar store of {len(Account.accounts)} account(s) from {replayed} transaction(s), budgets from {counted}.{Text.RESET}"
+
+    @staticmethod
+    def execute_report_totals(arguments=[]) -> tuple:
+        _, options = Executor.parse_options(arguments)
+        try:
+            start = Executor.parse_timestamp(options["from"]) if "from" in options else None
+            end = Executor.parse_timestamp(options["to"], True) if "to" in options else None
+        except ValueError:
+            return False, f"{Text.YELLOW}Invalid date. Dates use YYYY-MM-DD.{Text.RESET}"
+
+        # Scan the columnar store, both for every account and for the current one
+        scopes = [("All accounts", None)]
+        if Session.current().current_account:
+            scopes.append((str(Session.current().current_account), Session.current().current_account.id))
+        print(f"{Text.CYAN}{'Scope':<25} {''.join(f'{t.name:<14}' for t in TransactionTypes)}{Text.RESET}")
+        print(f"{Text.CYAN}{'-'*(25 + 14 * len(TransactionTypes))}{Text.RESET}")
+        for name, account_id in scopes:
+            totals = ColumnarStore.sum_by_type(account_id, start, end)
+            print(f"{name:<25} {''.join(f'{Money.format(totals.get(t.name, 0)):<14}' for t in TransactionTypes)}")
+        return True, f"{Text.GREEN}Summed transactions from the columnar store.{Text.RESET}"
+
+    @staticmethod
+    def execute_report_audit(arguments=[]) -> tuple:
+        from modules.audit import LedgerAudit
+        _, options = Executor.parse_options(arguments)
+        try:
+            workers = int(options["workers"]) if "workers" in options else None
+        except ValueError:
+            return False, f"{Text.YELLOW}The amount of workers must be a number.{Text.RESET}"
+        if workers is not None and workers < 1:
+            return False, f"{Text.YELLOW}Cannot audit with less than 1 worker.{Text.RESET}"
+
+        # Recompute every balance from the transaction history and match up the transfer legs
+        audit = LedgerAudit(list(Account.accounts), workers)
+        passed = audit.run()
+        print(f"{Text.CYAN}{'Account Name':<25} {'Opening':<14} {'History':<14} {'Balance':<14} {'Transactions':<14} {'Status':<10}{Text.RESET}")
+        print(f"{Text.CYAN}{'-'*95}{Text.RESET}")
+        balances = {account.id: account for account in audit.accounts}
+        for result in audit.results:
+            account = balances[result["id"]]
+            matches = result["balance"] == account.balance and result["opening_balance"] == 0 and result["chain_breaks"] == 0
+            status = f"{Text.GREEN}OK{Text.RESET}" if matches else f"{Text.RED}MISMATCH{Text.RESET}"
+            print(f"{account.name:<25} {Money.format(result['opening_balance']):<14} {Money.format(result['balance']):<14} {Money.format(account.balance):<14} {result['transactions']:<14} {status}")
+        for discrepancy in audit.discrepancies:
+            print(f"{Text.YELLOW}{discrepancy}{Text.RESET}")
+        path = audit.save()
+
+        if not passed:
+            return False, f"{Text.YELLOW}Found {len(audit.discrepancies)} discrepancy(ies) in {len(audit.results)} account(s), saved the audit to {path}.{Text.RESET}"
+        return True, f"{Text.GREEN}All {len(audit.results)} account(s) add up to their history, saved the audit to {path}.{Text.RESET}"
+
+    # Persistence
+
+    @staticmethod
+    def execute_flush() -> tuple:
+        profiles = Account.flush_profiles()
+        DataHandler.flush()
+        return True, f"{Text.GREEN}Saved {profiles} changed account profile(s) to disk.{Text.RESET}"
+
+    @staticmethod
+    def execute_verify() -> tuple:
+        checkpoint = DataHandler.latest_checkpoint()
+        DataHandler.flush()
+
+        # Compare checkpoint + replayed history with the balance in use and the balance history recorded,
+        # before the first checkpoint every history is replayed from the start
+        if checkpoint is None:
+            print(f"{Text.CYAN}No checkpoint yet, replaying every history.{Text.RESET}")
+        else:
+            print(f"{Text.CYAN}Checkpoint #{checkpoint['sequence']} ({datetime.fromtimestamp(checkpoint['timestamp']).strftime('%Y-%m-%d %H:%M:%S')}){Text.RESET}")
+        print(f"{Text.CYAN}{'-'*95}{Text.RESET}")
+        print(f"{Text.CYAN}{'Account Name':<25} {'Checkpoint':<14} {'Replayed':<10} {'Balance':<14} {'Recorded':<14} {'Status':<10}{Text.RESET}")
+        drifted, replayed_total = 0, 0
+        for account in Account.accounts:
+            with account.lock:
+                checkpointed = checkpoint["balances"].get(account.id) if checkpoint is not None else None
+                if checkpointed is None:
+                    # No checkpoint or created after it, only its own history can be checked
+                    _, recorded, replayed = DataHandler.replay_balance(account, 0, None)
+                    expected = recorded if recorded is not None else account.balance
+                else:
+                    expected, recorded, replayed = DataHandler.replay_balance(account, checkpointed, checkpoint["timestamp"])
+                matches = expected == account.balance and recorded in (None, expected)
+                balance = account.balance
+            replayed_total += replayed
+            if not matches:
+                drifted += 1
+            status = f"{Text.GREEN}OK{Text.RESET}" if matches else f"{Text.RED}DRIFT{Text.RESET}"
+            checkpoint_text = Money.format(checkpointed) if checkpointed is not None else "-"
+            recorded_text = Money.format(recorded) if recorded is not None else "-"
+            print(f"{account.name:<25} {checkpoint_text:<14} {replayed:<10} {Money.format(balance):<14} {recorded_text:<14} {status}")
+
+        if drifted:
+            return False, f"{Text.YELLOW}Found drift in {drifted} of {len(Account.accounts)} account(s).{Text.RESET}"
+        source = f"checkpoint #{checkpoint['sequence']} plus" if checkpoint is not None else "their"
+        return True, f"{Text.GREEN}All {len(Account.accounts)} account balance(s) match {source} {replayed_total} replayed transaction(s).{Text.RESET}"
+
+    # Instrumentation
+
+    @staticmethod
+    def execute_debug_stats(arguments=[]) -> tuple:
+        from modules.instrumentation import Instrumentation
+        action = arguments[0].lower() if len(arguments) >= 1 else "show"
+        match (action):
+            case "reset":
+                Instrumentation.reset()
+                return True, f"{Text.GREEN}Cleared every command timing and I/O counter.{Text.RESET}"
+            case "export":
+                if len(arguments) < 2 or arguments[1].strip() == "":
+                    return False, f"{Text.YELLOW}Missing an argument for the export file.{Text.RESET}"
+                path = Instrumentation.export(arguments[1])
+                return True, f"{Text.GREEN}Exported command timings and I/O counters to {path}.{Text.RESET}"
+            case "show":
+                pass
+            case _:
+                return False, f"{Text.YELLOW}Unknown stats action {arguments[0]}. Use reset or export.{Text.RESET}"
+
+        # Latency of every command by phase, in milliseconds
+        snapshot = Instrumentation.snapshot()
+        print(f"{Text.CYAN}{'Command':<20} {'Phase':<10} {'Count':<8} {'Mean':<10} {'p50':<10} {'p95':<10} {'p99':<10} {'Max':<10}{Text.RESET}")
+        print(f"{Text.CYAN}{'-'*95}{Text.RESET}")
+        for command, phases in snapshot["commands"].items():
+            for phase in Instrumentation.phases:
+                stats = phases[phase]
+                timings = "".join(f"{stats[key] * 1000:<11.3f}" for key in ("mean", "p50", "p95", "p99", "max"))
+                print(f"{command:<20} {phase:<10} {stats['count']:<8} {timings}")
+        print(f"{Text.CYAN}{'-'*95}{Text.RESET}")
+        for name, value in snapshot["io"].items():
+            print(f"{name:<20} {value:.6f}" if isinstance(value, float) else f"{name:<20} {value}")
+
+        if not snapshot["enabled"]:
+            return True, f"{Text.YELLOW}Instrumentation is off, turn on debug mode to measure commands.{Text.RESET}"
+        return True, f"{Text.GREEN}Showing timings (ms) of {len(snapshot['commands'])} command(s).{Text.RESET}"
+
     # Help Command
     @staticmethod
     def command_help():
@@ -180,17 +744,21 @@ class Executor():
 
         # Description
         prefix_descriptions = {
-            "DEBUG": "Toggle debug mode for developer.",
+            "DEBUG": "Toggle debug mode, 'debug stats [reset/export File]' shows command timings.",
             "HELP": "Show help message.",
             "CLEAR": "Clear the terminal.",
             "VERSION": "Show the program version",
             "EXIT": "Exit the program.",
+            "FLUSH": "Save every pending change to disk.",
+            "VERIFY": "Check balances against the last checkpoint.",
             "ACCOUNT": "Account related commands.",
             "TRANSACTION": "Transaction related commands.", 
+            "REPORT": "Savings report related commands.",
             "SOB": ":("
         }
 
         account_sub_command_description = {
+            "ACC_LIST": "List accounts a page at a time, sorted or as top/bottom k.",
             "ACC_LOGIN": "Log into an account.",
             "ACC_CREATE": "Create an new account",
             "ACC_BALANCE": "Query an existing account balance.",
@@ -199,6 +767,7 @@ class Executor():
         }
 
         account_sub_command_syntax = {
+            "ACC_LIST": "acc list [<--sort balance/name/id>] [<--desc>] [<--page N>] [<--limit N>] [<--top/--bottom K>] [<--format table/json/csv>]",
             "ACC_LOGIN": "acc log [Account Name]",
             "ACC_CREATE": "acc new [Account Name] [<Starting Balance>]",
             "ACC_BALANCE": "acc balance",
@@ -208,13 +777,29 @@ class Executor():
         transaction_sub_command_description = {
             "T_DEPOSIT": "Deposit money into an existing account.",
             "T_WITHDRAW": "Withdraw money from an existing account.",
-            "T_TRANSFER": "Transfer money from A to B account."
+            "T_TRANSFER": "Transfer money from A to B account.",
+            "T_BULK": "Transfer to (or --collect from) many accounts in one batch.",
+            "T_HISTORY": "Show past transactions with filters.",
+            "T_IMPORT": "Import a CSV or OFX bank statement.",
+            "T_EXPORT": "Export accounts and history as CSV or JSON Lines.",
+            "T_SCHEDULE": "Schedule a one-off or recurring deposit, withdrawal or transfer.",
+            "T_ORDERS": "List standing orders, 'run' applies the due ones now.",
+            "T_UNSCHEDULE": "Cancel a standing order.",
+            "T_BUDGET": "Show budgets, or set one for an expense category."
         }
 
         transaction_sub_command_syntax = {
-            "T_DEPOSIT": "t + [Amount]",
-            "T_WITHDRAW": "t - [Amount]",
-            "T_TRANSFER": "t > [Target Account] [Amount]"
+            "T_DEPOSIT": "t + [Amount] [<Category>]",
+            "T_WITHDRAW": "t - [Amount] [<Category>]",
+            "T_TRANSFER": "t > [Target Account] [Amount]",
+            "T_BULK": "t bulk [<Account:Amount/Account Amount> ...] [<--file CSV>] [<--collect>]",
+            "T_HISTORY": "t h [<--from/--to Date>] [<--days N>] [<--type deposit,...>] [<--min/--max Amount>] [<--with Account>] [<--category Category>] [<--limit N>]",
+            "T_IMPORT": "t import File [<--format csv/ofx>] [<--account Account>] [<--date/--amount/--debit/--credit/--type/--description/--id Column>] [<--date-format %Y-%m-%d>] [<--delimiter ,>] [<--batch-size N>]",
+            "T_EXPORT": "t export [<File/->] [<--format csv/jsonl>] [<--account Account,...>] [<--from/--to Date>] [<--workers N>]",
+            "T_SCHEDULE": "t schedule [+/-/>] [<Target Account>] [Amount] --every [once/daily/weekly/monthly/\"Cron\"] [<--start Date>] [<--times N>] [<--category Category>]",
+            "T_ORDERS": "t orders [<run>]",
+            "T_UNSCHEDULE": "t cancel [Order Id]",
+            "T_BUDGET": "t budget [<Category> <Amount/off>] [<--period daily/weekly/monthly>]"
         }
 
         # Prefix
@@ -243,4 +828,32 @@ class Executor():
             syntax = transaction_sub_command_syntax.get(sub_command.name, "")
             print(f"{Text.GREEN}{sub_command.name:<20}{Text.RESET} {alias_string:<30} {description:<40} {syntax:<20}")
 
+        # Report Subcommand
+        report_sub_command_description = {
+            "REPORT_DAILY": "Save a daily savings report.",
+            "REPORT_WEEKLY": "Save a weekly savings report.",
+            "REPORT_MONTHLY": "Save a monthly savings report.",
+            "REPORT_REBUILD": "Rebuild report data from history.",
+            "REPORT_TOTALS": "Sum transactions by type.",
+            "REPORT_AUDIT": "Recompute balances from history and match transfers."
+        }
+
+        report_sub_command_syntax = {
+            "REPORT_DAILY": "r d [<YYYY-MM-DD>]",
+            "REPORT_WEEKLY": "r w [<YYYY-Www>]",
+            "REPORT_MONTHLY": "r m [<YYYY-MM>]",
+            "REPORT_REBUILD": "r rebuild",
+            "REPORT_TOTALS": "r totals [<--from/--to Date>]",
+            "REPORT_AUDIT": "r audit [<--workers N>]"
+        }
+
+        print(f"{Text.RED}\nReport Subcommand")
+        print(f"{Text.RED}{'TYPE':<20} {'ALIASES':<30} {'DESCRIPTION':<40} {'SYNTAX':<40} {Text.RESET}")
+        print(f"{Text.RED}{'-'*140}{Text.RESET}")
+        for sub_command, aliases in Parser.report_sub_command_aliases.items():
+            alias_string = ", ".join(aliases)
+            description = report_sub_command_description.get(sub_command.name, "")
+            syntax = report_sub_command_syntax.get(sub_command.name, "")
+            print(f"{Text.GREEN}{sub_command.name:<20}{Text.RESET} {alias_string:<30} {description:<40} {syntax:<20}")
+
         print(f"{Text.RESET}")
@@ -0,0 +1,138 @@
+import atexit, json, os, threading, time
+from pathlib import Path
+
+from modules.data_handler import DataHandler
+
+class IdAllocator():
+
+    # ULID-style ids: 26 Crockford base32 characters, 48 bits of milliseconds followed by 80 random bits.
+    # Ids made in the same millisecond add one to the random part, so ids sort in the order they were made.
+    alphabet: str = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+    length: int = 26
+    time_length: int = 10
+    random_bits: int = 80
+
+    # High-water mark: no timestamp or id handed out so far is later than it, so a clock set back
+    # can't make a new one sort before an old one. It is kept a lease ahead and written once per lease.
+    # After a crash the mark is still up to a lease ahead of the clock, so the lease is kept short.
+    lease_seconds: float = 1.0
+    high_water_file_name: str = "ids.json"
+
+    _lock: threading.Lock = threading.Lock()
+    _last_time: int = -1
+    _last_random: int = 0
+    _high_water: float | None = None
+    _reserved_until: float = 0.0
+    _issued: float = 0.0
+
+    # High-water Mark
+
+    @classmethod
+    def high_water_path(cls) -> Path:
+        if not DataHandler._initialised:
+            DataHandler.initialise()
+        return DataHandler.data_folder_path / cls.high_water_file_name
+
+    # Latest timestamp any earlier run may have handed out, 0 for a new data folder
+    @classmethod
+    def high_water(cls) -> float:
+        if cls._high_water is None:
+            with cls._lock:
+                if cls._high_water is None:
+                    try:
+                        high_water = DataHandler.read_json(cls.high_water_path())["high_water"]
+                    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+                        high_water = 0.0
+                    # Started right after a crash, wait for the clock to pass the lease instead of handing
+                    # out ids and timestamps ahead of it. A mark further ahead means the clock was set back.
+                    ahead = high_water - time.time()
+                    if 0 < ahead <= cls.lease_seconds:
+                        time.sleep(ahead)
+                    cls._reserved_until = high_water
+                    # The first id made here sorts after every id up to the mark
+                    cls._last_time = max(cls._last_time, int(high_water * 1000))
+                    cls._last_random = (1 << cls.random_bits) - 1
+                    cls._high_water = high_water
+        return cls._high_water
+
+    # Note that a timestamp is handed out, moving the mark a lease ahead when it gets there
+    @classmethod
+    def reserve(cls, timestamp: float) -> None:
+        cls.high_water()
+        with cls._lock:
+            cls._issued = max(cls._issued, timestamp)
+            if timestamp > cls._reserved_until:
+                cls._reserved_until = timestamp + cls.lease_seconds
+                cls._write_high_water(cls._reserved_until)
+
+    @classmethod
+    def _write_high_water(cls, high_water: float) -> None:
+        DataHandler.ensure_data_folder()
+        DataHandler._replace_json(cls.high_water_path(), {"high_water": high_water}, sync=True)
+
+    # On exit the mark comes back to the last timestamp handed out, unless another run moved it since
+    @classmethod
+    def release(cls) -> None:
+        with cls._lock:
+            if cls._issued == 0.0 or cls._issued >= cls._reserved_until:
+                return
+            try:
+                stored = DataHandler.read_json(cls.high_water_path())["high_water"]
+            except (FileNotFoundError, json.JSONDecodeError, KeyError):
+                return
+            if stored == cls._reserved_until:
+                cls._write_high_water(cls._issued)
+                cls._reserved_until = cls._issued
+
+    # Allocation
+
+    # Get a new id for something made at the given timestamp (now by default)
+    @classmethod
+    def allocate(cls, timestamp: float | None = None) -> str:
+        timestamp = timestamp if timestamp is not None else time.time()
+        cls.reserve(timestamp)
+        milliseconds = int(timestamp * 1000)
+        with cls._lock:
+            if milliseconds <= cls._last_time:
+                milliseconds = cls._last_time
+                random_part = cls._last_random + 1
+                if random_part >> cls.random_bits:
+                    milliseconds, random_part = milliseconds + 1, int.from_bytes(os.urandom(cls.random_bits // 8))
+            else:
+                random_part = int.from_bytes(os.urandom(cls.random_bits // 8))
+            cls._last_time, cls._last_random = milliseconds, random_part
+        return cls.encode(milliseconds, random_part)
+
+    @classmethod
+    def encode(cls, milliseconds: int, random_part: int) -> str:
+        value = (milliseconds << cls.random_bits) | random_part
+        characters = []
+        for _ in range(cls.length):
+            characters.append(cls.alphabet[value & 31])
+            value >>= 5
+        return "".join(reversed(characters))
+
+    # Reading Ids
+
+    # Whether an id was made by this allocator, ids written before it are 8 random hex characters
+    @classmethod
+    def is_ordered(cls, identifier: str) -> bool:
+        return len(identifier) == cls.length and all(character in cls.alphabet for character in identifier)
+
+    # Timestamp (in seconds, to the millisecond) an id was made at, None for older ids
+    @classmethod
+    def timestamp(cls, identifier: str) -> float | None:
+        if not cls.is_ordered(identifier):
+            return None
+        milliseconds = 0
+        for character in identifier[:cls.time_length]:
+            milliseconds = milliseconds * 32 + cls.alphabet.index(character)
+        return milliseconds / 1000
+
+    # Smallest id that can be made at or after a timestamp, every id >= it is newer ("since" scans)
+    @classmethod
+    def first_id(cls, timestamp: float) -> str:
+        return cls.encode(int(timestamp * 1000), 0)
+
+# Bring the high-water mark back to the last timestamp used, so the next run doesn't start a lease ahead
+atexit.register(IdAllocator.release)
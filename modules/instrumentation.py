@@ -0,0 +1,151 @@
+import json, threading, time
+from contextvars import ContextVar, Token
+from bisect import bisect_left
+from functools import wraps
+from pathlib import Path
+
+class LatencyHistogram():
+
+    # Upper bounds of the buckets in seconds, 1-2-5 steps from 1µs to 10s (the last bucket takes the rest)
+    bounds: list[float] = [step * 10 ** exponent / 1_000_000 for exponent in range(7) for step in (1, 2, 5)] + [10.0]
+
+    # Initialise an empty histogram.
+    def __init__(self) -> None:
+        self.counts: list[int] = [0] * (len(self.bounds) + 1)
+        self.count: int = 0
+        self.total: float = 0.0
+        self.max: float = 0.0
+
+    def record(self, seconds: float) -> None:
+        self.counts[bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    # Upper bound of the bucket holding the given share of the samples (e.g. 0.95), never above the slowest sample
+    def percentile(self, share: float) -> float:
+        wanted, seen = share * self.count, 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= wanted:
+                return min(self.bounds[index], self.max) if index < len(self.bounds) else self.max
+        return 0.0
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(0.50),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+            "buckets": {f"{bound:g}": count for bound, count in zip(self.bounds + [float("inf")], self.counts) if count}
+        }
+
+class Instrumentation():
+
+    # Off unless the command running is in debug mode, every hook checks this first so it costs next to
+    # nothing when off. Each command sets it from its own parser, so one session's debug mode stays its own.
+    _enabled: ContextVar[bool] = ContextVar("instrumentation_enabled", default=False)
+
+    # Command latency split into phases: reading the command, running it, and the disk writes it made
+    phases: tuple[str, ...] = ("parse", "execute", "persist")
+    _histograms: dict[tuple[str, str], LatencyHistogram] = {}
+
+    # I/O counters of the storage layer
+    counter_names: tuple[str, ...] = ("files_opened", "bytes_written", "bytes_read", "json_encodes", "json_encode_seconds",
+                                      "json_decodes", "json_decode_seconds")
+    _counters: dict[str, int | float] = {name: 0.0 if name.endswith("_seconds") else 0 for name in counter_names}
+
+    _lock: threading.Lock = threading.Lock()
+    # Time spent persisting by the command running on each thread
+    _local: threading.local = threading.local()
+
+    @classmethod
+    def enabled(cls) -> bool:
+        return cls._enabled.get()
+
+    # Measure (or not) what runs in the current context until deactivate is called with the returned token
+    @classmethod
+    def activate(cls, enabled: bool) -> Token:
+        return cls._enabled.set(enabled)
+
+    @classmethod
+    def deactivate(cls, token: Token) -> None:
+        cls._enabled.reset(token)
+
+    # Recording
+
+    @classmethod
+    def count(cls, name: str, amount: int | float = 1) -> None:
+        with cls._lock:
+            cls._counters[name] += amount
+
+    # Count a JSON encode or decode ("encode"/"decode") and the time it took
+    @classmethod
+    def count_json(cls, kind: str, started: float, amount: int = 1) -> None:
+        elapsed = time.perf_counter() - started
+        with cls._lock:
+            cls._counters[f"json_{kind}s"] += amount
+            cls._counters[f"json_{kind}_seconds"] += elapsed
+
+    # Decorator adding the time a storage function takes to the persist phase of the running command.
+    # Calls made inside another persisting call are only counted once.
+    @classmethod
+    def persisting(cls, function):
+        @wraps(function)
+        def wrapper(*arguments, **keywords):
+            if not cls._enabled.get():
+                return function(*arguments, **keywords)
+            local = cls._local
+            depth = getattr(local, "depth", 0)
+            local.depth = depth + 1
+            started = time.perf_counter()
+            try:
+                return function(*arguments, **keywords)
+            finally:
+                local.depth = depth
+                if depth == 0:
+                    local.persist_seconds = getattr(local, "persist_seconds", 0.0) + time.perf_counter() - started
+        return wrapper
+
+    # Start measuring a command on this thread
+    @classmethod
+    def begin_command(cls) -> None:
+        cls._local.persist_seconds = 0.0
+
+    # Record the phases of a finished command, execute is what's left once persisting is taken out
+    @classmethod
+    def record_command(cls, command: str, started: float, parsed: float, finished: float) -> None:
+        persist = getattr(cls._local, "persist_seconds", 0.0)
+        durations = {"parse": parsed - started, "execute": max(finished - parsed - persist, 0.0), "persist": persist}
+        with cls._lock:
+            for phase, seconds in durations.items():
+                histogram = cls._histograms.get((command, phase))
+                if histogram is None:
+                    histogram = cls._histograms[(command, phase)] = LatencyHistogram()
+                histogram.record(seconds)
+
+    # Reading
+
+    @classmethod
+    def snapshot(cls) -> dict:
+        with cls._lock:
+            commands: dict[str, dict] = {}
+            for (command, phase), histogram in sorted(cls._histograms.items()):
+                commands.setdefault(command, {})[phase] = histogram.summary()
+            return {"enabled": cls.enabled(), "commands": commands, "io": dict(cls._counters)}
+
+    @classmethod
+    def reset(cls) -> None:
+        with cls._lock:
+            cls._histograms.clear()
+            cls._counters = {name: 0.0 if name.endswith("_seconds") else 0 for name in cls.counter_names}
+
+    @classmethod
+    def export(cls, path: str) -> Path:
+        path = Path(path)
+        with open(path, "w") as file:
+            json.dump(cls.snapshot(), file, indent=4)
+        return path
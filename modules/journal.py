@@ -0,0 +1,298 @@
+import json, os, struct, threading, time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterator
+
+from modules.instrumentation import Instrumentation
+
+class Journal():
+
+    # Segment Variables
+    segment_prefix: str = "segment-"
+    segment_suffix: str = ".jsonl"
+    index_suffix: str = ".idx"
+    max_segment_bytes: int = 4 * 1024 * 1024
+
+    # Index entry: record timestamp and its byte offset inside the segment
+    index_entry: struct.Struct = struct.Struct("<dq")
+
+    # Journals with an open segment file, oldest first
+    max_open_files: int = 64
+    _open_journals: OrderedDict[Path, Journal] = OrderedDict()
+    _journals: dict[Path, Journal] = {}
+    _lock: threading.RLock = threading.RLock()
+
+    # Initialise a journal inside a folder.
+    def __init__(self, folder_path: Path) -> None:
+        self.folder_path: Path = Path(folder_path)
+        self._segment_number: int | None = None
+        self._segment_size: int = 0
+        self._file = None
+        self._index_file = None
+        self._indexes: dict[int, tuple[array, array]] = {}
+
+    # Get the shared journal of a folder
+    @classmethod
+    def for_folder(cls, folder_path: Path) -> Journal:
+        folder_path = Path(folder_path)
+        with cls._lock:
+            journal = cls._journals.get(folder_path)
+            if journal is None:
+                journal = cls(folder_path)
+                cls._journals[folder_path] = journal
+        return journal
+
+    # Segment Handling
+
+    def segment_path(self, number: int) -> Path:
+        return self.folder_path / f"{self.segment_prefix}{number:06d}{self.segment_suffix}"
+
+    def index_path(self, number: int) -> Path:
+        return self.folder_path / f"{self.segment_prefix}{number:06d}{self.index_suffix}"
+
+    # All segment files in order
+    def segments(self) -> list[Path]:
+        return sorted(self.folder_path.glob(f"{self.segment_prefix}*{self.segment_suffix}"))
+
+    def segment_number(self, segment: Path) -> int:
+        return int(segment.stem.removeprefix(self.segment_prefix))
+
+    def _find_current_segment(self) -> None:
+        segments = self.segments()
+        if segments:
+            last = segments[-1]
+            self._segment_number = self.segment_number(last)
+            self._segment_size = last.stat().st_size
+        else:
+            self._segment_number = 1
+            self._segment_size = 0
+
+    def _open(self) -> None:
+        if Instrumentation.enabled():
+            Instrumentation.count("files_opened", 2)
+        self._file = open(self.segment_path(self._segment_number), "ab")
+        self._index_file = open(self.index_path(self._segment_number), "ab")
+        Journal._open_journals[self.folder_path] = self
+        # Keep the amount of open files bounded
+        while len(Journal._open_journals) > Journal.max_open_files:
+            _, oldest = Journal._open_journals.popitem(last=False)
+            oldest.close()
+
+    def _roll_over(self) -> None:
+        self.close()
+        self._segment_number += 1
+        self._segment_size = 0
+
+    # Writing
+
+    # Append a record at the end of the journal, sync makes sure it reached the disk before returning
+    def append(self, record: dict, flush: bool = True, sync: bool = False) -> None:
+        started = time.perf_counter()
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+        if Instrumentation.enabled():
+            Instrumentation.count_json("encode", started)
+            Instrumentation.count("bytes_written", len(line) + self.index_entry.size)
+        with Journal._lock:
+            self._append(line, float(record.get("timestamp", 0)), flush or sync)
+            if sync:
+                os.fsync(self._file.fileno())
+
+    def _append(self, line: bytes, timestamp: float, flush: bool) -> None:
+        if self._segment_number is None:
+            self._find_current_segment()
+        if self._segment_size > 0 and self._segment_size + len(line) > self.max_segment_bytes:
+            self._roll_over()
+        if self._file is None:
+            self._open()
+        else:
+            Journal._open_journals.move_to_end(self.folder_path)
+
+        offset = self._segment_size
+        self._file.write(line)
+        self._index_file.write(self.index_entry.pack(timestamp, offset))
+        self._segment_size += len(line)
+
+        # Keep an already loaded index up to date
+        index = self._indexes.get(self._segment_number)
+        if index is not None:
+            index[0].append(timestamp)
+            index[1].append(offset)
+
+        if flush:
+            self.flush()
+
+    def flush(self) -> None:
+        with Journal._lock:
+            if self._file is not None:
+                self._file.flush()
+                self._index_file.flush()
+
+    def close(self) -> None:
+        with Journal._lock:
+            if self._file is not None:
+                self._file.close()
+                self._index_file.close()
+                self._file = None
+                self._index_file = None
+            Journal._open_journals.pop(self.folder_path, None)
+
+    # Flush every journal with an open segment
+    @classmethod
+    def flush_all(cls) -> None:
+        with cls._lock:
+            for journal in cls._open_journals.values():
+                journal.flush()
+
+    # Reading
+
+    # Stream every record back in the order it was written
+    def read(self) -> Iterator[dict]:
+        self.flush()
+        for segment in self.segments():
+            yield from self._read_segment(segment, 0)
+
+    def _read_segment(self, segment: Path, offset: int) -> Iterator[dict]:
+        measure = Instrumentation.enabled()
+        if measure:
+            Instrumentation.count("files_opened")
+        with open(segment, "rb") as file:
+            file.seek(offset)
+            for line in file:
+                started = time.perf_counter() if measure else 0.0
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn line can only be the last one written before a crash
+                    continue
+                if measure:
+                    Instrumentation.count_json("decode", started)
+                    Instrumentation.count("bytes_read", len(line))
+                yield record
+
+    # Get the last record written, reading only the end of the last segment
+    def last(self) -> dict | None:
+        self.flush()
+        segments = self.segments()
+        if not segments:
+            return None
+        _, offsets = self.load_index(self.segment_number(segments[-1]))
+        # Start a couple of records early in case the very last one was torn
+        offset = offsets[max(len(offsets) - 2, 0)] if offsets else 0
+        record = None
+        for record in self._read_segment(segments[-1], offset):
+            pass
+        return record
+
+    # Stream records with a timestamp between start and end (inclusive), using the index to skip the rest
+    def query(self, start: float | None = None, end: float | None = None) -> Iterator[dict]:
+        self.flush()
+        segments = self.segments()
+        for position, segment in enumerate(segments):
+            timestamps, offsets = self.load_index(self.segment_number(segment))
+            is_last = position == len(segments) - 1
+
+            # Whole segment is older than the range
+            if start is not None and timestamps and timestamps[-1] < start and not is_last:
+                continue
+            # Whole segment (and every later one) is newer than the range
+            if end is not None and timestamps and timestamps[0] > end:
+                break
+
+            offset = 0
+            if start is not None and timestamps:
+                entry = bisect_left(timestamps, start)
+                offset = offsets[min(entry, len(offsets) - 1)]
+
+            for record in self._read_segment(segment, offset):
+                timestamp = float(record.get("timestamp", 0))
+                if start is not None and timestamp < start:
+                    continue
+                if end is not None and timestamp > end:
+                    return
+                yield record
+
+    # Index Handling
+
+    # Get the timestamps and offsets of a segment, building the index file if it doesn't exist
+    def load_index(self, number: int) -> tuple[array, array]:
+        index = self._indexes.get(number)
+        if index is not None:
+            return index
+
+        path = self.index_path(number)
+        if not path.exists():
+            self.rebuild_index(number)
+
+        timestamps, offsets = array("d"), array("q")
+        data = path.read_bytes()
+        usable = len(data) - len(data) % self.index_entry.size
+        for timestamp, offset in self.index_entry.iter_unpack(data[:usable]):
+            timestamps.append(timestamp)
+            offsets.append(offset)
+        self._indexes[number] = (timestamps, offsets)
+        return timestamps, offsets
+
+    # Write the index file of a segment from its records
+    def rebuild_index(self, number: int) -> None:
+        entries = bytearray()
+        offset = 0
+        with open(self.segment_path(number), "rb") as file:
+            for line in file:
+                try:
+                    timestamp = float(json.loads(line).get("timestamp", 0))
+                    entries += self.index_entry.pack(timestamp, offset)
+                except json.JSONDecodeError:
+                    pass
+                offset += len(line)
+        self.index_path(number).write_bytes(entries)
+        self._indexes.pop(number, None)
+
+    # Migration
+
+    # Move one-JSON-file-per-transaction records into the journal. They go into segment 0, ahead of
+    # every segment the journal writes (those start at 1), sorted by timestamp so the index stays sorted.
+    # The segment is written aside and renamed in one step and records already in it are skipped, so a run
+    # that stopped before removing the old files can be run again without copying a record twice.
+    @classmethod
+    def migrate_transactions_folder(cls, folder_path: Path) -> int:
+        journal = cls.for_folder(folder_path)
+        files = sorted(Path(folder_path).glob("*.json"), key=lambda path: (path.stat().st_mtime, path.name))
+        if not files:
+            return 0
+        with cls._lock:
+            journal.close()
+            migrated = journal.segment_path(0)
+            existing = list(journal._read_segment(migrated, 0)) if migrated.exists() else []
+            known = {record.get("id") for record in existing}
+            records = []
+            for path in files:
+                with open(path, "r") as file:
+                    record = json.load(file)
+                if record.get("id") not in known:
+                    records.append(record)
+
+            if records:
+                records = sorted(existing + records, key=lambda record: float(record.get("timestamp", 0)))
+                # Old records come first, so none of them may be newer than what the later segments hold
+                later = [segment for segment in journal.segments() if journal.segment_number(segment) > 0]
+                if later:
+                    timestamps, _ = journal.load_index(journal.segment_number(later[0]))
+                    if timestamps and float(records[-1].get("timestamp", 0)) > timestamps[0]:
+                        raise ValueError(f"{folder_path} holds old transactions newer than its journal, they can't be put ahead of it.")
+
+                temporary = migrated.with_name(migrated.name + ".tmp")
+                with open(temporary, "wb") as file:
+                    for record in records:
+                        file.write((json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8"))
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(temporary, migrated)
+                journal.rebuild_index(0)
+                # The current segment is looked up again, segment 0 is the last one of a journal that was empty
+                journal._segment_number = None
+        # Only remove the old files once every record is in the journal
+        for path in files:
+            path.unlink()
+        return len(files)
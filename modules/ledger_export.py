@@ -0,0 +1,155 @@
+import csv, json, queue, sys, threading, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator
+
+from modules.money import Money
+from modules.data_handler import DataHandler
+from modules.ascii_decorator import AsciiDecorator as Text
+
+class LedgerExporter():
+
+    formats: tuple[str, ...] = ("csv", "jsonl")
+    columns: list[str] = ["kind", "account_id", "account_name", "id", "timestamp", "date", "type",
+                          "amount", "balance", "transferer", "receiver", "transfer_id", "description"]
+
+    # Accounts read ahead of the one being written, each handing over small chunks through a bounded queue
+    default_workers: int = 4
+    chunk_size: int = 256
+    max_queued_chunks: int = 4
+
+    # Initialise an export of accounts (and their history between start and end) into a file, "-" is stdout.
+    def __init__(self, accounts: list, output_path: str = "-", file_format: str | None = None,
+                 start: float | None = None, end: float | None = None, workers: int | None = None) -> None:
+        self.accounts: list = accounts
+        self.output_path: str = output_path
+        if file_format is None:
+            file_format = "csv" if Path(output_path).suffix.lower() == ".csv" else "jsonl"
+        self.file_format: str = file_format.lower()
+        if self.file_format not in self.formats:
+            raise ValueError(f"Unknown export format {file_format}, use {' or '.join(self.formats)}.")
+        self.start: float | None = start
+        self.end: float | None = end
+        self.workers: int = workers or self.default_workers
+        self.transactions: int = 0
+        self._stopped: threading.Event = threading.Event()
+        self._csv_writer: csv.DictWriter | None = None
+
+    # Reading
+
+    # Read the history of one account in a worker thread, a chunk at a time
+    def read_account(self, account, chunks: queue.Queue) -> None:
+        try:
+            chunk = []
+            for record in DataHandler.query_transactions(account, self.start, self.end):
+                chunk.append(record)
+                if len(chunk) >= self.chunk_size:
+                    if not self.hand_over(chunks, chunk):
+                        return
+                    chunk = []
+            if chunk and not self.hand_over(chunks, chunk):
+                return
+            self.hand_over(chunks, None)
+        except Exception as e:
+            self.hand_over(chunks, e)
+
+    # Queue a chunk for the writer, returns False when the writer stopped and nobody will take it
+    def hand_over(self, chunks: queue.Queue, item) -> bool:
+        while not self._stopped.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    # Records of one account as the reader hands them over
+    @staticmethod
+    def drain(chunks: queue.Queue) -> Iterator[dict]:
+        while (chunk := chunks.get()) is not None:
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield from chunk
+
+    # Every account with its history, the next few accounts are read while the current one is written
+    def histories(self) -> Iterator[tuple]:
+        accounts = iter(self.accounts)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="export") as pool:
+            try:
+                while True:
+                    while len(pending) < self.workers and (account := next(accounts, None)) is not None:
+                        chunks = queue.Queue(maxsize=self.max_queued_chunks)
+                        pool.submit(self.read_account, account, chunks)
+                        pending.append((account, chunks))
+                    if not pending:
+                        return
+                    account, chunks = pending.popleft()
+                    yield account, self.drain(chunks)
+            finally:
+                self._stopped.set()
+
+    # Rows
+
+    @staticmethod
+    def account_row(account) -> dict:
+        return {"kind": "account", "account_id": account.id, "account_name": account.name, "balance": account.balance}
+
+    @staticmethod
+    def transaction_row(account, record: dict) -> dict:
+        timestamp = DataHandler.posted(record)
+        return {
+            "kind": "transaction",
+            "account_id": account.id,
+            "account_name": account.name,
+            "id": record["id"],
+            "timestamp": timestamp,
+            "date": datetime.fromtimestamp(timestamp).isoformat(timespec="seconds"),
+            "type": record["type"].removeprefix("TransactionTypes."),
+            "amount": Money.read(record, "amount"),
+            "balance": Money.read(record, "new_balance"),
+            "transferer": record.get("transferer_id", record["transferer"]),
+            "receiver": record.get("receiver_id", record["receiver"]),
+            "transfer_id": record.get("transfer_id"),
+            "description": record.get("description", "")
+        }
+
+    # Writing
+
+    # Write one row, CSV shows money in major units and JSON Lines keeps cents
+    def write_row(self, output, row: dict) -> None:
+        if self._csv_writer is not None:
+            row["amount"] = Money.format(row["amount"]) if "amount" in row else ""
+            row["balance"] = Money.format(row["balance"])
+            self._csv_writer.writerow(row)
+            return
+        if "amount" in row:
+            row["amount_cents"] = row.pop("amount")
+        row["balance_cents"] = row.pop("balance")
+        output.write(json.dumps(row, separators=(",", ":")) + "\n")
+
+    # Write every account followed by its history, returns (success, summary)
+    def run(self) -> tuple:
+        started = time.perf_counter()
+        output = sys.stdout if self.output_path == "-" else open(self.output_path, "w", newline="")
+        try:
+            if self.file_format == "csv":
+                self._csv_writer = csv.DictWriter(output, self.columns, extrasaction="ignore")
+                self._csv_writer.writeheader()
+            for account, records in self.histories():
+                self.write_row(output, self.account_row(account))
+                for record in records:
+                    self.write_row(output, self.transaction_row(account, record))
+                    self.transactions += 1
+        finally:
+            if output is sys.stdout:
+                output.flush()
+            else:
+                output.close()
+        elapsed = time.perf_counter() - started
+
+        rate = (len(self.accounts) + self.transactions) / elapsed if elapsed > 0 else 0
+        destination = "stdout" if self.output_path == "-" else self.output_path
+        return True, f"{Text.GREEN}Exported {len(self.accounts)} account(s) and {self.transactions} transaction(s) as {self.file_format} to {destination} in {elapsed:.3f}s ({rate:.0f} rows/sec).{Text.RESET}"
@@ -0,0 +1,37 @@
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+class Money():
+
+    # Amounts are kept as whole minor units (cents), so sums are exact
+    minor_units: int = 100
+
+    # Parse a typed amount (e.g. "12.34") into cents without going through float
+    @classmethod
+    def parse(cls, text: str) -> int:
+        try:
+            value = Decimal(str(text).strip())
+        except InvalidOperation:
+            raise ValueError(f"{text} is not an amount.")
+        if not value.is_finite():
+            raise ValueError(f"{text} is not an amount.")
+        return int((value * cls.minor_units).to_integral_value(ROUND_HALF_UP))
+
+    # Turn an amount in major units (old float JSON) into cents
+    @classmethod
+    def from_major(cls, value: float | int) -> int:
+        return cls.parse(repr(value))
+
+    # Read an amount from a stored record, older records only have the major unit field
+    @classmethod
+    def read(cls, record: dict, key: str) -> int:
+        cents = record.get(f"{key}_cents")
+        if cents is not None:
+            return int(cents)
+        return cls.from_major(record.get(key, 0))
+
+    # Cents as text in major units (e.g. 123456 -> "1234.56")
+    @classmethod
+    def format(cls, cents: int, signed: bool = False) -> str:
+        sign = "-" if cents < 0 else ("+" if signed else "")
+        whole, fraction = divmod(abs(cents), cls.minor_units)
+        return f"{sign}{whole}.{fraction:02d}"
@@ -1,6 +1,9 @@
-import os, platform, shlex, traceback
+import os, platform, shlex, time, traceback
+from contextvars import ContextVar
 from modules.commands import Commands
+from modules.session import Session
 from modules.executor import Executor
+from modules.instrumentation import Instrumentation
 from modules.ascii_decorator import AsciiDecorator as Text
 
 class Parser:
@@ -13,9 +16,12 @@ class Parser:
         Commands.CLEAR: ["CLS", "CLEAR"],
         Commands.VERSION: ["VER", "VERSION", "ABOUT", "PATCH"],
         Commands.EXIT: ["EXIT", "QUIT", "STOP", "END", "Q"],
+        Commands.FLUSH: ["FLUSH", "SYNC"],
+        Commands.VERIFY: ["VERIFY", "CHECK", "FSCK"],
         
         Commands.ACCOUNT: ["ACCOUNT", "ACC", "A"],
         Commands.TRANSACTION: ["TRANSACTION", "TRAN", "T"],
+        Commands.REPORT: ["REPORT", "REP", "R"],
 
         Commands.SOB: ["SOB", ":(", "D:", "cry"]
     }
@@ -32,7 +38,44 @@ class Parser:
     transaction_sub_command_aliases = {
         Commands.T_DEPOSIT: ["deposit", "add", "+"],
         Commands.T_WITHDRAW: ["withdraw", "remove", "-"],
-        Commands.T_TRANSFER: ["transfer", "move", ">"]
+        Commands.T_TRANSFER: ["transfer", "move", ">"],
+        Commands.T_BULK: ["bulk", "payroll", "fanout", ">>"],
+        Commands.T_HISTORY: ["history", "query", "log", "h"],
+        Commands.T_IMPORT: ["import", "statement", "load"],
+        Commands.T_EXPORT: ["export", "dump", "backup"],
+        Commands.T_SCHEDULE: ["schedule", "standing", "every"],
+        Commands.T_ORDERS: ["orders", "scheduled"],
+        Commands.T_UNSCHEDULE: ["unschedule", "cancel"],
+        Commands.T_BUDGET: ["budget", "budgets", "limit"]
+    }
+
+    report_sub_command_aliases = {
+        Commands.REPORT_DAILY: ["daily", "day", "d"],
+        Commands.REPORT_WEEKLY: ["weekly", "week", "w"],
+        Commands.REPORT_MONTHLY: ["monthly", "month", "m"],
+        Commands.REPORT_REBUILD: ["rebuild", "refresh"],
+        Commands.REPORT_TOTALS: ["totals", "total", "sum"],
+        Commands.REPORT_AUDIT: ["audit", "a"]
+    }
+
+    # Sub command aliases of each prefix that takes a sub command
+    sub_command_namespaces = {
+        Commands.ACCOUNT: account_sub_command_aliases,
+        Commands.TRANSACTION: transaction_sub_command_aliases,
+        Commands.REPORT: report_sub_command_aliases
+    }
+
+    # Precompiled alias tables, built once when the class is defined
+    prefix_table: dict[str, Commands] = {
+        alias.upper(): command
+        for command, aliases in prefix_aliases.items()
+        for alias in aliases
+    }
+    sub_command_table: dict[tuple[Commands, str], Commands] = {
+        (prefix, alias.lower()): command
+        for prefix, namespace in sub_command_namespaces.items()
+        for command, aliases in namespace.items()
+        for alias in aliases
     }
 
     executor_map = {
@@ -47,11 +90,28 @@ class Parser:
         # TRANSACTION
         Commands.T_DEPOSIT: Executor.execute_transaction_deposit,
         Commands.T_WITHDRAW: Executor.execute_transaction_withdraw,
-        Commands.T_TRANSFER: Executor.execute_transaction_transfer
+        Commands.T_TRANSFER: Executor.execute_transaction_transfer,
+        Commands.T_BULK: Executor.execute_transaction_bulk,
+        Commands.T_HISTORY: Executor.execute_transaction_history,
+        Commands.T_IMPORT: Executor.execute_transaction_import,
+        Commands.T_EXPORT: Executor.execute_transaction_export,
+        Commands.T_SCHEDULE: Executor.execute_transaction_schedule,
+        Commands.T_ORDERS: Executor.execute_transaction_orders,
+        Commands.T_UNSCHEDULE: Executor.execute_transaction_unschedule,
+        Commands.T_BUDGET: Executor.execute_transaction_budget,
+
+        # REPORT
+        Commands.REPORT_DAILY: Executor.execute_report_daily,
+        Commands.REPORT_WEEKLY: Executor.execute_report_weekly,
+        Commands.REPORT_MONTHLY: Executor.execute_report_monthly,
+        Commands.REPORT_REBUILD: Executor.execute_report_rebuild,
+        Commands.REPORT_TOTALS: Executor.execute_report_totals,
+        Commands.REPORT_AUDIT: Executor.execute_report_audit
     }
 
     executor_function_required_arguments = {
         # ACCOUNT
+        Commands.ACC_LIST: Executor.execute_account_list,
         Commands.ACC_LOGIN: Executor.execute_account_login,
         Commands.ACC_CREATE: Executor.execute_account_create,
         Commands.ACC_MODIFY: Executor.execute_account_modify,
@@ -60,52 +120,71 @@ class Parser:
         # TRANSACTION
         Commands.T_DEPOSIT: Executor.execute_transaction_deposit,
         Commands.T_WITHDRAW: Executor.execute_transaction_withdraw,
-        Commands.T_TRANSFER: Executor.execute_transaction_transfer
+        Commands.T_TRANSFER: Executor.execute_transaction_transfer,
+        Commands.T_BULK: Executor.execute_transaction_bulk,
+        Commands.T_HISTORY: Executor.execute_transaction_history,
+        Commands.T_IMPORT: Executor.execute_transaction_import,
+        Commands.T_EXPORT: Executor.execute_transaction_export,
+        Commands.T_SCHEDULE: Executor.execute_transaction_schedule,
+        Commands.T_ORDERS: Executor.execute_transaction_orders,
+        Commands.T_UNSCHEDULE: Executor.execute_transaction_unschedule,
+        Commands.T_BUDGET: Executor.execute_transaction_budget,
+
+        # REPORT
+        Commands.REPORT_DAILY: Executor.execute_report_daily,
+        Commands.REPORT_WEEKLY: Executor.execute_report_weekly,
+        Commands.REPORT_MONTHLY: Executor.execute_report_monthly,
+        Commands.REPORT_TOTALS: Executor.execute_report_totals,
+        Commands.REPORT_AUDIT: Executor.execute_report_audit
     }
 
-    command: str = ""
-    prefix: str | Commands = Commands.NONE
-    sub_command: str = ""
-    arguments : list[str] = []
-    
-    # Debug mode
-    debug_mode = False
+    # Parser running the current command (each session or thread has its own)
+    _active_parser: ContextVar[Parser] = ContextVar("active_parser")
+
+    # Initialise a parser for a session (the terminal session when none is given).
+    def __init__(self, debug_mode: bool = False, session: Session | None = None) -> None:
+        self.debug_mode: bool = debug_mode
+        self.session: Session = session or Session.current()
+
+    # Debug mode of the parser running the current command
+    @classmethod
+    def current_debug_mode(cls) -> bool:
+        parser = cls._active_parser.get(None)
+        return parser.debug_mode if parser else False
 
     # Aliases checker
 
     @classmethod
     def check_prefix_aliases(cls, prefix: str) -> Commands:
-        prefix = prefix.upper()
-        for key, alias in cls.prefix_aliases.items():
-            if prefix in alias:
-                return key
-        return Commands.NONE
+        return cls.prefix_table.get(prefix.upper(), Commands.NONE)
 
     @classmethod
-    def check_sub_command_aliases(cls) -> tuple:
-        sub_command = cls.sub_command.lower()
-        # Account
-        for key, alias in cls.account_sub_command_aliases.items():
-            if sub_command in alias:
-                return key, "Account Subcommand."
-        # Transaction
-        for key, alias in cls.transaction_sub_command_aliases.items():
-            if sub_command in alias:
-                return key, "Transaction Subcommand."
-        return Commands.NONE, f"{Text.YELLOW}Unknown Subcommand. Try using 'HELP' command.{Text.RESET}"
+    def check_sub_command_aliases(cls, prefix: Commands, sub_command: str) -> tuple:
+        command = cls.sub_command_table.get((prefix, sub_command.lower()), Commands.NONE)
+        if command == Commands.NONE:
+            return Commands.NONE, f"{Text.YELLOW}Unknown Subcommand. Try using 'HELP' command.{Text.RESET}"
+        return command, f"{prefix.name.capitalize()} Subcommand."
 
     # Check Prefix
 
-    @classmethod
-    def parse_prefix(cls) -> tuple:
-        match (cls.prefix):
+    def parse_prefix(self, prefix: Commands, arguments: list[str] = []) -> tuple:
+        match (prefix):
             case Commands.DEBUG:
-                cls.debug_mode = not cls.debug_mode
-                return False, f"Toggled Debug mode to {cls.debug_mode}"
+                if len(arguments) >= 2 and arguments[1].lower() == "stats":
+                    _, log = Executor.execute_debug_stats(arguments[2:])
+                    return False, log
+                self.debug_mode = not self.debug_mode
+                return False, f"Toggled Debug mode to {self.debug_mode}"
             case Commands.EXIT:
                 return False, f"Stopping..."
+            case Commands.FLUSH:
+                _, log = Executor.execute_flush()
+                return False, log
+            case Commands.VERIFY:
+                _, log = Executor.execute_verify()
+                return False, log
             case Commands.HELP:
-                cls.command_help()
+                self.command_help()
                 return False, "Displayed available commands. Learn more at https://github.com/1ampupa/basic-savings-app"
             case Commands.CLEAR:
                 if platform.system() == "Windows":
@@ -114,11 +193,13 @@ class Parser:
                     os.system("clear")
                 return False, f"{Text.BG_GREEN}{Text.WHITE}Welcome to Basic Savings App Version {Parser.program_version}.{Text.RESET}\nType help for list of commands."
             case Commands.VERSION:
-                return False, f"Basic Savings App Version {cls.program_version}"
+                return False, f"Basic Savings App Version {self.program_version}"
             case Commands.ACCOUNT:
                 return True, "Parsing Account-related command."    
             case Commands.TRANSACTION:
-                return True, "Parsing Transaction-related command."    
+                return True, "Parsing Transaction-related command."
+            case Commands.REPORT:
+                return True, "Parsing Report-related command."
             case Commands.SOB:
                 return False, "it's okay."
 
@@ -127,34 +208,32 @@ class Parser:
     # Check sub command
 
     @classmethod
-    def parse_sub_command(cls) -> tuple:
+    def parse_sub_command(cls, prefix: Commands, arguments: list[str]) -> tuple:
         # Check command arguments length
-        if len(cls.arguments) < 2:
+        if len(arguments) < 2:
             return Commands.NONE, f"{Text.YELLOW}This command prefix required a subcommand. Try using 'HELP' command.{Text.RESET}"
         
         # Check empty subcommand
-        sub_command = cls.arguments[1].strip()
-        cls.sub_command = sub_command
+        sub_command = arguments[1].strip()
         if sub_command == "": 
             return Commands.NONE, f"{Text.YELLOW}Missing or empty subcommand. Try using 'HELP' command.{Text.RESET}"
         
         # Get aliases
-        sub_command, log = cls.check_sub_command_aliases()
+        sub_command, log = cls.check_sub_command_aliases(prefix, sub_command)
         return sub_command, log
     
     # Executor
 
-    @classmethod
-    def execute(cls, sub_command: Commands) -> tuple:
+    def execute(self, sub_command: Commands, arguments: list[str]) -> tuple:
         try:
-            execute_function = cls.executor_map.get(sub_command)
+            execute_function = self.executor_map.get(sub_command)
             if execute_function:   
-                arguments = cls.arguments[2:] if sub_command in cls.executor_function_required_arguments else []
+                arguments = arguments[2:] if sub_command in self.executor_function_required_arguments else []
                 success, log = execute_function(arguments) if arguments else execute_function()
                 return success, log
         except Exception as e:
-            if cls.debug_mode:
-                return False, cls.traceback_exception(e)
+            if self.debug_mode:
+                return False, self.traceback_exception(e)
             
         return False, f"{Text.BG_RED}{Text.WHITE}Something went wrong, please try again later.{Text.RESET}"
                 
@@ -166,46 +245,55 @@ class Parser:
 
     # Parser
 
-    @classmethod
-    def parse(cls, command: str) -> tuple:
-        cls.command = command
+    def parse(self, command: str) -> tuple:
         # Check Empty
         if command.strip() == "": 
             return False, f"{Text.YELLOW}Please enter a command, or typing help for list of commands.{Text.RESET}"
 
+        token = Parser._active_parser.set(self)
+        session_token = self.session.activate()
+        # Commands are measured while debug mode is on
+        measured_token = Instrumentation.activate(self.debug_mode)
+        measured = self.debug_mode
+        if measured:
+            Instrumentation.begin_command()
+            started = parsed = time.perf_counter()
+        measured_command = Commands.NONE
         try:
             # Get Arguments list
-            cls.arguments = shlex.split(command)
-
-            # Get Prefix
-            cls.prefix = cls.arguments[0]
+            arguments = shlex.split(command)
 
             # Check Prefix
-            cls.prefix = cls.check_prefix_aliases(cls.prefix)
-            chain_command, log = cls.parse_prefix()
+            prefix = self.check_prefix_aliases(arguments[0])
+            measured_command = prefix
+            if measured:
+                parsed = time.perf_counter()
+            chain_command, log = self.parse_prefix(prefix, arguments)
             
             # Check Sub command
             if chain_command:
-                sub_command, log = cls.parse_sub_command()
+                sub_command, log = self.parse_sub_command(prefix, arguments)
                 if sub_command == Commands.NONE:
-                    return False, log or f"{Text.YELLOW}Unknown command given: {cls.command}. Try using 'HELP' command.{Text.RESET}"
-                success, log = cls.execute(sub_command)
+                    return False, log or f"{Text.YELLOW}Unknown command given: {command}. Try using 'HELP' command.{Text.RESET}"
+                measured_command = sub_command
+                if measured:
+                    parsed = time.perf_counter()
+                success, log = self.execute(sub_command, arguments)
             else:
                 success = True
 
             return success, log
         except Exception as e:
-            if cls.debug_mode:
-                return False, cls.traceback_exception(e)
+            if self.debug_mode:
+                return False, self.traceback_exception(e)
             else:
                 return False, f"{Text.RED}An error occurred while parsing {command}.{Text.RESET}"
         finally:
-            # Reset
-            cls.command = ""
-            cls.prefix = Commands.NONE
-            cls.sub_command = ""
-            cls.arguments = []
-            
+            if measured:
+                Instrumentation.record_command(measured_command.name, started, parsed, time.perf_counter())
+            Instrumentation.deactivate(measured_token)
+            Session.deactivate(session_token)
+            Parser._active_parser.reset(token)
 
     # Help command
 
@@ -0,0 +1,171 @@
+import threading
+from datetime import datetime
+from pathlib import Path
+
+from modules.money import Money
+from modules.data_handler import DataHandler
+from modules.transaction_types import TransactionTypes
+
+class Report():
+
+    # Rollup Variables
+    periods: tuple[str, ...] = ("daily", "weekly", "monthly")
+    rollups_file_name: str = "rollups.json"
+    _rollups: dict[str, dict] = {}
+    _dirty_rollups: dict[str, Path] = {}
+    _lock: threading.RLock = threading.RLock()
+
+    # Period Keys
+
+    # Key of the period a moment belongs to (e.g. 2025-10-30, 2025-W44, 2025-10)
+    @staticmethod
+    def period_key(period: str, moment: datetime) -> str:
+        match (period):
+            case "daily":
+                return moment.strftime("%Y-%m-%d")
+            case "weekly":
+                year, week, _ = moment.isocalendar()
+                return f"{year}-W{week:02d}"
+            case "monthly":
+                return moment.strftime("%Y-%m")
+        raise ValueError(f"Unknown report period {period}.")
+
+    # Rollup Handling
+
+    @classmethod
+    def rollups_path(cls, account) -> Path:
+        return Path(account.folder_path) / cls.rollups_file_name
+
+    # Empty rollups, every amount inside is in cents
+    @classmethod
+    def empty(cls) -> dict:
+        rollups = {period: {} for period in cls.periods}
+        rollups["units"] = "cents"
+        return rollups
+
+    # Rollups written before money was kept in cents hold major units, convert them once
+    @classmethod
+    def _upgrade(cls, rollups: dict) -> dict:
+        if rollups.get("units") == "cents":
+            return rollups
+        for period in cls.periods:
+            for entry in rollups.get(period, {}).values():
+                entry["totals"] = {name: Money.from_major(total) for name, total in entry["totals"].items()}
+                for key in ("net_change", "opening_balance", "closing_balance"):
+                    entry[key] = Money.from_major(entry[key])
+        rollups["units"] = "cents"
+        return rollups
+
+    # Get the rollups of an account, reading them from disk once
+    @classmethod
+    def load(cls, account) -> dict:
+        rollups = cls._rollups.get(account.id)
+        if rollups is None:
+            path = cls.rollups_path(account)
+            try:
+                rollups = cls._upgrade(DataHandler.read_json(path))
+            except FileNotFoundError:
+                rollups = cls.empty()
+            cls._rollups[account.id] = rollups
+        return rollups
+
+    # Add one transaction into every period it belongs to
+    @staticmethod
+    def apply(rollups: dict, transaction_type: TransactionTypes, amount: int, new_balance: int, timestamp: float) -> None:
+        moment = datetime.fromtimestamp(timestamp)
+        change = transaction_type.signed(amount)
+        for period in Report.periods:
+            key = Report.period_key(period, moment)
+            entry = rollups[period].get(key)
+            if entry is None:
+                entry = rollups[period][key] = {
+                    "totals": {},
+                    "count": 0,
+                    "net_change": 0,
+                    "opening_balance": new_balance - change,
+                    "closing_balance": new_balance
+                }
+            entry["totals"][transaction_type.name] = entry["totals"].get(transaction_type.name, 0) + amount
+            entry["count"] += 1
+            entry["net_change"] += change
+            entry["closing_balance"] = new_balance
+
+    # Update the rollups of an account with a newly recorded transaction
+    @classmethod
+    def record(cls, account, transaction) -> None:
+        with cls._lock:
+            cls.apply(cls.load(account), transaction.transaction_type, transaction.amount, transaction.new_balance, transaction.posted)
+            cls._dirty_rollups[account.id] = cls.rollups_path(account)
+
+    # Write every changed rollups file, returns the amount of files written
+    @classmethod
+    def flush(cls) -> int:
+        with cls._lock:
+            dirty_rollups = cls._dirty_rollups
+            cls._dirty_rollups = {}
+            for account_id, path in dirty_rollups.items():
+                DataHandler.write_json(path, cls._rollups[account_id])
+            return len(dirty_rollups)
+
+    # Regenerate the rollups of every account from its transaction history
+    @classmethod
+    def rebuild(cls, accounts: list) -> int:
+        replayed = 0
+        for account in accounts:
+            rollups = cls.empty()
+            for record in DataHandler.read_transactions(account):
+                cls.apply(rollups, TransactionTypes.from_record(record["type"]), Money.read(record, "amount"),
+                          Money.read(record, "new_balance"), DataHandler.posted(record))
+                replayed += 1
+            cls._rollups[account.id] = rollups
+            cls._dirty_rollups[account.id] = cls.rollups_path(account)
+        cls.flush()
+        return replayed
+
+    # Reports
+
+    # Summary of an account in a period, carrying the balance over when nothing happened
+    @classmethod
+    def summary(cls, account, period: str, key: str) -> dict:
+        entries: dict = cls.load(account)[period]
+        entry = entries.get(key)
+        if entry is not None:
+            return entry
+
+        earlier = [other for other in entries if other < key]
+        later = [other for other in entries if other > key]
+        if earlier:
+            balance = entries[max(earlier)]["closing_balance"]
+        elif later:
+            balance = entries[min(later)]["opening_balance"]
+        else:
+            balance = account.balance
+        return {"totals": {}, "count": 0, "net_change": 0, "opening_balance": balance, "closing_balance": balance}
+
+    # Write a savings report of every account into a .txt file
+    @classmethod
+    def generate(cls, accounts: list, period: str, key: str | None = None) -> Path:
+        key = key or cls.period_key(period, datetime.now())
+        lines = [
+            f"Basic Savings App - {period.capitalize()} Savings Report ({key})",
+            f"Generated at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+            "=" * 60
+        ]
+
+        total_net_change = 0
+        for account in accounts:
+            summary = cls.summary(account, period, key)
+            total_net_change += summary["net_change"]
+            lines.append(f"{account.name} ({account.id})")
+            lines.append(f"  {'Opening balance':<20} {Money.format(summary['opening_balance']):>15}")
+            for transaction_type in TransactionTypes:
+                lines.append(f"  {transaction_type.name.capitalize():<20} {Money.format(summary['totals'].get(transaction_type.name, 0)):>15}")
+            lines.append(f"  {'Net change':<20} {Money.format(summary['net_change'], signed=True):>15}")
+            lines.append(f"  {'Closing balance':<20} {Money.format(summary['closing_balance']):>15}")
+            lines.append(f"  {'Transactions':<20} {summary['count']:>15}")
+            lines.append("-" * 60)
+        lines.append(f"{'Total net change':<22} {Money.format(total_net_change, signed=True):>15}")
+
+        path = DataHandler.create_reports_folder() / f"{period}-{key}.txt"
+        DataHandler.write_text(path, "\n".join(lines) + "\n")
+        return path
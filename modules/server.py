@@ -0,0 +1,153 @@
+import asyncio, io, json, re, signal, sys
+from contextvars import ContextVar
+
+from modules.parser import Parser
+from modules.account import Account
+from modules.session import Session
+from modules.data_handler import DataHandler
+from modules.standing_orders import StandingOrders
+from modules.ascii_decorator import AsciiDecorator as Text
+
+# Send printed text to the buffer of the session running the command, or to the real stdout
+class SessionOutput(io.TextIOBase):
+
+    _buffer: ContextVar[io.StringIO] = ContextVar("session_output")
+
+    def __init__(self, stream) -> None:
+        self.stream = stream
+
+    def write(self, text: str) -> int:
+        buffer = SessionOutput._buffer.get(None)
+        if buffer is None:
+            return self.stream.write(text)
+        return buffer.write(text)
+
+    def flush(self) -> None:
+        if SessionOutput._buffer.get(None) is None:
+            self.stream.flush()
+
+class CommandServer():
+
+    # Server Variables
+    default_host: str = "127.0.0.1"
+    default_port: int = 8765
+    flush_interval_seconds: float = 1.0
+
+    # Colour codes are stripped from responses
+    _colour_pattern: re.Pattern = re.compile(r"\x1b\[[0-9;]*m")
+
+    # Initialise a server on a TCP address or a unix socket path.
+    def __init__(self, host: str | None = None, port: int | None = None, unix_path: str | None = None) -> None:
+        self.host: str = host or self.default_host
+        self.port: int = port or self.default_port
+        self.unix_path: str | None = unix_path
+        self.commands: int = 0
+        self._stopping: asyncio.Event | None = None
+
+    @classmethod # Alternative Constructor
+    def from_address(cls, address: str) -> CommandServer:
+        # unix:PATH, HOST:PORT, :PORT or HOST
+        if address.startswith("unix:"):
+            return cls(unix_path=address.removeprefix("unix:"))
+        host, _, port = address.rpartition(":") if ":" in address else (address, "", "")
+        return cls(host or None, int(port) if port else None)
+
+    # Commands
+
+    # Run one command of a session, called from a worker thread so disk I/O never blocks the event loop
+    @classmethod
+    def run_command(cls, parser: Parser, command: str) -> dict:
+        output = io.StringIO()
+        SessionOutput._buffer.set(output)
+        success, log = parser.parse(command)
+        return {
+            "success": success,
+            "log": cls._colour_pattern.sub("", log),
+            "output": cls._colour_pattern.sub("", output.getvalue())
+        }
+
+    # Connections
+
+    # Serve one client, every line it sends is a command and every reply is one JSON line
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        session = Session(Account.accounts[0] if Account.accounts else None)
+        parser = Parser(session=session)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode("utf-8").strip()
+                if command == "":
+                    continue
+
+                response = await asyncio.to_thread(self.run_command, parser, command)
+                self.commands += 1
+                writer.write((json.dumps(response) + "\n").encode("utf-8"))
+                await writer.drain()
+
+                # exit only ends this session, the server keeps running
+                if response["log"].startswith("Stopping"):
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    # Write changed profiles every now and then, without blocking the event loop
+    async def flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval_seconds)
+            await asyncio.to_thread(Account.flush_profiles)
+
+    # Run standing orders as they come due, without blocking the event loop
+    async def run_standing_orders(self) -> None:
+        while True:
+            await asyncio.sleep(StandingOrders.tick_seconds)
+            await asyncio.to_thread(StandingOrders.tick)
+
+    # Serving
+
+    async def serve(self) -> None:
+        sys.stdout = SessionOutput(sys.stdout)
+        if self.unix_path:
+            server = await asyncio.start_unix_server(self.handle_client, path=self.unix_path)
+            address = f"unix:{self.unix_path}"
+        else:
+            server = await asyncio.start_server(self.handle_client, self.host, self.port)
+            address = f"{self.host}:{self.port}"
+        print(f"{Text.GREEN}Serving commands on {address}. Press Ctrl+C to stop.{Text.RESET}")
+
+        self._stopping = asyncio.Event()
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, self.stop)
+        except NotImplementedError:
+            # Windows event loops don't support signal handlers
+            pass
+        flusher = asyncio.create_task(self.flush_periodically())
+        scheduler = asyncio.create_task(self.run_standing_orders())
+        try:
+            await self._stopping.wait()
+        finally:
+            # Close idle sessions too, otherwise stopping would wait for every client to leave
+            server.close()
+            server.close_clients()
+            await server.wait_closed()
+            flusher.cancel()
+            scheduler.cancel()
+            Account.flush_profiles()
+            DataHandler.flush()
+            sys.stdout = sys.stdout.stream
+
+    # Stop accepting commands, can be called from another task of the event loop
+    def stop(self) -> None:
+        if self._stopping is not None:
+            self._stopping.set()
+
+    # Run the server until it is interrupted
+    def run(self) -> None:
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+        print(f"Stopped serving, handled {self.commands} command(s).")
@@ -0,0 +1,29 @@
+from contextvars import ContextVar, Token
+
+class Session():
+
+    # Session running the current command (the terminal uses the default one)
+    _active_session: ContextVar[Session] = ContextVar("active_session")
+    _default_session: Session | None = None
+
+    # Initialise a session, each one has its own current account.
+    def __init__(self, current_account=None) -> None:
+        self.current_account = current_account
+
+    # Get the session of the command being run
+    @classmethod
+    def current(cls) -> Session:
+        session = cls._active_session.get(None)
+        if session is None:
+            if cls._default_session is None:
+                cls._default_session = cls()
+            session = cls._default_session
+        return session
+
+    # Make this session the current one until deactivate is called with the returned token
+    def activate(self) -> Token:
+        return Session._active_session.set(self)
+
+    @staticmethod
+    def deactivate(token: Token) -> None:
+        Session._active_session.reset(token)
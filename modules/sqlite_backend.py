@@ -0,0 +1,229 @@
+import json, sqlite3, threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+from modules.money import Money
+from modules.data_handler import DataHandler
+from modules.storage_backend import StorageBackend
+
+class SQLiteStorageBackend(StorageBackend):
+
+    # Every account, profile and transaction inside one SQLite database (WAL mode), money in cents
+    name: str = "sqlite"
+    database_file_name: str = "savings.sqlite3"
+
+    schema: str = """
+        CREATE TABLE IF NOT EXISTS accounts (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            balance INTEGER NOT NULL,
+            folder_path TEXT NOT NULL,
+            profile_path TEXT NOT NULL,
+            transactions_folder_path TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS transactions (
+            seq INTEGER PRIMARY KEY,
+            id TEXT NOT NULL,
+            account_id TEXT NOT NULL,
+            timestamp REAL NOT NULL,
+            type TEXT NOT NULL,
+            amount INTEGER NOT NULL,
+            new_balance INTEGER NOT NULL,
+            record TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS transactions_by_account_time ON transactions (account_id, timestamp);
+    """
+
+    # Statements are kept as constants so sqlite3 reuses their prepared form
+    insert_account_sql: str = "INSERT OR REPLACE INTO accounts VALUES (?, ?, ?, ?, ?, ?)"
+    update_account_sql: str = "UPDATE accounts SET name = ?, balance = ? WHERE id = ?"
+    update_balance_sql: str = "UPDATE accounts SET balance = ? WHERE id = ?"
+    select_accounts_sql: str = "SELECT id, name, balance, folder_path, profile_path, transactions_folder_path FROM accounts ORDER BY rowid"
+    select_account_sql: str = "SELECT id, name, balance, folder_path, profile_path, transactions_folder_path FROM accounts WHERE id = ?"
+    upsert_setting_sql: str = "INSERT INTO settings VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value"
+    select_setting_sql: str = "SELECT value FROM settings WHERE key = ?"
+    insert_transaction_sql: str = "INSERT INTO transactions (id, account_id, timestamp, type, amount, new_balance, record) VALUES (?, ?, ?, ?, ?, ?, ?)"
+    select_transactions_sql: str = "SELECT record FROM transactions WHERE account_id = ? ORDER BY seq"
+    query_transactions_sql: str = "SELECT record FROM transactions WHERE account_id = ? AND timestamp >= ? AND timestamp <= ? ORDER BY seq"
+    last_transaction_sql: str = "SELECT record FROM transactions WHERE account_id = ? ORDER BY seq DESC LIMIT 1"
+    profile_columns: tuple[str, ...] = ("id", "name", "balance_cents", "folder_path", "profile_path", "transactions_folder_path")
+    # Rows read from a cursor at a time
+    fetch_rows: int = 500
+
+    # Seconds a write waits for another connection's transaction before giving up
+    busy_timeout_seconds: float = 30.0
+
+    # Initialise the backend, the database is opened on first use.
+    def __init__(self, path: Path | None = None) -> None:
+        self.path: Path = Path(path) if path else DataHandler.data_folder_path / self.database_file_name
+        # Every thread has its own connection, so a write is only ever committed or rolled back by the
+        # thread that made it
+        self._local: threading.local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._lock = threading.RLock()
+
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            with self._lock:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                # Transactions are managed by atomic(), not by the sqlite3 module
+                connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=self.busy_timeout_seconds)
+                connection.execute("PRAGMA journal_mode = WAL")
+                connection.execute("PRAGMA synchronous = NORMAL")
+                connection.executescript(self.schema)
+                self._upgrade_money_columns(connection)
+                self._connections.append(connection)
+            self._local.connection = connection
+            self._local.depth = 0
+        return connection
+
+    # Databases written before money was kept in cents store major units, convert them once
+    def _upgrade_money_columns(self, connection: sqlite3.Connection) -> None:
+        if connection.execute(self.select_setting_sql, ("money_units",)).fetchone() is not None:
+            return
+        connection.execute("BEGIN IMMEDIATE")
+        # Another connection may have converted them meanwhile
+        if connection.execute(self.select_setting_sql, ("money_units",)).fetchone() is None:
+            connection.execute("UPDATE accounts SET balance = CAST(ROUND(balance * 100) AS INTEGER)")
+            connection.execute("UPDATE transactions SET amount = CAST(ROUND(amount * 100) AS INTEGER), new_balance = CAST(ROUND(new_balance * 100) AS INTEGER)")
+            connection.execute(self.upsert_setting_sql, ("money_units", "cents"))
+        connection.execute("COMMIT")
+
+    # Stream the rows of a query a chunk at a time, a cursor is never read while another thread uses the connection
+    def _rows(self, sql: str, parameters: tuple) -> Iterator[tuple]:
+        connection = self.connection()
+        with self._lock:
+            cursor = connection.execute(sql, parameters)
+            rows = cursor.fetchmany(self.fetch_rows)
+        while rows:
+            yield from rows
+            with self._lock:
+                rows = cursor.fetchmany(self.fetch_rows)
+
+    # Persistence
+
+    # Run the writes inside one SQL transaction of this thread's connection. Transactions are committed
+    # right away even while writes are deferred: keeping one open for a whole batch would hold the database
+    # write lock while the batch waits for account locks that other sessions hold while writing.
+    @contextmanager
+    def atomic(self):
+        connection = self.connection()
+        local = self._local
+        if not connection.in_transaction:
+            connection.execute("BEGIN IMMEDIATE")
+        local.depth += 1
+        try:
+            yield connection
+        except BaseException:
+            local.depth -= 1
+            if local.depth == 0:
+                connection.execute("ROLLBACK")
+            raise
+        local.depth -= 1
+        if local.depth == 0:
+            connection.execute("COMMIT")
+
+    # Commit what this thread wrote, other threads commit their own transactions
+    def flush(self) -> None:
+        connection = getattr(self._local, "connection", None)
+        if connection is not None and self._local.depth == 0 and connection.in_transaction:
+            connection.execute("COMMIT")
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+            self._local = threading.local()
+
+    # Accounts list
+
+    def get_accounts_list(self) -> dict:
+        with self._lock:
+            connection = self.connection()
+            counter = connection.execute(self.select_setting_sql, ("account_id_counter",)).fetchone()
+            accounts = {row[0]: {"name": row[1], "profile_path": row[4]} for row in connection.execute(self.select_accounts_sql)}
+        return {
+            "accounts": accounts,
+            "account_id_counter": int(counter[0]) if counter else 1
+        }
+
+    # Account rows are written by create_account, only the counter lives here
+    def add_to_accounts_list(self, account_id: str, entry: dict, account_id_counter: int) -> None:
+        self.update_accounts_list({"account_id_counter": account_id_counter})
+
+    def update_accounts_list(self, data: dict) -> None:
+        with self.atomic() as connection:
+            connection.execute(self.upsert_setting_sql, ("account_id_counter", str(data["account_id_counter"])))
+
+    # Profiles
+
+    def create_account(self, account_id: str, name: str, balance: int) -> dict:
+        # Account folder only holds derived data such as report rollups
+        folder_path = DataHandler.data_folder_path / account_id
+        folder_path.mkdir(parents=True, exist_ok=True)
+        profile = {
+            "id": account_id,
+            "name": name,
+            "balance_cents": balance,
+            "folder_path": str(folder_path),
+            "profile_path": str(self.path),
+            "transactions_folder_path": str(self.path)
+        }
+        with self.atomic() as connection:
+            connection.execute(self.insert_account_sql, tuple(profile.values()))
+        return profile
+
+    def read_account_profiles(self) -> Iterator[dict]:
+        with self._lock:
+            rows = self.connection().execute(self.select_accounts_sql).fetchall()
+        for row in rows:
+            profile = dict(zip(self.profile_columns, row))
+            profile["balance_cents"] = int(profile["balance_cents"])
+            yield profile
+
+    def read_account_profile(self, account) -> dict:
+        with self._lock:
+            row = self.connection().execute(self.select_account_sql, (account.id,)).fetchone()
+        if row is None:
+            raise KeyError(f"Account {account.id} isn't stored.")
+        profile = dict(zip(self.profile_columns, row))
+        profile["balance_cents"] = int(profile["balance_cents"])
+        return profile
+
+    def update_account_profile(self, account) -> None:
+        with self.atomic() as connection:
+            connection.execute(self.update_account_sql, (account.name, account.balance, account.id))
+
+    # Transactions
+
+    # The transaction and the new balance are stored in the same SQL transaction
+    def write_transaction(self, account, record: dict) -> None:
+        with self.atomic() as connection:
+            connection.execute(self.insert_transaction_sql, (
+                record["id"], account.id, record.get("timestamp", 0), record["type"],
+                Money.read(record, "amount"), Money.read(record, "new_balance"), json.dumps(record, separators=(",", ":"))
+            ))
+            connection.execute(self.update_balance_sql, (Money.read(record, "new_balance"), account.id))
+
+    def read_transactions(self, account) -> Iterator[dict]:
+        for (record,) in self._rows(self.select_transactions_sql, (account.id,)):
+            yield json.loads(record)
+
+    def last_transaction(self, account) -> dict | None:
+        with self._lock:
+            row = self.connection().execute(self.last_transaction_sql, (account.id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def query_transactions(self, account, start: float | None, end: float | None) -> Iterator[dict]:
+        start = start if start is not None else float("-inf")
+        end = end if end is not None else float("inf")
+        for (record,) in self._rows(self.query_transactions_sql, (account.id, start, end)):
+            yield json.loads(record)
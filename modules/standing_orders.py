@@ -0,0 +1,332 @@
+import heapq, threading, time
+from calendar import monthrange
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from modules.money import Money
+from modules.account import Account
+from modules.budgets import Budgets
+from modules.data_handler import DataHandler
+from modules.id_allocator import IdAllocator
+from modules.transaction_types import TransactionTypes
+
+class StandingOrders():
+
+    # What an order does on every run, and how often it runs. Anything else given as the schedule
+    # is read as a cron expression: minute hour day-of-month month day-of-week (0 is Sunday).
+    kinds: tuple[str, ...] = ("deposit", "withdraw", "transfer")
+    schedules: tuple[str, ...] = ("once", "daily", "weekly", "monthly")
+    cron_ranges: tuple[tuple[int, int], ...] = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+    # Runs one order may catch up in one pass, the rest are caught up on the next tick
+    max_catch_up_runs: int = 1000
+    # Seconds between two ticks of the server
+    tick_seconds: float = 30.0
+
+    # Orders are kept in each account folder, the schedule (order id: [next due, account id]) in the data root
+    orders_file_name: str = "standing_orders.json"
+    schedule_file_name: str = "schedule.json"
+
+    # Scheduler Variables (the heap holds (next due, account id, order id), entries the schedule no longer agrees with are skipped)
+    _orders: dict[str, dict] = {}
+    _dirty_accounts: dict[str, Path] = {}
+    _schedule: dict[str, list] | None = None
+    _schedule_changed: bool = False
+    _heap: list[tuple[float, str, str]] = []
+    _lock: threading.RLock = threading.RLock()
+
+    # Schedules
+
+    # Read a cron expression into the set of values allowed in each of its five fields
+    @classmethod
+    def parse_cron(cls, expression: str) -> list[set[int]]:
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Schedule {expression} isn't once, daily, weekly, monthly or a cron expression with 5 fields.")
+        parsed = []
+        for field, (low, high) in zip(fields, cls.cron_ranges):
+            values = set()
+            for part in field.split(","):
+                part_range, _, step = part.partition("/")
+                if part_range == "*":
+                    start, end = low, high
+                elif "-" in part_range:
+                    start, end = (int(value) for value in part_range.split("-", 1))
+                else:
+                    start = int(part_range)
+                    end = high if step else start
+                step = int(step) if step else 1
+                if start < low or end > high or start > end or step < 1:
+                    raise ValueError(f"Cron field {field} is out of range {low}-{high}.")
+                values.update(range(start, end + 1, step))
+            parsed.append(values)
+        return parsed
+
+    # First minute after a moment that a cron expression allows
+    @classmethod
+    def next_cron(cls, expression: str, after: datetime) -> datetime:
+        minutes, hours, days, months, weekdays = cls.parse_cron(expression)
+        any_day, any_weekday = len(days) == 31, len(weekdays) == 7
+        moment = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        # Eight years covers every day and weekday combination, leap days included
+        for _ in range(366 * 8):
+            weekday = moment.isoweekday() % 7
+            if any_weekday:
+                day_matches = moment.day in days
+            elif any_day:
+                day_matches = weekday in weekdays
+            else:
+                # Like cron, a day matches when either the day of month or the day of week does
+                day_matches = moment.day in days or weekday in weekdays
+            if moment.month in months and day_matches:
+                for hour in sorted(hour for hour in hours if hour >= moment.hour):
+                    for minute in sorted(minutes):
+                        if hour > moment.hour or minute >= moment.minute:
+                            return moment.replace(hour=hour, minute=minute)
+            moment = (moment + timedelta(days=1)).replace(hour=0, minute=0)
+        raise ValueError(f"Cron expression {expression} never runs.")
+
+    # Timestamp of the run after the one due at a timestamp, None when the order is done
+    @classmethod
+    def next_run(cls, order: dict, due: float) -> float | None:
+        moment = datetime.fromtimestamp(due)
+        match (order["every"]):
+            case "once":
+                return None
+            case "daily":
+                moment += timedelta(days=1)
+            case "weekly":
+                moment += timedelta(weeks=1)
+            case "monthly":
+                # Runs on the day it started on, or the last day of shorter months
+                year, month = moment.year + moment.month // 12, moment.month % 12 + 1
+                moment = moment.replace(year=year, month=month, day=min(order["day"], monthrange(year, month)[1]))
+            case _:
+                moment = cls.next_cron(order["every"], moment)
+        return moment.timestamp()
+
+    # Orders
+
+    @classmethod
+    def orders_path(cls, account) -> Path:
+        return Path(account.folder_path) / cls.orders_file_name
+
+    @classmethod
+    def schedule_path(cls) -> Path:
+        return DataHandler.data_folder_path / cls.schedule_file_name
+
+    # Get the orders of an account (order id: order), reading them from disk once
+    @classmethod
+    def orders(cls, account) -> dict[str, dict]:
+        with cls._lock:
+            orders = cls._orders.get(account.id)
+            if orders is None:
+                try:
+                    orders = DataHandler.read_json(cls.orders_path(account))
+                except FileNotFoundError:
+                    orders = {}
+                cls._orders[account.id] = orders
+            return orders
+
+    # Read the schedule once and build the heap of next due times from it
+    @classmethod
+    def load_schedule(cls) -> dict[str, list]:
+        with cls._lock:
+            if cls._schedule is None:
+                try:
+                    cls._schedule = DataHandler.read_json(cls.schedule_path())
+                except FileNotFoundError:
+                    cls._schedule = {}
+                cls._heap = [(due, account_id, order_id) for order_id, (due, account_id) in cls._schedule.items()]
+                heapq.heapify(cls._heap)
+            return cls._schedule
+
+    # Add an order to an account, the first run is due at start (now by default). Returns the order.
+    @classmethod
+    def schedule(cls, account, kind: str, amount: int, every: str, start: float | None = None,
+                 target=None, times: int | None = None, category: str | None = None) -> dict:
+        if kind not in cls.kinds:
+            raise ValueError(f"Unknown order {kind}, use {', '.join(cls.kinds)}.")
+        if amount <= 0:
+            raise ValueError("The amount of an order must be above 0.")
+        if kind == "transfer" and (target is None or target is account):
+            raise ValueError("A transfer order needs another account to transfer to.")
+        if times is not None and times < 1:
+            raise ValueError("An order runs at least once.")
+        if category is not None:
+            if kind == "transfer":
+                raise ValueError("Transfers have no category.")
+            category = Budgets.category_for(TransactionTypes.DEPOSIT, category)
+        every = every.lower() if every.lower() in cls.schedules else every
+        now = time.time()
+        if every in cls.schedules:
+            due = start if start is not None else now
+        else:
+            due = cls.next_cron(every, datetime.fromtimestamp((start if start is not None else now) - 60)).timestamp()
+
+        order = {
+            "id": IdAllocator.allocate(),
+            "kind": kind,
+            "amount_cents": amount,
+            "target_id": target.id if target is not None else None,
+            "category": category,
+            "every": every,
+            "day": datetime.fromtimestamp(due).day,
+            "remaining": 1 if every == "once" else times,
+            "next_due": due,
+            "runs": 0,
+            "failures": 0,
+            "created": now
+        }
+        with cls._lock:
+            cls.load_schedule()
+            cls.orders(account)[order["id"]] = order
+            cls._reschedule(account, order, due)
+            cls.flush()
+        return order
+
+    # Remove an order of an account, returns False when the account has no such order
+    @classmethod
+    def cancel(cls, account, order_id: str) -> bool:
+        with cls._lock:
+            cls.load_schedule()
+            order = cls.orders(account).get(order_id)
+            if order is None:
+                return False
+            cls._reschedule(account, order, None)
+            cls.flush()
+        return True
+
+    # Move an order to its next due time (None removes it), the heap keeps the old entry until it's popped
+    @classmethod
+    def _reschedule(cls, account, order: dict, due: float | None) -> None:
+        if due is None:
+            cls.orders(account).pop(order["id"], None)
+            cls._schedule.pop(order["id"], None)
+        else:
+            order["next_due"] = due
+            cls._schedule[order["id"]] = [due, account.id]
+            heapq.heappush(cls._heap, (due, account.id, order["id"]))
+        cls._dirty_accounts[account.id] = cls.orders_path(account)
+        cls._schedule_changed = True
+
+    # Take a broken order off the schedule, it is still listed (as disabled) until it is cancelled
+    @classmethod
+    def _disable(cls, account, order: dict, reason: str) -> None:
+        order["disabled"] = reason
+        cls._schedule.pop(order["id"], None)
+        cls._dirty_accounts[account.id] = cls.orders_path(account)
+        cls._schedule_changed = True
+
+    # Running
+
+    # Make one run of an order through the account, returns (success, log)
+    @staticmethod
+    def apply(account, order: dict) -> tuple:
+        amount = order["amount_cents"]
+        match (order["kind"]):
+            case "deposit":
+                return account.deposit(amount, True, order.get("category"))
+            case "withdraw":
+                return account.withdraw(amount, True, order.get("category"))
+            case "transfer":
+                return account.transfer(Account.find_account(order["target_id"]), amount)
+        return False, f"Unknown order {order['kind']}."
+
+    # Time until the next order is due, None when nothing is scheduled
+    @classmethod
+    def next_due(cls) -> float | None:
+        with cls._lock:
+            cls.load_schedule()
+            return cls._heap[0][0] if cls._heap else None
+
+    # Run every order due by now in one batched pass, catching up the runs missed meanwhile.
+    # Only the orders at the top of the heap are looked at. Returns the counts of what happened.
+    @classmethod
+    def run_due(cls, now: float | None = None) -> dict[str, int]:
+        now = time.time() if now is None else now
+        counts = {"orders": 0, "runs": 0, "caught_up": 0, "failed": 0}
+        with cls._lock:
+            cls.load_schedule()
+            if not cls._heap or cls._heap[0][0] > now:
+                return counts
+
+            # Everything written in the pass reaches the disk together, unless a batch already defers writes
+            started_deferred = not DataHandler.deferred()
+            if started_deferred:
+                DataHandler.begin_deferred()
+            try:
+                while cls._heap and cls._heap[0][0] <= now:
+                    due, account_id, order_id = heapq.heappop(cls._heap)
+                    if cls._schedule.get(order_id) != [due, account_id]:
+                        continue
+
+                    # Orders of accounts that are gone are dropped
+                    account = Account.find_account(account_id)
+                    order = cls.orders(account).get(order_id) if account is not None else None
+                    if order is None:
+                        cls._schedule.pop(order_id, None)
+                        cls._schedule_changed = True
+                        continue
+
+                    runs = 0
+                    try:
+                        while due is not None and due <= now and runs < cls.max_catch_up_runs:
+                            success, _ = cls.apply(account, order)
+                            runs += 1
+                            order["runs"] += 1
+                            if not success:
+                                order["failures"] += 1
+                                counts["failed"] += 1
+                            if order["remaining"] is not None:
+                                order["remaining"] -= 1
+                            due = cls.next_run(order, due) if order["remaining"] != 0 else None
+                    except (KeyError, TypeError, ValueError) as e:
+                        # A schedule with no next run or a hand-edited order must not stop the other orders
+                        order["failures"] = order.get("failures", 0) + 1
+                        counts["failed"] += 1
+                        cls._disable(account, order, str(e))
+                        continue
+                    order["last_run"] = now
+                    cls._reschedule(account, order, due)
+                    counts["orders"] += 1
+                    counts["runs"] += runs
+                    counts["caught_up"] += runs - 1
+                cls.flush()
+            finally:
+                if started_deferred:
+                    Account.flush_profiles()
+                    DataHandler.end_deferred()
+        return counts
+
+    # Run the due orders when the top of the heap says there are any, cheap enough to call before every command
+    @classmethod
+    def tick(cls) -> dict[str, int] | None:
+        due = cls.next_due()
+        if due is None or due > time.time():
+            return None
+        return cls.run_due()
+
+    # Write every changed orders file and the schedule, returns the amount of files written
+    @classmethod
+    def flush(cls) -> int:
+        with cls._lock:
+            dirty_accounts = cls._dirty_accounts
+            cls._dirty_accounts = {}
+            for account_id, path in dirty_accounts.items():
+                DataHandler.write_json(path, cls._orders[account_id])
+            written = len(dirty_accounts)
+            if cls._schedule_changed:
+                DataHandler.ensure_data_folder()
+                DataHandler.write_json(cls.schedule_path(), cls._schedule)
+                cls._schedule_changed = False
+                written += 1
+            return written
+
+    # Summary of a pass for the command line, None when nothing ran
+    @staticmethod
+    def describe(counts: dict[str, int] | None) -> str | None:
+        if not counts or counts["runs"] == 0:
+            return None
+        return (f"Ran {counts['runs']} standing order run(s) of {counts['orders']} order(s), "
+                f"{counts['caught_up']} caught up and {counts['failed']} failed.")
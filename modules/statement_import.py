@@ -0,0 +1,305 @@
+import csv, hashlib, html, re, sqlite3, time
+from datetime import date as date_type, datetime
+from itertools import islice
+from pathlib import Path
+from typing import Iterator
+
+from modules.money import Money
+from modules.account import Account
+from modules.data_handler import DataHandler
+from modules.transaction_types import TransactionTypes
+from modules.ascii_decorator import AsciiDecorator as Text
+
+class StatementImporter():
+
+    # Rows applied between two persistence flushes
+    default_batch_size: int = 1000
+
+    # Rejected rows listed in the summary, the rest are only counted
+    max_listed_rejects: int = 10
+
+    # OFX files are read in chunks, some banks put the whole file on one line
+    ofx_chunk_size: int = 64 * 1024
+    ofx_tag = re.compile(r"<(/?)([A-Za-z0-9.]+)>([^<]*)")
+
+    # Header names looked for when a CSV column isn't given (matched case-insensitively)
+    column_candidates: dict[str, list[str]] = {
+        "date": ["date", "posted", "posting date", "transaction date", "value date"],
+        "amount": ["amount", "value"],
+        "debit": ["debit", "withdrawal", "money out"],
+        "credit": ["credit", "deposit", "money in"],
+        "type": ["type", "transaction type"],
+        "description": ["description", "details", "memo", "name", "payee"],
+        "id": ["id", "reference", "fitid", "transaction id"]
+    }
+
+    # Values of a type column and the transaction they become
+    type_aliases: dict[str, TransactionTypes] = {
+        "DEPOSIT": TransactionTypes.DEPOSIT,
+        "CREDIT": TransactionTypes.DEPOSIT,
+        "CR": TransactionTypes.DEPOSIT,
+        "IN": TransactionTypes.DEPOSIT,
+        "WITHDRAW": TransactionTypes.WITHDRAW,
+        "WITHDRAWAL": TransactionTypes.WITHDRAW,
+        "DEBIT": TransactionTypes.WITHDRAW,
+        "DR": TransactionTypes.WITHDRAW,
+        "OUT": TransactionTypes.WITHDRAW
+    }
+
+    # Rows already imported into each account, kept on disk so memory doesn't grow with the file
+    imports_file_name: str = "imports.sqlite3"
+    schema: str = """
+        CREATE TABLE IF NOT EXISTS imported (
+            account_id TEXT NOT NULL,
+            key TEXT NOT NULL,
+            PRIMARY KEY (account_id, key)
+        ) WITHOUT ROWID;
+        CREATE TEMP TABLE seen (
+            key TEXT PRIMARY KEY,
+            count INTEGER NOT NULL
+        ) WITHOUT ROWID;
+    """
+    count_seen_sql: str = "INSERT INTO seen VALUES (?, 1) ON CONFLICT (key) DO UPDATE SET count = count + 1 RETURNING count"
+    select_imported_sql: str = "SELECT 1 FROM imported WHERE account_id = ? AND key = ?"
+    insert_imported_sql: str = "INSERT OR IGNORE INTO imported VALUES (?, ?)"
+
+    # Initialise an import of a statement file into an account.
+    def __init__(self, account: Account, path: str, file_format: str | None = None, columns: dict[str, str] | None = None,
+                 date_format: str = "%Y-%m-%d", delimiter: str = ",", batch_size: int | None = None) -> None:
+        self.account: Account = account
+        self.path: Path = Path(path)
+        self.file_format: str = (file_format or ("ofx" if self.path.suffix.lower() in (".ofx", ".qfx") else "csv")).lower()
+        self.columns: dict[str, str] = columns or {}
+        self.date_format: str = date_format
+        self.delimiter: str = delimiter
+        self.batch_size: int = batch_size or self.default_batch_size
+        self.rows: int = 0
+        self.imported: int = 0
+        self.duplicates: int = 0
+        self.rejected: int = 0
+        self.batches: int = 0
+        self.files_written: int = 0
+        self.rejects: list[tuple[int, str]] = []
+        self._connection: sqlite3.Connection | None = None
+
+    # Reading
+
+    # Raw rows of the statement as (row number, {field: text})
+    def read_rows(self) -> Iterator[tuple[int, dict[str, str]]]:
+        match (self.file_format):
+            case "csv":
+                return self.read_csv()
+            case "ofx":
+                return self.read_ofx()
+        raise ValueError(f"Unknown statement format {self.file_format}, use csv or ofx.")
+
+    # Column index of every field, from the given mapping or else the header names
+    def map_columns(self, header: list[str]) -> dict[str, int]:
+        names = [name.strip().casefold() for name in header]
+        mapping = {}
+        for field, candidates in self.column_candidates.items():
+            wanted = [self.columns[field]] if field in self.columns else candidates
+            for candidate in wanted:
+                if candidate.isdigit() and field in self.columns:
+                    mapping[field] = int(candidate)
+                    break
+                if candidate.casefold() in names:
+                    mapping[field] = names.index(candidate.casefold())
+                    break
+            else:
+                if field in self.columns:
+                    raise ValueError(f"Column {self.columns[field]} isn't in the statement header.")
+        if "date" not in mapping or ("amount" not in mapping and "debit" not in mapping and "credit" not in mapping):
+            raise ValueError("The statement needs a date column and an amount (or debit/credit) column.")
+        return mapping
+
+    def read_csv(self) -> Iterator[tuple[int, dict[str, str]]]:
+        with open(self.path, "r", newline="", encoding="utf-8-sig") as file:
+            reader = csv.reader(file, delimiter=self.delimiter)
+            header = next(reader, None)
+            if header is None:
+                return
+            mapping = self.map_columns(header)
+            for row in reader:
+                if not any(cell.strip() for cell in row):
+                    continue
+                yield reader.line_num, {field: row[index].strip() if index < len(row) else "" for field, index in mapping.items()}
+
+    def read_ofx(self) -> Iterator[tuple[int, dict[str, str]]]:
+        number, transaction, buffer = 0, None, ""
+        with open(self.path, "r", encoding="utf-8", errors="replace") as file:
+            while True:
+                chunk = file.read(self.ofx_chunk_size)
+                buffer += chunk
+                # Keep the last tag, it may go on in the next chunk
+                cut = buffer.rfind("<") if chunk else len(buffer)
+                if cut < 0:
+                    cut = len(buffer)
+                for closing, tag, value in self.ofx_tag.findall(buffer, 0, cut):
+                    tag = tag.upper()
+                    if tag == "STMTTRN":
+                        if closing and transaction is not None:
+                            number += 1
+                            yield number, {
+                                "date": transaction.get("DTPOSTED", "")[:8],
+                                "amount": transaction.get("TRNAMT", ""),
+                                "description": html.unescape(transaction.get("NAME") or transaction.get("MEMO", "")),
+                                "id": transaction.get("FITID", "")
+                            }
+                        transaction = None if closing else {}
+                    elif transaction is not None and not closing:
+                        transaction[tag] = value.strip()
+                buffer = buffer[cut:]
+                if not chunk:
+                    break
+
+    # Validating
+
+    # Amount as text into signed cents, "(12.00)" is a negative amount in many exports
+    @staticmethod
+    def parse_amount(text: str) -> int:
+        text = text.replace(" ", "")
+        comma, dot = text.rfind(","), text.rfind(".")
+        if comma > dot and (dot >= 0 or len(text) - comma - 1 <= 2):
+            # Decimal comma (e.g. 1.234,56 or 12,5)
+            text = text.replace(".", "").replace(",", ".")
+        else:
+            text = text.replace(",", "")
+        if text.startswith("(") and text.endswith(")"):
+            return -Money.parse(text[1:-1])
+        return Money.parse(text)
+
+    # Check a raw row and turn it into (row number, date, type, cents, description, reference)
+    def validate(self, number: int, row: dict[str, str]) -> tuple:
+        if self.file_format == "ofx":
+            date = datetime.strptime(row["date"], "%Y%m%d").date().isoformat()
+        elif self.date_format == "%Y-%m-%d" and len(row["date"]) == 10:
+            # strptime is slow, plain ISO dates have their own parser
+            date = date_type.fromisoformat(row["date"]).isoformat()
+        else:
+            date = datetime.strptime(row["date"], self.date_format).date().isoformat()
+
+        if row.get("amount"):
+            amount = self.parse_amount(row["amount"])
+        else:
+            # Some banks write debits as negative numbers, others as positive ones
+            amount = (abs(self.parse_amount(row["credit"])) if row.get("credit") else 0) - (abs(self.parse_amount(row["debit"])) if row.get("debit") else 0)
+
+        if row.get("type"):
+            transaction_type = self.type_aliases.get(row["type"].upper())
+            if transaction_type is None:
+                raise ValueError(f"unknown transaction type {row['type']}")
+        else:
+            transaction_type = TransactionTypes.DEPOSIT if amount > 0 else TransactionTypes.WITHDRAW
+        if amount == 0:
+            raise ValueError("amount is 0")
+        return number, date, transaction_type, abs(amount), row.get("description", ""), row.get("id", "")
+
+    # Valid rows of the statement, invalid ones are counted and skipped
+    def valid_rows(self, rows: Iterator[tuple[int, dict[str, str]]]) -> Iterator[tuple]:
+        for number, row in rows:
+            self.rows += 1
+            try:
+                yield self.validate(number, row)
+            except (KeyError, ValueError) as e:
+                self.reject(number, str(e))
+
+    def reject(self, number: int, reason: str) -> None:
+        self.rejected += 1
+        if len(self.rejects) < self.max_listed_rejects:
+            self.rejects.append((number, reason))
+
+    # Duplicates
+
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(DataHandler.ensure_data_folder() / self.imports_file_name)
+            self._connection.executescript(self.schema)
+        return self._connection
+
+    # Key of a row, bank references are unique by themselves, other rows count how often they appear in the file
+    def row_key(self, row: tuple) -> str | None:
+        _, date, transaction_type, amount, description, reference = row
+        if reference:
+            base = f"ref:{reference}"
+        else:
+            base = hashlib.sha1(f"{date}|{transaction_type.name}|{amount}|{description}".encode()).hexdigest()
+        occurrence = self.connection().execute(self.count_seen_sql, (base,)).fetchone()[0]
+        if reference:
+            # A reference seen twice in one file is the same transaction
+            return base if occurrence == 1 else None
+        return f"{base}#{occurrence}"
+
+    # Rows that weren't imported into the account before, paired with their key
+    def new_rows(self, rows: Iterator[tuple]) -> Iterator[tuple[tuple, str]]:
+        connection = self.connection()
+        for row in rows:
+            key = self.row_key(row)
+            if key is None or connection.execute(self.select_imported_sql, (self.account.id, key)).fetchone():
+                self.duplicates += 1
+                continue
+            yield row, key
+
+    # Applying
+
+    @staticmethod
+    def batched(items: Iterator, size: int) -> Iterator[list]:
+        while batch := list(islice(items, size)):
+            yield batch
+
+    # Apply a batch to the account, then persist it and its keys once
+    def apply(self, batch: list[tuple[tuple, str]]) -> None:
+        applied = []
+        for (number, date, transaction_type, amount, description, _), key in batch:
+            # Rows keep the date and memo of the statement, not the time they were imported
+            posted = datetime.fromisoformat(date).timestamp()
+            if transaction_type == TransactionTypes.DEPOSIT:
+                success, _ = self.account.deposit(amount, True, posted=posted, description=description or None)
+            else:
+                success, _ = self.account.withdraw(amount, True, posted=posted, description=description or None)
+            if not success:
+                self.reject(number, f"cannot {transaction_type.name.lower()} {Money.format(amount)} with a balance of {Money.format(self.account.balance)}")
+                continue
+            applied.append((self.account.id, key))
+
+        Account.flush_profiles()
+        self.files_written += DataHandler.flush()
+        # Keys are saved after the rows, a crash in between imports the batch again rather than losing it
+        connection = self.connection()
+        connection.executemany(self.insert_imported_sql, applied)
+        connection.commit()
+        self.imported += len(applied)
+        self.batches += 1
+
+    # Stream the statement through the pipeline, returns (success, summary)
+    def run(self) -> tuple:
+        started_deferred = not DataHandler.deferred()
+        if started_deferred:
+            DataHandler.begin_deferred()
+        started = time.perf_counter()
+        try:
+            for batch in self.batched(self.new_rows(self.valid_rows(self.read_rows())), self.batch_size):
+                self.apply(batch)
+        finally:
+            if started_deferred:
+                Account.flush_profiles()
+                self.files_written += DataHandler.end_deferred()
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+        elapsed = time.perf_counter() - started
+        return self.rejected == 0, self.summary(elapsed)
+
+    # Build the import report
+    def summary(self, elapsed: float) -> str:
+        rate = self.rows / elapsed if elapsed > 0 else 0
+        lines = [f"{Text.RED}Row {number}:{Text.RESET} {reason}" for number, reason in self.rejects]
+        if self.rejected > len(self.rejects):
+            lines.append(f"{Text.RED}... and {self.rejected - len(self.rejects)} more rejected row(s).{Text.RESET}")
+        colour = Text.GREEN if self.rejected == 0 else Text.YELLOW
+        lines.append(
+            f"{colour}Read {self.rows} row(s) from {self.path} into {self.account.name} in {elapsed:.3f}s ({rate:.0f} rows/sec), "
+            f"{self.imported} imported, {self.duplicates} duplicate(s) skipped, {self.rejected} rejected, "
+            f"{self.files_written} file(s) written over {self.batches} batch(es).{Text.RESET}"
+        )
+        return "\n".join(lines)
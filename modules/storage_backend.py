@@ -0,0 +1,375 @@
+import json, os, threading
+from abc import ABC, abstractmethod
+from contextlib import nullcontext
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Iterator
+
+from modules.money import Money
+from modules.journal import Journal
+from modules.data_handler import DataHandler
+from modules.instrumentation import Instrumentation
+
+class StorageBackend(ABC):
+
+    # Name used in config.json ("storage_backend")
+    name: str = ""
+
+    # Get a backend by its config name
+    @staticmethod
+    def from_name(name: str) -> StorageBackend:
+        match (name.lower()):
+            case "json":
+                return JsonStorageBackend()
+            case "sqlite":
+                from modules.sqlite_backend import SQLiteStorageBackend
+                return SQLiteStorageBackend()
+        raise ValueError(f"Unknown storage backend {name}, use json or sqlite.")
+
+    # Accounts list
+
+    @abstractmethod
+    def get_accounts_list(self) -> dict:
+        ...
+
+    @abstractmethod
+    def update_accounts_list(self, data: dict) -> None:
+        ...
+
+    # Add a new account ({"name", "profile_path"}) to the list together with the id counter after it
+    def add_to_accounts_list(self, account_id: str, entry: dict, account_id_counter: int) -> None:
+        data = self.get_accounts_list()
+        self.update_accounts_list({
+            "accounts": {**data.get("accounts", {}), account_id: entry},
+            "account_id_counter": account_id_counter
+        })
+
+    # Profiles
+
+    # Create the storage of a new account (balance in cents), returns its profile
+    @abstractmethod
+    def create_account(self, account_id: str, name: str, balance: int) -> dict:
+        ...
+
+    # Stream the profile of every account in the order they were created
+    @abstractmethod
+    def read_account_profiles(self) -> Iterator[dict]:
+        ...
+
+    # Stream what the registry needs of every account, a "balance_cents" of None is read later by read_account_profile
+    def read_account_index(self) -> Iterator[dict]:
+        return self.read_account_profiles()
+
+    @abstractmethod
+    def read_account_profile(self, account) -> dict:
+        ...
+
+    @abstractmethod
+    def update_account_profile(self, account) -> None:
+        ...
+
+    # Transactions
+
+    @abstractmethod
+    def write_transaction(self, account, record: dict) -> None:
+        ...
+
+    # Store both legs of a transfer as one unit, legs are (account, record) pairs
+    def write_transfer(self, transfer: dict, legs: list[tuple]) -> None:
+        with self.atomic():
+            for account, record in legs:
+                self.write_transaction(account, record)
+
+    @abstractmethod
+    def read_transactions(self, account) -> Iterator[dict]:
+        ...
+
+    @abstractmethod
+    def query_transactions(self, account, start: float | None, end: float | None) -> Iterator[dict]:
+        ...
+
+    def last_transaction(self, account) -> dict | None:
+        record = None
+        for record in self.read_transactions(account):
+            pass
+        return record
+
+    # Persistence
+
+    # Group several writes so they are applied all together or not at all
+    def atomic(self):
+        return nullcontext()
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    # Finish work a crash interrupted, returns the amount of records written again
+    def recover(self) -> int:
+        return 0
+
+    # Account-like view of a stored profile, with the balance in cents
+    @staticmethod
+    def profile_account(profile: dict) -> SimpleNamespace:
+        account = SimpleNamespace(**profile)
+        account.balance = Money.read(profile, "balance")
+        return account
+
+    # Migration
+
+    # Copy every account, profile and transaction from one backend into another
+    @staticmethod
+    def migrate(source: StorageBackend, target: StorageBackend) -> tuple[int, int]:
+        accounts_list = source.get_accounts_list()
+        accounts, transactions = 0, 0
+        for profile in source.read_account_profiles():
+            source_account = StorageBackend.profile_account(profile)
+            target_account = StorageBackend.profile_account(target.create_account(profile["id"], profile["name"], Money.read(profile, "balance")))
+            with target.atomic():
+                for record in source.read_transactions(source_account):
+                    target.write_transaction(target_account, record)
+                    transactions += 1
+                target.update_account_profile(target_account)
+            accounts += 1
+        target.update_accounts_list({
+            "accounts": {profile["id"]: {"name": profile["name"], "profile_path": profile["profile_path"]} for profile in target.read_account_profiles()},
+            "account_id_counter": accounts_list.get("account_id_counter", accounts + 1)
+        })
+        target.flush()
+        return accounts, transactions
+
+class JsonStorageBackend(StorageBackend):
+
+    # One folder per account holding profile.json and a transaction journal
+    name: str = "json"
+
+    # Accounts appended to accounts.jsonl before accounts.json is rewritten with them
+    compact_accounts_after: int = 1000
+
+    def __init__(self) -> None:
+        # Transfers being written, by id, and the newest one that is complete
+        self._transfers_lock = threading.Lock()
+        self._transfers_in_progress: dict[str, float] = {}
+        self._last_transfer: float | None = None
+        self._last_logged: float = 0.0
+        self._transfers_folder: Path | None = None
+        # Last accounts list read or written, startup reads it more than once
+        self._accounts_list: dict | None = None
+        self._accounts_lock = threading.RLock()
+        # Lines in accounts.jsonl
+        self._logged_accounts: int = 0
+
+    def accounts_json_file(self) -> Path:
+        return DataHandler.data_folder_path / "accounts.json"
+
+    # Every transfer is committed by one record here before its legs reach the account journals
+    def transfers_folder(self) -> Path:
+        folder = DataHandler.data_folder_path / "transfers"
+        if folder != self._transfers_folder:
+            folder.mkdir(parents=True, exist_ok=True)
+            self._transfers_folder = folder
+        return folder
+
+    # Transfers older than this timestamp have both legs in the account journals
+    def transfers_applied_file(self) -> Path:
+        return self.transfers_folder() / "applied.json"
+
+    # New accounts are appended here, one line each, instead of rewriting accounts.json every time
+    def accounts_log_file(self) -> Path:
+        return DataHandler.data_folder_path / "accounts.jsonl"
+
+    # Accounts list (id: {"name", "profile_path"}, older lists hold only the profile path).
+    # accounts.json plus the accounts appended after it was written, an account it already holds keeps its entry.
+
+    def get_accounts_list(self) -> dict:
+        with self._accounts_lock:
+            if self._accounts_list is None:
+                try:
+                    data = DataHandler.read_json(self.accounts_json_file())
+                except FileNotFoundError:
+                    data = {
+                        "accounts": {},
+                        "account_id_counter": 1
+                    }
+                self._logged_accounts = 0
+                try:
+                    with open(self.accounts_log_file(), "r") as file:
+                        for line in file:
+                            try:
+                                added = json.loads(line)
+                            except json.JSONDecodeError:
+                                # A torn line can only be the last one written before a crash
+                                continue
+                            data["accounts"].setdefault(added["id"], added["entry"])
+                            data["account_id_counter"] = max(data.get("account_id_counter", 1), added["account_id_counter"])
+                            self._logged_accounts += 1
+                except FileNotFoundError:
+                    pass
+                self._accounts_list = data
+            return self._accounts_list
+
+    def update_accounts_list(self, data: dict) -> None:
+        with self._accounts_lock:
+            DataHandler.ensure_data_folder()
+            DataHandler.write_json(self.accounts_json_file(), data)
+            self._accounts_list = data
+            # accounts.json holds every account now, the appended ones can go once it is on disk
+            if not DataHandler.deferred():
+                self.accounts_log_file().unlink(missing_ok=True)
+                self._logged_accounts = 0
+
+    # Append one line instead of writing the whole list, the list is rewritten once enough lines piled up
+    def add_to_accounts_list(self, account_id: str, entry: dict, account_id_counter: int) -> None:
+        with self._accounts_lock:
+            data = self.get_accounts_list()
+            data["accounts"][account_id] = entry
+            data["account_id_counter"] = account_id_counter
+            if self._logged_accounts >= self.compact_accounts_after:
+                self.update_accounts_list(data)
+                return
+            DataHandler.ensure_data_folder()
+            line = json.dumps({"id": account_id, "entry": entry, "account_id_counter": account_id_counter}, separators=(",", ":")) + "\n"
+            if Instrumentation.enabled():
+                Instrumentation.count("files_opened")
+                Instrumentation.count("bytes_written", len(line))
+            with open(self.accounts_log_file(), "a") as file:
+                file.write(line)
+            self._logged_accounts += 1
+
+    # Profiles
+
+    def create_account(self, account_id: str, name: str, balance: int) -> dict:
+        # Create an account folder with a transactions folder inside
+        folder_path = DataHandler.data_folder_path / account_id
+        folder_path.mkdir(parents=True, exist_ok=True)
+        transactions_folder_path = folder_path / "transactions"
+        transactions_folder_path.mkdir(exist_ok=True)
+
+        # Create a profile.json file
+        profile = {
+            "id": account_id,
+            "name": name,
+            "balance_cents": balance,
+            "folder_path": str(folder_path),
+            "profile_path": str(folder_path / "profile.json"),
+            "transactions_folder_path": str(transactions_folder_path)
+        }
+        DataHandler.write_json(profile["profile_path"], profile)
+        return profile
+
+    def read_account_profiles(self) -> Iterator[dict]:
+        for entry in self.get_accounts_list().get("accounts", {}).values():
+            yield DataHandler.read_json(entry["profile_path"] if isinstance(entry, dict) else entry)
+
+    # Accounts the list names are known without opening their profile, the folders sit next to profile.json
+    def read_account_index(self) -> Iterator[dict]:
+        for account_id, entry in self.get_accounts_list().get("accounts", {}).items():
+            if not isinstance(entry, dict):
+                yield DataHandler.read_json(entry)
+                continue
+            folder_path = os.path.dirname(entry["profile_path"])
+            yield {
+                "id": account_id,
+                "name": entry["name"],
+                "balance_cents": None,
+                "folder_path": folder_path,
+                "profile_path": entry["profile_path"],
+                "transactions_folder_path": os.path.join(folder_path, "transactions")
+            }
+
+    def read_account_profile(self, account) -> dict:
+        return DataHandler.read_json(account.profile_path)
+
+    def update_account_profile(self, account) -> None:
+        DataHandler.write_json(account.profile_path, {
+            "id": account.id,
+            "name": account.name,
+            "balance_cents": account.balance,
+            "folder_path": str(account.folder_path),
+            "profile_path": str(account.profile_path),
+            "transactions_folder_path": str(account.transactions_folder_path)
+        })
+
+    # Transactions
+
+    def write_transaction(self, account, record: dict) -> None:
+        Journal.for_folder(account.transactions_folder_path).append(record, flush=not DataHandler.deferred())
+
+    def write_transfer(self, transfer: dict, legs: list[tuple]) -> None:
+        # The transfer record is the commit point, a crash after it is finished by recover.
+        # Records are logged in timestamp order, so recover can start from the oldest unfinished one.
+        with self._transfers_lock:
+            transfer["timestamp"] = max(transfer["timestamp"], self._last_logged)
+            self._last_logged = transfer["timestamp"]
+            self._transfers_in_progress[transfer["id"]] = transfer["timestamp"]
+            Journal.for_folder(self.transfers_folder()).append(transfer, sync=not DataHandler.deferred())
+        try:
+            for account, record in legs:
+                self.write_transaction(account, record)
+        finally:
+            with self._transfers_lock:
+                del self._transfers_in_progress[transfer["id"]]
+                self._last_transfer = max(self._last_transfer or 0, transfer["timestamp"])
+
+    def read_transactions(self, account) -> Iterator[dict]:
+        return Journal.for_folder(account.transactions_folder_path).read()
+
+    def query_transactions(self, account, start: float | None, end: float | None) -> Iterator[dict]:
+        return Journal.for_folder(account.transactions_folder_path).query(start, end)
+
+    def last_transaction(self, account) -> dict | None:
+        return Journal.for_folder(account.transactions_folder_path).last()
+
+    # Persistence
+
+    def flush(self) -> None:
+        Journal.flush_all()
+        with self._transfers_lock:
+            in_progress = list(self._transfers_in_progress.values())
+            applied = min(in_progress) if in_progress else self._last_transfer
+            self._last_transfer = None
+        if applied is not None:
+            DataHandler.write_json(self.transfers_applied_file(), {"timestamp": applied})
+
+    # Write the legs of committed transfers that never reached the account journals
+    def recover(self) -> int:
+        # Nothing was ever transferred, don't create the folder just to look into it
+        if not (DataHandler.data_folder_path / "transfers").is_dir():
+            return 0
+        try:
+            applied = DataHandler.read_json(self.transfers_applied_file())["timestamp"]
+        except FileNotFoundError:
+            applied = None
+
+        # Only the accounts list is read here, profiles are read for the accounts a leg gets written to
+        recovered, touched, latest, profiles = 0, set(), None, None
+        for transfer in Journal.for_folder(self.transfers_folder()).query(start=applied):
+            latest = transfer["timestamp"]
+            if profiles is None:
+                profiles = {profile["id"]: profile for profile in self.read_account_index()}
+            for record in transfer["legs"]:
+                profile = profiles.get(record["account_id"])
+                if profile is None:
+                    continue
+                journal = Journal.for_folder(profile["transactions_folder_path"])
+                written = journal.query(record["timestamp"], record["timestamp"])
+                # A bulk transfer has several legs in one account, each one is looked for by its own id
+                if any(leg["id"] == record["id"] for leg in written):
+                    continue
+                journal.append(record)
+                touched.add(record["account_id"])
+                recovered += 1
+
+        # The last journal record holds the balance after every recovered leg
+        for account_id in touched:
+            account = StorageBackend.profile_account(self.read_account_profile(SimpleNamespace(**profiles[account_id])))
+            account.balance = Money.read(Journal.for_folder(account.transactions_folder_path).last(), "new_balance")
+            self.update_account_profile(account)
+
+        # Only newer transfers need to be checked next time
+        if latest is not None and latest != applied:
+            self._last_transfer = latest
+            self.flush()
+        return recovered
@@ -1,33 +1,91 @@
-import uuid
+import threading, time
+from modules.money import Money
+from modules.report import Report
 from modules.data_handler import DataHandler
+from modules.id_allocator import IdAllocator
 from modules.transaction_types import TransactionTypes
 
 class Transaction():
+
+    # Timestamps never go backwards, so journals stay sorted by time
+    _last_timestamp: float = 0.0
+    _timestamp_lock: threading.Lock = threading.Lock()
     
-    def __init__(self, account, transaction_type: TransactionTypes, amount: float,
-                 transferer, receiver):
+    def __init__(self, account, transaction_type: TransactionTypes, amount: int,
+                 transferer, receiver, transfer_id: str | None = None, timestamp: float | None = None, store: bool = True,
+                 category: str | None = None, posted: float | None = None, description: str | None = None):
         from modules.account import Account
 
-        self.id : str = str(uuid.uuid4())[:8]
+        self.timestamp: float = timestamp or Transaction.next_timestamp()
+        # Ids sort by the time they were made, so "since" scans can compare ids
+        self.id : str = IdAllocator.allocate(self.timestamp)
         self.account : Account = account
         self.transaction_type: TransactionTypes = transaction_type
-        self.amount: float = amount
+        # Amount in cents
+        self.amount: int = amount
         self.transferer: Account = transferer
         self.receiver: Account = receiver
+        self.transfer_id: str | None = transfer_id
+        # Income or expense category (see Budgets), transfers have none
+        self.category: str | None = category
+        # When the money actually moved (e.g. the date on a bank statement), history and reports go by it
+        self.posted: float = posted if posted is not None else self.timestamp
+        self.description: str | None = description
+        # Balance of the account right after this transaction, in cents
+        self.new_balance: int = account.balance
 
         # Create the transaction information
-        
-        DataHandler.write_transaction(self.account, self)
+        if store:
+            DataHandler.write_transaction(self.account, self)
+            Report.record(self.account, self)
+
+    @classmethod # Alternative Constructor
+    def transfer(cls, transferer, receiver, amount: int) -> tuple[Transaction, Transaction]:
+        # Both legs share an id and a timestamp and are stored with a single commit
+        transfer_id, timestamp = cls.new_transfer()
+        legs = cls.legs(transferer, receiver, amount, transfer_id, timestamp)
+        cls.store_transfer(list(legs))
+        return legs
+
+    # Id and timestamp shared by every leg of a transfer
+    @classmethod
+    def new_transfer(cls) -> tuple[str, float]:
+        timestamp = cls.next_timestamp()
+        return IdAllocator.allocate(timestamp), timestamp
+
+    # Both legs of moving an amount between two accounts, made once their balances moved and not stored yet
+    @classmethod
+    def legs(cls, transferer, receiver, amount: int, transfer_id: str, timestamp: float) -> tuple[Transaction, Transaction]:
+        return (
+            cls(transferer, TransactionTypes.TRANSFER, amount, transferer, receiver, transfer_id, timestamp, store=False),
+            cls(receiver, TransactionTypes.RECEIVE, amount, transferer, receiver, transfer_id, timestamp, store=False)
+        )
+
+    # Store the legs of a transfer with a single commit, however many there are
+    @staticmethod
+    def store_transfer(legs: list[Transaction]) -> None:
+        DataHandler.write_transfer(legs)
+        for leg in legs:
+            Report.record(leg.account, leg)
+
+    # Every call gets a later timestamp than the one before (earlier runs included, through the
+    # high-water mark), so a checkpoint time splits history exactly
+    @classmethod
+    def next_timestamp(cls) -> float:
+        with cls._timestamp_lock:
+            cls._last_timestamp = max(time.time(), cls._last_timestamp + 1e-6, IdAllocator.high_water() + 1e-6)
+            IdAllocator.reserve(cls._last_timestamp)
+            return cls._last_timestamp
 
     def __str__(self) -> str:
         if self.transaction_type == TransactionTypes.DEPOSIT:
-            return f"Transaction: DEPOSITED {self.amount} to {self.account.name}, now {self.account.balance}."
+            return f"Transaction: DEPOSITED {Money.format(self.amount)} to {self.account.name}, now {Money.format(self.account.balance)}."
         elif self.transaction_type == TransactionTypes.WITHDRAW:
-            return f"Transaction: WITHDREW {self.amount} from {self.account.name}, now {self.account.balance}."
+            return f"Transaction: WITHDREW {Money.format(self.amount)} from {self.account.name}, now {Money.format(self.account.balance)}."
         elif self.transaction_type == TransactionTypes.TRANSFER:
-            return f"Transaction: TRANSFER {self.amount} from {self.transferer.name} to {self.receiver.name}, now {self.account.balance}."
+            return f"Transaction: TRANSFER {Money.format(self.amount)} from {self.transferer.name} to {self.receiver.name}, now {Money.format(self.account.balance)}."
         elif self.transaction_type == TransactionTypes.RECEIVE:
-            return f"Transaction: RECEIVE {self.amount} from {self.transferer.name}, now {self.account.balance}."
+            return f"Transaction: RECEIVE {Money.format(self.amount)} from {self.transferer.name}, now {Money.format(self.account.balance)}."
         else:
-            return f"Transaction: {self.transaction_type} {self.amount} -> {self.account.name}"
+            return f"Transaction: {self.transaction_type} {Money.format(self.amount)} -> {self.account.name}"
     
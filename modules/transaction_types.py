@@ -5,4 +5,14 @@ class TransactionTypes(Enum):
     WITHDRAW = auto()
     TRANSFER = auto()
     RECEIVE = auto()
-    
\ No newline at end of file
+
+    # Amount as seen by the account balance (money in is positive, money out is negative)
+    def signed(self, amount: int) -> int:
+        if self in (TransactionTypes.WITHDRAW, TransactionTypes.TRANSFER):
+            return -amount
+        return amount
+
+    # Get the type back from its stored form (e.g. "TransactionTypes.DEPOSIT")
+    @classmethod
+    def from_record(cls, value: str) -> TransactionTypes:
+        return cls[value.removeprefix(f"{cls.__name__}.")]
@@ -0,0 +1,30 @@
+import tempfile, unittest
+from pathlib import Path
+
+from modules.account import Account
+from modules.journal import Journal
+from modules.data_handler import DataHandler
+from modules.storage_backend import JsonStorageBackend
+
+class DataFolderTestCase(unittest.TestCase):
+
+    # Every test gets its own data root with the JSON backend and an empty account registry
+    def setUp(self) -> None:
+        self._folder = tempfile.TemporaryDirectory()
+        self.data_folder_path: Path = DataHandler.initialise(self._folder.name)
+        DataHandler.use_backend(JsonStorageBackend())
+        Account.load_accounts()
+
+    def tearDown(self) -> None:
+        Account.flush_profiles()
+        DataHandler.flush()
+        Journal.flush_all()
+        self._folder.cleanup()
+
+    # Start again on the same data root, like the app does after a crash: nothing kept in memory is trusted
+    def restart(self) -> None:
+        Journal.flush_all()
+        # Profile changes the crashed run hadn't written yet are lost with it
+        Account._dirty_accounts.clear()
+        DataHandler.use_backend(JsonStorageBackend())
+        Account.load_accounts()
@@ -0,0 +1,59 @@
+import json, tempfile, unittest
+from pathlib import Path
+
+from modules.journal import Journal
+
+class MigrateTransactionsFolderTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self._folder = tempfile.TemporaryDirectory()
+        self.folder_path: Path = Path(self._folder.name) / "transactions"
+        self.folder_path.mkdir()
+
+    def tearDown(self) -> None:
+        Journal.for_folder(self.folder_path).close()
+        self._folder.cleanup()
+
+    # Old one-file-per-transaction logs, named like the app used to name them
+    def write_old_files(self, *timestamps: float) -> None:
+        for timestamp in timestamps:
+            record = {"id": f"{int(timestamp):08x}", "timestamp": timestamp, "type": "DEPOSIT", "amount_cents": 100}
+            with open(self.folder_path / f"{int(timestamp)}.json", "w") as file:
+                json.dump(record, file)
+
+    def journal_timestamps(self) -> list[float]:
+        return [record["timestamp"] for record in Journal.for_folder(self.folder_path).read()]
+
+    def test_records_move_into_the_journal_in_order(self) -> None:
+        self.write_old_files(300.0, 100.0, 200.0)
+        self.assertEqual(Journal.migrate_transactions_folder(self.folder_path), 3)
+        self.assertEqual(self.journal_timestamps(), [100.0, 200.0, 300.0])
+        self.assertEqual(list(self.folder_path.glob("*.json")), [])
+
+    # A run that stopped before removing the old files copies none of them twice, and keeps files added since
+    def test_running_again_copies_nothing_twice(self) -> None:
+        self.write_old_files(100.0, 200.0)
+        Journal.migrate_transactions_folder(self.folder_path)
+        self.write_old_files(100.0, 200.0, 150.0)
+
+        self.assertEqual(Journal.migrate_transactions_folder(self.folder_path), 3)
+        self.assertEqual(self.journal_timestamps(), [100.0, 150.0, 200.0])
+        self.assertEqual(Journal.migrate_transactions_folder(self.folder_path), 0)
+        self.assertEqual(self.journal_timestamps(), [100.0, 150.0, 200.0])
+
+    # Records the journal already holds are newer, old files can only go ahead of them
+    def test_old_files_newer_than_the_journal_are_refused(self) -> None:
+        Journal.for_folder(self.folder_path).append({"id": "new", "timestamp": 500.0})
+        self.write_old_files(100.0, 900.0)
+
+        with self.assertRaises(ValueError):
+            Journal.migrate_transactions_folder(self.folder_path)
+        self.assertEqual(self.journal_timestamps(), [500.0])
+        self.assertTrue((self.folder_path / "900.json").exists())
+
+        (self.folder_path / "900.json").unlink()
+        self.assertEqual(Journal.migrate_transactions_folder(self.folder_path), 1)
+        self.assertEqual(self.journal_timestamps(), [100.0, 500.0])
+
+if __name__ == "__main__":
+    unittest.main()
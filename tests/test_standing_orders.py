@@ -0,0 +1,39 @@
+import unittest
+from datetime import datetime
+
+from modules.standing_orders import StandingOrders
+
+class NextCronTest(unittest.TestCase):
+
+    def assertNext(self, expression: str, after: datetime, expected: datetime) -> None:
+        self.assertEqual(StandingOrders.next_cron(expression, after), expected)
+
+    def test_always_after_the_given_minute(self) -> None:
+        self.assertNext("* * * * *", datetime(2026, 10, 16, 10, 7, 30), datetime(2026, 10, 16, 10, 8))
+        self.assertNext("30 9 * * *", datetime(2026, 10, 16, 9, 30), datetime(2026, 10, 17, 9, 30))
+
+    def test_steps_and_lists(self) -> None:
+        self.assertNext("*/15 * * * *", datetime(2026, 10, 16, 10, 7), datetime(2026, 10, 16, 10, 15))
+        self.assertNext("0 8,20 * * *", datetime(2026, 10, 16, 12, 0), datetime(2026, 10, 16, 20, 0))
+        self.assertNext("45 23 * * *", datetime(2026, 12, 31, 23, 50), datetime(2027, 1, 1, 23, 45))
+
+    # 2026-10-16 is a Friday, weekdays count from Sunday (0)
+    def test_weekdays(self) -> None:
+        self.assertNext("30 9 * * 1-5", datetime(2026, 10, 16, 10, 0), datetime(2026, 10, 19, 9, 30))
+        self.assertNext("0 0 * * 0", datetime(2026, 10, 16, 10, 0), datetime(2026, 10, 18, 0, 0))
+
+    # Like cron, a day matches when either the day of month or the day of week does
+    def test_day_of_month_or_weekday(self) -> None:
+        self.assertNext("0 12 1 * 0", datetime(2026, 10, 16, 10, 0), datetime(2026, 10, 18, 12, 0))
+        self.assertNext("0 12 1 * 0", datetime(2026, 10, 25, 13, 0), datetime(2026, 11, 1, 12, 0))
+
+    def test_leap_day(self) -> None:
+        self.assertNext("0 0 29 2 *", datetime(2025, 3, 1), datetime(2028, 2, 29))
+
+    def test_invalid_expressions(self) -> None:
+        for expression in ("61 * * * *", "* * * *", "0 0 0 * *", "*/0 * * * *", "0 0 31 2 *"):
+            with self.subTest(expression=expression), self.assertRaises(ValueError):
+                StandingOrders.next_cron(expression, datetime(2026, 10, 16))
+
+if __name__ == "__main__":
+    unittest.main()
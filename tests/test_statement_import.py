@@ -0,0 +1,59 @@
+import unittest
+from datetime import datetime
+
+from support import DataFolderTestCase
+from modules.account import Account
+from modules.data_handler import DataHandler
+from modules.statement_import import StatementImporter
+
+class StatementImportTest(DataFolderTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.account: Account = Account.create_account("Checking", 100000)
+
+    def write_statement(self, name: str, *rows: str) -> str:
+        path = self.data_folder_path / name
+        path.write_text("\n".join(("Date,Amount,Description,Reference",) + rows) + "\n")
+        return str(path)
+
+    def run_import(self, path: str) -> StatementImporter:
+        importer = StatementImporter(self.account, path)
+        success, _ = importer.run()
+        self.assertTrue(success)
+        return importer
+
+    def imported(self) -> list[dict]:
+        return list(DataHandler.read_transactions(self.account))[1:]
+
+    def test_rows_keep_the_statement_date_and_description(self) -> None:
+        self.run_import(self.write_statement("october.csv", "2026-10-01,-12.50,Coffee,", "2026-10-02,2000.00,Salary,REF-1"))
+        records = self.imported()
+        self.assertEqual([DataHandler.posted(record) for record in records],
+                         [datetime(2026, 10, 1).timestamp(), datetime(2026, 10, 2).timestamp()])
+        self.assertEqual([record["description"] for record in records], ["Coffee", "Salary"])
+        self.assertEqual(self.account.balance, 100000 - 1250 + 200000)
+
+    # Importing the same statement again changes nothing, identical rows in one file are still all imported
+    def test_reimport_skips_every_row(self) -> None:
+        path = self.write_statement("october.csv", "2026-10-01,-12.50,Coffee,", "2026-10-01,-12.50,Coffee,",
+                                    "2026-10-02,2000.00,Salary,REF-1")
+        first = self.run_import(path)
+        self.assertEqual((first.imported, first.duplicates), (3, 0))
+        balance = self.account.balance
+
+        again = self.run_import(path)
+        self.assertEqual((again.imported, again.duplicates), (0, 3))
+        self.assertEqual(self.account.balance, balance)
+        self.assertEqual(len(self.imported()), 3)
+
+    # A statement overlapping the last one only adds the rows that weren't imported yet
+    def test_overlapping_statement_adds_only_new_rows(self) -> None:
+        self.run_import(self.write_statement("first.csv", "2026-10-01,-12.50,Coffee,", "2026-10-02,2000.00,Salary,REF-1"))
+        second = self.run_import(self.write_statement("second.csv", "2026-10-02,2000.00,Salary,REF-1",
+                                                      "2026-10-01,-12.50,Coffee,", "2026-10-03,-40.00,Books,"))
+        self.assertEqual((second.imported, second.duplicates), (1, 2))
+        self.assertEqual([record["description"] for record in self.imported()], ["Coffee", "Salary", "Books"])
+
+if __name__ == "__main__":
+    unittest.main()
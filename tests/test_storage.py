@@ -0,0 +1,151 @@
+import unittest
+from unittest.mock import patch
+
+from support import DataFolderTestCase
+from modules.account import Account
+from modules.data_handler import DataHandler
+from modules.storage_backend import StorageBackend
+from modules.sqlite_backend import SQLiteStorageBackend
+from modules.transaction_types import TransactionTypes
+
+class DataFolderTest(DataFolderTestCase):
+
+    # Make writes to some accounts' journals fail, like a crash between the transfer record and its legs
+    def crash_writing_to(self, *accounts: Account):
+        backend = DataHandler.backend()
+        write_transaction = backend.write_transaction
+        crashed = {account.id for account in accounts}
+
+        def write(account, record: dict) -> None:
+            if account.id in crashed:
+                raise OSError("crashed")
+            write_transaction(account, record)
+        return patch.object(backend, "write_transaction", side_effect=write)
+
+    def journal(self, account: Account) -> list[dict]:
+        return list(DataHandler.read_transactions(account))
+
+class TransferRecoveryTest(DataFolderTest):
+
+    # A transfer whose record was written is finished on the next start, its missing leg included
+    def test_recover_writes_the_missing_leg(self) -> None:
+        source = Account.create_account("Source", 10000)
+        target = Account.create_account("Target")
+        Account.flush_profiles()
+
+        with self.crash_writing_to(target), self.assertRaises(OSError):
+            source.transfer(target, 2500)
+        self.assertEqual(self.journal(target), [])
+
+        self.restart()
+        source, target = Account.find_account("Source"), Account.find_account("Target")
+        self.assertEqual(source.balance, 7500)
+        self.assertEqual(target.balance, 2500)
+        received = self.journal(target)
+        self.assertEqual([TransactionTypes.from_record(record["type"]) for record in received], [TransactionTypes.RECEIVE])
+        self.assertEqual(received[0]["transfer_id"], self.journal(source)[-1]["transfer_id"])
+
+        # Nothing is written twice on the next start
+        self.assertEqual(DataHandler.recover(), 0)
+        self.assertEqual(len(self.journal(target)), 1)
+
+class BulkTransferTest(DataFolderTest):
+
+    # Nothing moves unless every leg can
+    def test_rejected_batch_moves_nothing(self) -> None:
+        payer = Account.create_account("Payer", 1000)
+        first, second = Account.create_account("First"), Account.create_account("Second")
+
+        success, _ = payer.bulk_transfer([(first, 600), (second, 600)])
+        self.assertFalse(success)
+        self.assertEqual((payer.balance, first.balance, second.balance), (1000, 0, 0))
+        self.assertEqual(self.journal(first) + self.journal(second), [])
+
+        success, _ = payer.bulk_transfer([(first, 600), (second, 400)])
+        self.assertTrue(success)
+        self.assertEqual((payer.balance, first.balance, second.balance), (0, 600, 400))
+
+    # Collecting checks every account the money comes from before taking any of it
+    def test_rejected_collection_moves_nothing(self) -> None:
+        collector = Account.create_account("Collector")
+        first, second = Account.create_account("First", 500), Account.create_account("Second", 100)
+
+        success, _ = collector.bulk_transfer([(first, 200), (second, 200)], collect=True)
+        self.assertFalse(success)
+        self.assertEqual((collector.balance, first.balance, second.balance), (0, 500, 100))
+
+    # The batch is one commit, a crash halfway through is finished on the next start
+    def test_crashed_batch_is_finished_on_restart(self) -> None:
+        payer = Account.create_account("Payer", 1000)
+        first, second = Account.create_account("First"), Account.create_account("Second")
+        Account.flush_profiles()
+
+        with self.crash_writing_to(second), self.assertRaises(OSError):
+            payer.bulk_transfer([(first, 300), (second, 200), (second, 100)])
+
+        self.restart()
+        payer, first, second = (Account.find_account(name) for name in ("Payer", "First", "Second"))
+        self.assertEqual((payer.balance, first.balance, second.balance), (400, 300, 300))
+        self.assertEqual(len(self.journal(second)), 2)
+        self.assertEqual(len({record["transfer_id"] for record in self.journal(payer)[1:]}), 1)
+
+class CheckpointTest(DataFolderTest):
+
+    # Balances come from the checkpoint plus the transactions after it, not from profiles written behind
+    def test_replay_after_checkpoint(self) -> None:
+        account = Account.create_account("Savings", 1000)
+        account.deposit(500, True)
+        checkpoint = Account.checkpoint(force=True)
+        self.assertEqual(checkpoint["balances"][account.id], 1500)
+
+        account.deposit(250, True)
+        account.withdraw(100, True)
+        self.restart()
+
+        account = Account.find_account("Savings")
+        self.assertEqual(account.balance, 1650)
+        self.assertEqual(DataHandler.latest_checkpoint(), checkpoint)
+        self.assertEqual(DataHandler.replay_balance(account, 1500, checkpoint["timestamp"]), (1650, 1650, 2))
+
+    # An account created after the checkpoint gets its balance from its last transaction
+    def test_account_created_after_checkpoint(self) -> None:
+        Account.create_account("Old", 100)
+        Account.checkpoint(force=True)
+        Account.create_account("New", 700).withdraw(200, True)
+        self.restart()
+
+        self.assertEqual(Account.find_account("Old").balance, 100)
+        self.assertEqual(Account.find_account("New").balance, 500)
+
+class SQLiteMigrationTest(DataFolderTest):
+
+    # Every account, profile and transaction is copied, and the app runs on the copy
+    def test_migrate_json_to_sqlite(self) -> None:
+        first = Account.create_account("First", 5000)
+        second = Account.create_account("Second", 1000)
+        first.transfer(second, 1500)
+        second.withdraw(300, True, description="Groceries")
+        Account.flush_profiles()
+        DataHandler.flush()
+
+        source = DataHandler.backend()
+        target = SQLiteStorageBackend()
+        self.assertEqual(StorageBackend.migrate(source, target), (2, 5))
+
+        accounts = {profile["id"]: profile for profile in target.read_account_profiles()}
+        self.assertEqual({profile["name"] for profile in accounts.values()}, {"First", "Second"})
+        for account in (first, second):
+            copied = StorageBackend.profile_account(accounts[account.id])
+            self.assertEqual(copied.balance, account.balance)
+            self.assertEqual([record["id"] for record in target.read_transactions(copied)],
+                             [record["id"] for record in source.read_transactions(account)])
+        self.assertEqual(target.get_accounts_list()["account_id_counter"], source.get_accounts_list()["account_id_counter"])
+
+        DataHandler.use_backend(target)
+        Account.load_accounts()
+        self.assertEqual(Account.find_account("First").balance, 3500)
+        self.assertEqual(Account.find_account("Second").balance, 2200)
+        self.assertEqual(DataHandler.last_transaction(Account.find_account("Second"))["description"], "Groceries")
+
+if __name__ == "__main__":
+    unittest.main()